@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Архив дампов кластера: один файл с блоками, сжатыми независимо (gzip-члены или кадры zstd), и индекс
+<архив>.index с экстентами каждого члена. Таблица извлекается чтением только своих экстентов.
+Извлечение таблицы: archive.py <архив> <db.table> [-o файл]
+"""
+
+import os
+import sys
+import json
+import zlib
+import fcntl
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from mysqlconf import ARCHIVE_CODEC, ARCHIVE_BLOCK_SIZE, ARCHIVE_THREADS, ARCHIVE_ZSTD_LEVEL, STREAM_COMPRESS_LEVEL
+
+# zstandard - необязательная зависимость, без нее архив сжимается gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Блок отдельных функций
+def archive_codec(codec=ARCHIVE_CODEC):
+    """ Используемый способ сжатия: zstd только при установленном zstandard """
+    return 'zstd' if codec == 'zstd' and zstandard is not None else 'gzip'
+
+def compress_block(data, codec):
+    """ Сжатие блока в самостоятельный gzip-член или кадр zstd (zlib и zstandard отпускают GIL) """
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).compress(data)
+    compressor = zlib.compressobj(STREAM_COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+def decompress_block(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data, 31)
+
+def index_path(archive_path):
+    return f"{archive_path}.index"
+
+def create_archive(archive_path, keep=False):
+    """
+    Создание пустого архива кластера (архив и индекс прошлого запуска удаляются).
+    keep - продолжение прерванного запуска: члены уже снятых дампов остаются в архиве
+    """
+    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+    if os.path.exists(index_path(archive_path)):
+        os.remove(index_path(archive_path))
+    with open(archive_path, 'ab' if keep else 'wb'):
+        pass
+    return archive_path
+
+def write_index(archive_path, members):
+    """
+    Запись индекса архива по описаниям членов (Member_writer.close): члены по имени и списки членов каждой таблицы
+    (диапазоны крупной таблицы - по порядку, у пачки мелких таблиц один общий член)
+    """
+    index = {'archive': os.path.basename(archive_path), 'members': {}, 'tables': {}}
+    for member in sorted(members, key=lambda member: (member['db'], member['tables'][0], member.get('chunk', 0))):
+        index['members'][member['name']] = member
+        for table in member['tables']:
+            index['tables'].setdefault(f"{member['db']}.{table}", []).append(member['name'])
+    with open(f"{index_path(archive_path)}.tmp", 'w', encoding='utf-8') as index_file:
+        json.dump(index, index_file, ensure_ascii=False, separators=(',', ':'))
+    os.replace(f"{index_path(archive_path)}.tmp", index_path(archive_path))
+    return index
+
+def read_index(archive_path):
+    with open(index_path(archive_path), 'r', encoding='utf-8') as index_file:
+        return json.load(index_file)
+
+def extract_table(archive_path, table, output):
+    """ Извлечение дампа таблицы 'db.table' в двоичный поток output с проверкой crc32 каждого члена """
+    index = read_index(archive_path)
+    if table not in index['tables']:
+        raise KeyError(f"Table {table} not found in {archive_path}")
+    with open(archive_path, 'rb') as archive_file:
+        for name in index['tables'][table]:
+            member, checksum = index['members'][name], 0
+            for offset, length, size in member['extents']:
+                archive_file.seek(offset)
+                data = decompress_block(archive_file.read(length), member['codec'])
+                checksum = zlib.crc32(data, checksum)
+                output.write(data)
+            if checksum != member['crc32']:
+                raise ValueError(f"Member {name} of {archive_path} is corrupted: crc32 mismatch")
+    return True
+
+
+class Member_writer:
+    """
+    Класс записи одного члена архива (дамп задачи) по мере получения потока: блоки по block_size сжимаются
+    параллельно в threads потоках и дописываются в общий архив кластера под flock, поэтому несколько процессов
+    пишут в архив одновременно. Очередь сжатия ограничена (2 * threads блоков). close() возвращает описание члена
+    с экстентами [смещение, длина сжатого блока, размер исходного блока]
+    """
+    def __init__(self, archive_path, name, codec=None, threads=ARCHIVE_THREADS, block_size=ARCHIVE_BLOCK_SIZE):
+        self.name = name
+        self.codec = codec or archive_codec()
+        self.threads = threads
+        self.block_size = block_size
+        self.fd = os.open(archive_path, os.O_WRONLY | os.O_APPEND)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.extents = []
+        self.size = 0
+        self.crc32 = 0
+
+    def write(self, data):
+        self.size += len(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+
+    def submit(self, block):
+        self.pending.append((len(block), self.executor.submit(compress_block, block, self.codec)))
+        while len(self.pending) > 2 * self.threads:
+            self.append_block()
+
+    def append_block(self):
+        """ Дозапись очередного сжатого блока (по порядку) в конец архива """
+        size, future = self.pending.popleft()
+        data = memoryview(future.result())
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            offset = os.lseek(self.fd, 0, os.SEEK_END)
+            length = len(data)
+            while data:
+                data = data[os.write(self.fd, data):]
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.extents.append([offset, length, size])
+
+    def close(self):
+        try:
+            if self.buffer:
+                self.submit(bytes(self.buffer))
+                self.buffer.clear()
+            while self.pending:
+                self.append_block()
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+            os.close(self.fd)
+        return {'name': self.name, 'codec': self.codec, 'size': self.size, 'crc32': self.crc32, 'extents': self.extents}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract one table dump from a cluster dump archive")
+    parser.add_argument('archive')
+    parser.add_argument('table', help="db.table")
+    parser.add_argument('-o', '--output', help="output file, default stdout")
+    args = parser.parse_args()
+    if args.output:
+        with open(args.output, 'wb') as output:
+            extract_table(args.archive, args.table, output)
+    else:
+        extract_table(args.archive, args.table, sys.stdout.buffer)
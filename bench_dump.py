@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Воспроизводимый бенчмарк стратегий снятия дампа (serial, pool, threads, asyncio, batched)
+на синтетической схеме: заглушка mysqldump (по умолчанию) или временный локальный mysqld (--socket).
+Результаты - JSON lines: пропускная способность, p50/p99 времени задачи, загрузка CPU
+"""
+
+import os
+import sys
+import json
+import time
+import shlex
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from models import tasks_scheduling
+
+STRATEGIES = ['serial', 'pool', 'threads', 'asyncio', 'batched']
+PARAMETRS = ["--no-create-info", "--single-transaction", "--skip-triggers", "--compact", "--complete-insert"]
+
+# Заглушка mysqldump: время работы пропорционально размеру таблиц, в stdout пишется столько же байт
+STUB_SOURCE = '''#!/usr/bin/env python3
+import sys, json, time
+schema = json.load(open(sys.argv[1]))
+rate, overhead = float(sys.argv[2]), float(sys.argv[3])
+args = sys.argv[4:]
+db = [arg for arg in args if not arg.startswith('-')][0]
+tables = args[args.index('--tables') + 1:] if '--tables' in args else []
+size = sum(schema[db][table]['size'] for table in tables if not table.startswith('-'))
+time.sleep(overhead + size / rate)
+line = b"INSERT INTO `t` VALUES (1,'" + b"x" * 1000 + b"');\\n"
+for _ in range(size // len(line)):
+    sys.stdout.buffer.write(line)
+'''
+
+# Блок отдельных функций
+def synthetic_schema(tables, total_size, skew, row_width, seed=0):
+    """
+    Синтетическая схема {db: {table: {'size', 'rows'}}}: размеры по закону Ципфа с показателем skew
+    (0 - все таблицы одинаковые), суммарный размер total_size байт, ширина строки row_width байт
+    """
+    weights = [1 / (i + 1) ** skew for i in range(tables)]
+    random.Random(seed).shuffle(weights)
+    schema = {}
+    for i, weight in enumerate(weights):
+        size = max(row_width, int(total_size * weight / sum(weights)))
+        schema.setdefault('bench', {})[f"t{i:05d}"] = {'size': size, 'rows': size // row_width}
+    return schema
+
+def create_schema_in_mysqld(schema, socket, row_width):
+    """ Создание синтетической схемы во временном локальном mysqld (MySQL 8.0, рекурсивный CTE) """
+    for db, tables in schema.items():
+        statements = [f"CREATE DATABASE IF NOT EXISTS `{db}`;", f"USE `{db}`;", "SET SESSION cte_max_recursion_depth = 100000000;"]
+        for table, info in tables.items():
+            statements.append(f"DROP TABLE IF EXISTS `{table}`;")
+            statements.append(f"CREATE TABLE `{table}` (id BIGINT AUTO_INCREMENT PRIMARY KEY, payload VARCHAR({row_width})) ENGINE=InnoDB;")
+            statements.append(f"INSERT INTO `{table}` (payload) WITH RECURSIVE seq AS (SELECT 1 AS n UNION ALL "
+                              f"SELECT n + 1 FROM seq WHERE n < {info['rows']}) SELECT REPEAT('x', {row_width}) FROM seq;")
+        subprocess.run(["mysql", f"--socket={socket}"], input='\n'.join(statements), text=True, check=True)
+
+def run_task(command):
+    """ Запуск одной команды дампа, возвращает время выполнения """
+    start = time.perf_counter()
+    subprocess.run(["bash", "-c", command], stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+async def run_task_async(command, semaphore):
+    async with semaphore:
+        start = time.perf_counter()
+        process = await asyncio.create_subprocess_shell(command, stdout=asyncio.subprocess.DEVNULL)
+        if await process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+        return time.perf_counter() - start
+
+async def run_asyncio(commands, workers):
+    semaphore = asyncio.Semaphore(workers)
+    return await asyncio.gather(*(run_task_async(command, semaphore) for command in commands))
+
+def run_strategy(strategy, commands, workers):
+    """ Выполнение команд выбранной стратегией, возвращает список времен выполнения задач """
+    if strategy == 'serial':
+        return [run_task(command) for command in commands]
+    if strategy in ('pool', 'batched'):
+        with multiprocessing.Pool(processes=workers) as pool:
+            return list(pool.imap_unordered(run_task, commands, chunksize=1))
+    if strategy == 'threads':
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(run_task, commands))
+    if strategy == 'asyncio':
+        return asyncio.run(run_asyncio(commands, workers))
+    raise ValueError(f"Unknown strategy: {strategy}")
+
+def build_commands(strategy, schema, dump_cmd):
+    """
+    Команды дампа: batched - задачи tasks_scheduling (крупные первыми, мелкие пачками),
+    остальные стратегии - по одной таблице в алфавитном порядке, как tasks_building
+    """
+    if strategy == 'batched':
+        tasks = tasks_scheduling(schema, PARAMETRS, result_file=False)
+    else:
+        tasks = [{'db': db, 'tables': [table], 'size': info['size'],
+                  'command': f"mysqldump {' '.join(PARAMETRS)} {shlex.quote(db)} --tables {shlex.quote(table)}"}
+                 for db, tables in schema.items() for table, info in sorted(tables.items())]
+    return [dump_cmd + task['command'][len('mysqldump'):] for task in tasks], tasks
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] if ordered else 0
+
+def benchmark(strategy, workers, schema, dump_cmd):
+    """ Один замер: стратегия x количество исполнителей """
+    commands, tasks = build_commands(strategy, schema, dump_cmd)
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    durations = run_strategy(strategy, commands, workers)
+    wall = time.perf_counter() - start
+    usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    tables = sum(len(task['tables']) for task in tasks)
+    total_size = sum(task['size'] for task in tasks)
+    return {
+        'strategy': strategy,
+        'workers': 1 if strategy == 'serial' else workers,
+        'tasks': len(tasks),
+        'tables': tables,
+        'wall': round(wall, 3),
+        'tables_per_s': round(tables / wall, 2),
+        'bytes_per_s': round(total_size / wall),
+        'p50': round(percentile(durations, 0.5), 4),
+        'p99': round(percentile(durations, 0.99), 4),
+        'cpu': round(cpu, 3),
+        'cpu_utilization': round(cpu / wall, 3),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of dump strategies on a synthetic schema")
+    parser.add_argument('--tables', type=int, default=950)
+    parser.add_argument('--total-size', type=int, default=512 * 1024 * 1024, help="total schema size, bytes")
+    parser.add_argument('--skew', type=float, default=1.2, help="Zipf exponent of table sizes, 0 - uniform")
+    parser.add_argument('--row-width', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--strategies', default=','.join(STRATEGIES))
+    parser.add_argument('--workers', default='1,2,4,8,20')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--socket', help="socket of a throwaway local mysqld; without it a mysqldump stub is used")
+    parser.add_argument('--stub-rate', type=float, default=200 * 1024 * 1024, help="stub throughput, bytes/s")
+    parser.add_argument('--stub-overhead', type=float, default=0.02, help="stub fixed cost per process, s")
+    parser.add_argument('--output', help="file to append JSON lines to, default stdout")
+    args = parser.parse_args()
+
+    schema = synthetic_schema(args.tables, args.total_size, args.skew, args.row_width, args.seed)
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.socket:
+            create_schema_in_mysqld(schema, args.socket, args.row_width)
+            dump_cmd = f"mysqldump --socket={shlex.quote(args.socket)}"
+        else:
+            schema_path = os.path.join(work_dir, 'schema.json')
+            stub_path = os.path.join(work_dir, 'mysqldump_stub')
+            with open(schema_path, 'w') as schema_file:
+                json.dump(schema, schema_file)
+            with open(stub_path, 'w') as stub_file:
+                stub_file.write(STUB_SOURCE)
+            dump_cmd = f"{shlex.quote(sys.executable)} {stub_path} {schema_path} {args.stub_rate} {args.stub_overhead}"
+
+        output = open(args.output, 'a') if args.output else sys.stdout
+        shape = {'schema_tables': args.tables, 'total_size': args.total_size, 'skew': args.skew,
+                 'row_width': args.row_width, 'engine': 'mysqld' if args.socket else 'stub'}
+        for strategy in args.strategies.split(','):
+            for workers in [1] if strategy == 'serial' else [int(value) for value in args.workers.split(',')]:
+                for run in range(args.repeat):
+                    result = dict(shape, run=run, **benchmark(strategy, workers, schema, dump_cmd))
+                    output.write(json.dumps(result) + '\n')
+                    output.flush()
+        if output is not sys.stdout:
+            output.close()
@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import math
+from concurrent.futures import ThreadPoolExecutor
+from models import quote_identifier
+from mysqlconf import STATS_DIR, CHECKSUM_CONCURRENCY, CHECKSUM_VERIFY_SHARE, CHUNKED_TABLE_SIZE, TABLE_CHUNKS
+
+# Блок отдельных функций
+def manifest_path(cluster_name, manifest_dir=None):
+    """ Путь к файлу манифеста контрольных сумм кластера """
+    return os.path.join(manifest_dir or os.path.join(STATS_DIR, 'manifests'), f"{cluster_name}.json")
+
+def load_manifest(file_path):
+    """ Чтение манифеста, если файла нет - возвращается None """
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, 'r', encoding='utf-8') as manifest_file:
+        return json.load(manifest_file)
+
+def save_manifest(file_path, manifest):
+    """ Запись манифеста через временный файл, чтобы не оставить его частично записанным """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(f"{file_path}.tmp", 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False, separators=(',', ':'))
+    os.replace(f"{file_path}.tmp", file_path)
+    return True
+
+def checksum_sql(db, table, columns, where=None):
+    """
+    Запрос агрегированной контрольной суммы: количество строк и BIT_XOR от CRC32 каждой строки.
+    Признаки NULL добавляются отдельно, чтобы NULL и пустая строка давали разные суммы
+    """
+    quoted = [quote_identifier(column) for column in columns]
+    row = f"CONCAT_WS('#', {', '.join(quoted)}, CONCAT({', '.join(f'ISNULL({column})' for column in quoted)}))"
+    sql = f"SELECT COUNT(*), COALESCE(BIT_XOR(CRC32({row})), 0) FROM {quote_identifier(db)}.{quote_identifier(table)}"
+    if where:
+        sql += f" WHERE {where}"
+    return sql + ";"
+
+def diff_manifests(previous, current, strict=False):
+    """
+    Сравнение манифестов, возвращает {'db.table': {'status': ..., 'chunks': [номера отличающихся диапазонов]}}.
+    Статусы: unchanged, grown (строк стало больше), changed (изменились и данные, и метаданные),
+    corrupt (данные отличаются при неизменных метаданных - у таблиц, пересчитанных по ротации verify_share), new, missing.
+    strict=True - сравнение с манифестом источника: любое отличие данных считается повреждением
+    """
+    report = {}
+    previous_tables = previous['tables'] if previous else {}
+    for key in sorted(set(previous_tables) | set(current['tables'])):
+        old, new = previous_tables.get(key), current['tables'].get(key)
+        if old is None:
+            report[key] = {'status': 'new'}
+            continue
+        if new is None:
+            report[key] = {'status': 'missing'}
+            continue
+        if (old['rows'], old['checksum']) == (new['rows'], new['checksum']):
+            report[key] = {'status': 'unchanged'}
+            continue
+        if strict or old['meta'] == new['meta']:
+            status = 'corrupt'
+        elif new['rows'] > old['rows']:
+            status = 'grown'
+        else:
+            status = 'changed'
+        chunks = [i for i, (old_chunk, new_chunk) in enumerate(zip(old.get('chunks', []), new.get('chunks', [])))
+                  if old_chunk['where'] == new_chunk['where'] and old_chunk != new_chunk]
+        report[key] = {'status': status, 'chunks': chunks}
+    return report
+
+
+class Checksum_engine:
+    """
+    Класс расчета контрольных сумм таблиц восстановленного экземпляра (через MySQL_cluster.run_sql).
+    Таблицы больше CHUNKED_TABLE_SIZE считаются по диапазонам ключа, одновременно выполняется не более concurrency запросов.
+    Таблица с неизменными метаданными относительно предыдущего манифеста не пересчитывается, кроме доли verify_share
+    давно не проверявшихся: у них отличие данных при тех же метаданных выявляется как повреждение.
+    inventory - опись кластера (inventory.Inventory), тогда метаданные, колонки и ключи не запрашиваются повторно
+    """
+    def __init__(self, cluster_instance, concurrency=CHECKSUM_CONCURRENCY, chunks=TABLE_CHUNKS, inventory=None,
+                 verify_share=CHECKSUM_VERIFY_SHARE):
+        self.cluster_instance = cluster_instance
+        self.inventory = inventory
+        self.concurrency = concurrency
+        self.chunks = chunks
+        self.verify_share = verify_share
+
+    def tables_columns(self):
+        """ Колонки таблиц в порядке следования, в виде {'db.table': [columns]} """
+        sql = "SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS \
+        WHERE TABLE_SCHEMA NOT IN ('information_schema', 'mysql', 'performance_schema', 'sys') \
+        ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION;"
+        columns = {}
+        for db, table, column in self.cluster_instance.run_sql(sql, timeout=300):
+            columns.setdefault(f"{db}.{table}", []).append(column)
+        return columns
+
+    def checksum(self, db, table, columns, where=None):
+        """ Контрольная сумма таблицы или диапазона: {'rows', 'checksum'} """
+        rows, checksum = self.cluster_instance.run_sql(checksum_sql(db, table, columns, where), timeout=None)[0]
+        return {'rows': int(rows), 'checksum': int(checksum)}
+
+    def build_manifest(self, previous=None):
+        """
+        Расчет манифеста кластера. Записи таблиц с теми же метаданными, что и в previous, переносятся без пересчета,
+        кроме доли verify_share с самой давней проверкой ('verified')
+        """
+        if self.inventory is not None and self.inventory.live:
+            metadata, columns = self.inventory.metadata(), self.inventory.columns()
+        else:
+            metadata, columns = self.cluster_instance.get_tables_metadata(), self.tables_columns()
+        previous_tables = previous['tables'] if previous else {}
+        manifest = {'cluster': self.cluster_instance.cluster_name, 'created': int(time.time()), 'tables': {}}
+        unchanged = sorted((key for key, meta in metadata.items() if key in previous_tables and previous_tables[key]['meta'] == meta),
+                           key=lambda key: previous_tables[key].get('verified', 0))
+        reverified = set(unchanged[:math.ceil(len(unchanged) * self.verify_share)])
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {}
+            for key, meta in metadata.items():
+                old = previous_tables.get(key)
+                if old is not None and old['meta'] == meta and key not in reverified:
+                    manifest['tables'][key] = dict(old, skipped=True)
+                    continue
+                conditions = []
+                if meta['size'] >= CHUNKED_TABLE_SIZE:
+                    chunk_column = self.inventory.chunk_key(meta['db'], meta['table']) if self.inventory is not None else False
+                    conditions = self.cluster_instance.get_table_chunks(meta['db'], meta['table'], self.chunks, chunk_column)
+                futures[key] = (conditions, [executor.submit(self.checksum, meta['db'], meta['table'], columns[key], where)
+                                             for where in conditions or [None]])
+            for key, (conditions, parts) in futures.items():
+                results = [part.result() for part in parts]
+                entry = {'meta': metadata[key], 'verified': manifest['created'],
+                         'rows': sum(result['rows'] for result in results), 'checksum': 0}
+                for result in results:
+                    entry['checksum'] ^= result['checksum']
+                if conditions:
+                    entry['chunks'] = [dict(result, where=where) for where, result in zip(conditions, results)]
+                manifest['tables'][key] = entry
+        return manifest
@@ -0,0 +1,222 @@
+import os
+import signal
+import asyncio
+import logging
+import threading
+import subprocess
+from collections import deque
+from mysqlconf import COMMAND_OUTPUT_LOG_LEVEL, COMMAND_KILL_GRACE, READINESS_PROBE_INTERVAL
+
+STDERR_TAIL_LINES = 200 # строк stderr, сохраняемых для текста ошибки
+READ_SIZE = 1024 * 1024
+LINE_LIMIT = 16 * 1024 * 1024 # максимальная длина строки вывода, которая пишется в лог
+
+# Блок отдельных функций
+def sudo_bash(command, user=None):
+    """ Аргументы запуска строки оболочки через sudo (от root или от user) """
+    return ["sudo"] + (["-u", user] if user else []) + ["bash", "-c", command]
+
+def command_label(args):
+    """ Имя программы для строк лога: для sudo [-u user] bash -c '...' - первое слово строки оболочки """
+    args = list(args)
+    if args[0] == "sudo":
+        args = args[3:] if args[1] == "-u" else args[1:]
+    if args[:2] == ["bash", "-c"]:
+        return args[2].split()[0]
+    return os.path.basename(args[0])
+
+async def pump(stream, label, sink=None, tail=None, on_line=None):
+    """
+    Построчное чтение потока процесса по мере поступления: строки пишутся в лог (уровень COMMAND_OUTPUT_LOG_LEVEL),
+    в sink (список) и в tail (хвост для текста ошибки), on_line() вызывается на каждую строку (признак хода команды)
+    """
+    level = logging.getLevelName(COMMAND_OUTPUT_LOG_LEVEL)
+    if label is None and tail is None:
+        # только сбор вывода: строки не нужны, читается порциями (строка результата может быть больше лимита readline)
+        while True:
+            chunk = await stream.read(READ_SIZE)
+            if not chunk:
+                break
+            sink.append(chunk)
+        return
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        if sink is not None:
+            sink.append(line)
+        if on_line is not None:
+            on_line()
+        text = line.decode(errors='replace').rstrip('\n')
+        if tail is not None:
+            tail.append(text)
+        if label is not None:
+            logging.log(level, f"[{label}] {text}")
+
+async def terminate(process):
+    """ Остановка процесса и его группы (SIGTERM, через COMMAND_KILL_GRACE секунд - SIGKILL) """
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        if process.returncode is not None:
+            return
+        try:
+            os.killpg(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            # sudo пересылает SIGTERM дочернему процессу, SIGKILL - только самому sudo
+            try:
+                process.send_signal(sig)
+            except ProcessLookupError:
+                return
+        try:
+            await asyncio.wait_for(process.wait(), COMMAND_KILL_GRACE)
+        except asyncio.TimeoutError:
+            continue
+
+def stop_process_group(process, grace=COMMAND_KILL_GRACE):
+    """ Синхронный вариант terminate для subprocess.Popen (процесс запущен с start_new_session=True) """
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        if process.poll() is not None:
+            return
+        try:
+            os.killpg(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            # sudo пересылает SIGTERM дочернему процессу, SIGKILL - только самому sudo
+            try:
+                process.send_signal(sig)
+            except ProcessLookupError:
+                return
+        try:
+            process.wait(grace)
+        except subprocess.TimeoutExpired:
+            continue
+
+async def run_command_async(args, deadline=None, check=True, capture=True, stdout=None, label=None, on_line=None):
+    """
+    Асинхронный запуск команды (список аргументов) с ограничением времени deadline (секунды, None - без ограничения).
+    stdout собирается (capture), пишется в файл stdout или в лог; stderr всегда читается одновременно с stdout и пишется в лог.
+    При превышении deadline или отмене задачи процесс со всей группой завершается, deadline - subprocess.TimeoutExpired.
+    on_line - функция без аргументов, вызываемая на каждую строку вывода (см. pump).
+    Возвращает subprocess.CompletedProcess (stdout - строка при capture), check - CalledProcessError при коде != 0
+    """
+    label = label or command_label(args)
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=stdout if stdout is not None else asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+        limit=LINE_LIMIT,
+    )
+    output, tail = [], deque(maxlen=STDERR_TAIL_LINES)
+    readers = [pump(process.stderr, label, tail=tail, on_line=on_line)]
+    if stdout is None:
+        readers.append(pump(process.stdout, None if capture else label, sink=output if capture else None,
+                            on_line=None if capture else on_line))
+    try:
+        await asyncio.wait_for(asyncio.gather(*readers, process.wait()), deadline)
+    except asyncio.TimeoutError:
+        await terminate(process)
+        raise subprocess.TimeoutExpired(args, deadline, stderr='\n'.join(tail))
+    except asyncio.CancelledError:
+        await terminate(process)
+        raise
+    result = subprocess.CompletedProcess(args, process.returncode,
+                                         b''.join(output).decode(errors='replace') if capture else None, '\n'.join(tail))
+    if check and result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, args, output=result.stdout, stderr=result.stderr)
+    return result
+
+def iter_command_lines(args, deadline=None, label=None):
+    """
+    Построчное чтение stdout команды по мере вывода (генератор строк без перевода строки), весь вывод в памяти
+    не собирается. stderr пишется в лог. При превышении deadline - subprocess.TimeoutExpired, при коде != 0 -
+    CalledProcessError. Если потребитель прекратил чтение, процесс со всей группой завершается
+    """
+    label = label or command_label(args)
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    tail = deque(maxlen=STDERR_TAIL_LINES)
+    level = logging.getLevelName(COMMAND_OUTPUT_LOG_LEVEL)
+
+    def read_stderr():
+        for line in process.stderr:
+            text = line.decode(errors='replace').rstrip('\n')
+            tail.append(text)
+            logging.log(level, f"[{label}] {text}")
+
+    def kill():
+        timed_out.append(True)
+        stop_process_group(process)
+
+    timed_out = []
+    stderr_reader = threading.Thread(target=read_stderr, daemon=True)
+    stderr_reader.start()
+    killer = threading.Timer(deadline, kill) if deadline is not None else None
+    if killer is not None:
+        killer.start()
+    try:
+        for line in process.stdout:
+            yield line.decode(errors='replace').rstrip('\n')
+        process.wait()
+    finally:
+        if killer is not None:
+            killer.cancel()
+        if process.poll() is None:
+            # генератор закрыт до конца вывода
+            kill()
+            timed_out.clear()
+            process.wait()
+        process.stdout.close()
+        stderr_reader.join()
+    if timed_out:
+        raise subprocess.TimeoutExpired(args, deadline, stderr='\n'.join(tail))
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args, stderr='\n'.join(tail))
+
+async def iter_command_lines_async(args, label=None):
+    """ Асинхронный вариант iter_command_lines (без ограничения времени) """
+    label = label or command_label(args)
+    process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                   start_new_session=True, limit=LINE_LIMIT)
+    tail = deque(maxlen=STDERR_TAIL_LINES)
+    stderr_reader = asyncio.create_task(pump(process.stderr, label, tail=tail))
+    try:
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            yield line.decode(errors='replace').rstrip('\n')
+        await process.wait()
+    finally:
+        if process.returncode is None:
+            await terminate(process)
+        await stderr_reader
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args, stderr='\n'.join(tail))
+
+def run_command(args, deadline=None, check=True, capture=True, stdout=None, label=None, on_line=None):
+    """ Синхронная обертка run_command_async для методов кластера (свой цикл событий в каждом потоке/процессе) """
+    return asyncio.run(run_command_async(args, deadline, check, capture, stdout, label, on_line))
+
+async def wait_ready_async(probe, deadline, interval=READINESS_PROBE_INTERVAL, description='condition'):
+    """
+    Ожидание, пока асинхронная проверка probe() не вернет True: опрос с интервалом interval вместо фиксированной паузы.
+    По истечении deadline - subprocess.TimeoutExpired
+    """
+    loop = asyncio.get_running_loop()
+    until = loop.time() + deadline
+    while not await probe():
+        if loop.time() > until:
+            raise subprocess.TimeoutExpired(description, deadline)
+        await asyncio.sleep(interval)
+    return True
+
+def wait_ready(probe, deadline, interval=READINESS_PROBE_INTERVAL, description='condition'):
+    return asyncio.run(wait_ready_async(probe, deadline, interval, description))
+
+async def socket_accepts(path):
+    """ Проверка, принимает ли unix-сокет подключения """
+    try:
+        reader, writer = await asyncio.open_unix_connection(path)
+    except OSError:
+        return False
+    writer.close()
+    await writer.wait_closed()
+    return True
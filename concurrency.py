@@ -0,0 +1,188 @@
+import os
+import time
+import heapq
+import queue
+import itertools
+import threading
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from mysqlconf import CONCURRENCY_MIN, CONCURRENCY_MAX, CONCURRENCY_INTERVAL, CONCURRENCY_IOWAIT_LIMIT
+from mysqlconf import CONCURRENCY_THREADS_RUNNING_FACTOR, CONCURRENCY_LOAD_FACTOR
+
+# Блок отдельных функций
+def cpu_times():
+    """ Суммарное время CPU и время iowait из /proc/stat (в тиках) """
+    with open('/proc/stat', 'r') as stat_file:
+        values = [int(value) for value in stat_file.readline().split()[1:]]
+    return sum(values), values[4]
+
+
+class Concurrency_controller:
+    """
+    Класс AIMD-регулятора количества одновременных дампов. Раз в interval секунд оценивается сглаженная
+    пропускная способность (байт завершенных задач в секунду) и признаки насыщения: iowait хоста,
+    Threads_running сервера, load average. При насыщении лимит уменьшается вдвое, иначе, если пропускная
+    способность не упала, увеличивается на единицу
+    """
+    def __init__(self, initial, cores, cluster_instance=None, min_limit=CONCURRENCY_MIN, max_limit=CONCURRENCY_MAX,
+                 interval=CONCURRENCY_INTERVAL, smoothing=0.3):
+        self.limit = max(min_limit, min(initial, max_limit))
+        self.cores = cores
+        self.cluster_instance = cluster_instance
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.interval = interval
+        self.smoothing = smoothing
+        self.throughput = None
+        self.completed_bytes = 0
+        self.last_time = time.monotonic()
+        self.last_cpu = cpu_times()
+
+    def completed(self, size):
+        """ Учет завершенной задачи размером size байт """
+        self.completed_bytes += size
+
+    def threads_running(self):
+        """ Threads_running восстановленного сервера, None если недоступно """
+        if self.cluster_instance is None:
+            return None
+        try:
+            return int(self.cluster_instance.run_sql("SHOW GLOBAL STATUS LIKE 'Threads_running';", timeout=10)[0][1])
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, IndexError, ValueError):
+            return None
+
+    def saturation(self):
+        """ Причина насыщения (строка) или None """
+        total, iowait = cpu_times()
+        delta_total = total - self.last_cpu[0]
+        iowait_share = (iowait - self.last_cpu[1]) / delta_total if delta_total else 0
+        self.last_cpu = (total, iowait)
+        if iowait_share > CONCURRENCY_IOWAIT_LIMIT:
+            return f"iowait {iowait_share:.2f}"
+        load = os.getloadavg()[0]
+        if load > self.cores * CONCURRENCY_LOAD_FACTOR:
+            return f"load average {load:.1f}"
+        threads_running = self.threads_running()
+        if threads_running is not None and threads_running > self.cores * CONCURRENCY_THREADS_RUNNING_FACTOR:
+            return f"Threads_running {threads_running}"
+        return None
+
+    def adjust(self):
+        """ Пересчет лимита, если прошел interval. Возвращает текущий лимит """
+        now = time.monotonic()
+        if now - self.last_time < self.interval:
+            return self.limit
+        current = self.completed_bytes / (now - self.last_time)
+        previous = self.throughput
+        self.throughput = current if previous is None else self.smoothing * current + (1 - self.smoothing) * previous
+        self.completed_bytes = 0
+        self.last_time = now
+        reason = self.saturation()
+        if reason is not None:
+            limit = max(self.min_limit, self.limit // 2)
+        elif previous is None or self.throughput >= previous * 0.95:
+            limit = min(self.max_limit, self.limit + 1)
+        else:
+            limit = self.limit
+        if limit != self.limit:
+            logging.info(f"Dump concurrency {self.limit} -> {limit}" + (f" ({reason})" if reason else ""))
+            self.limit = limit
+        return self.limit
+
+def run_adaptive(tasks, function, controller, completed=None, requeue=None):
+    """
+    Выполнение задач (см. tasks_scheduling) функцией function с количеством одновременных задач,
+    которое задает controller. Порядок выдачи задач сохраняется. Возвращает список (результат, метрики).
+    completed(результат, метрики) вызывается в основном потоке по завершении каждой задачи.
+    requeue(результат) - задача для повтора (выдается не раньше ее 'not_before') или None - результат окончательный
+    """
+    def timed(task):
+        start = time.perf_counter()
+        result = function(task)
+        metrics = {'wall': round(time.perf_counter() - start, 6), 'db': task['db'], 'tables': task['tables'],
+                   'size': task.get('size', 0)}
+        if 'chunk' in task:
+            metrics.update(chunk=task['chunk'], chunks=task['chunks'])
+        return result, metrics
+
+    results = []
+    pending = iter(tasks)
+    in_flight = {}
+    # задачи на повтор: (не раньше, порядковый номер, задача)
+    delayed, order = [], itertools.count()
+    exhausted = False
+    with ThreadPoolExecutor(max_workers=controller.max_limit) as executor:
+        while True:
+            while len(in_flight) < controller.limit:
+                if delayed and delayed[0][0] <= time.time():
+                    task = heapq.heappop(delayed)[2]
+                elif not exhausted:
+                    task = next(pending, None)
+                    if task is None:
+                        exhausted = True
+                        continue
+                else:
+                    break
+                in_flight[executor.submit(timed, task)] = task
+            if not in_flight:
+                if not delayed:
+                    break
+                # остались только задачи на повтор, пауза до ближайшей
+                time.sleep(min(controller.interval, max(0, delayed[0][0] - time.time())))
+                continue
+            done, _ = wait(in_flight, timeout=controller.interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = in_flight.pop(future)
+                retry = requeue(future.result()[0]) if requeue is not None else None
+                if retry is not None:
+                    heapq.heappush(delayed, (retry.get('not_before', 0), next(order), retry))
+                    continue
+                results.append(future.result())
+                if completed is not None:
+                    completed(*results[-1])
+                controller.completed(task['size'])
+            controller.adjust()
+    return results
+
+
+class Task_feed:
+    """
+    Источник задач для multiprocessing.Pool.imap_unordered с повторной постановкой: сначала задачи tasks (список
+    или генератор iter_tasks, читается по мере выдачи), затем задачи из requeue (не раньше их 'not_before'), пока у каждой
+    задачи не будет окончательного результата. Потребитель результатов вызывает requeue(задача) или finished() на каждый результат
+    """
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.outstanding = 0
+        self.exhausted = False
+        self.retries = queue.Queue()
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        for task in self.tasks:
+            with self.lock:
+                self.outstanding += 1
+            yield task
+        with self.lock:
+            self.exhausted = True
+            if not self.outstanding:
+                return
+        while True:
+            task = self.retries.get()
+            if task is None:
+                return
+            # пауза в потоке выдачи задач пула, процессы пула тем временем выполняют остальные задачи
+            delay = task.get('not_before', 0) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            yield task
+
+    def requeue(self, task):
+        self.retries.put(task)
+
+    def finished(self):
+        with self.lock:
+            self.outstanding -= 1
+            if self.outstanding == 0 and self.exhausted:
+                self.retries.put(None)
@@ -0,0 +1,132 @@
+import os
+import shutil
+import threading, queue
+import subprocess
+from mysqlconf import DECOMPRESS_THREADS, DECOMPRESS_QUEUE_SIZE
+
+# zstandard - необязательная зависимость, без нее .zst распаковываются утилитой zstd
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# утилиты распаковки в stdout: qpress -do (архив xtrabackup содержит один файл), zstd -dc, lz4 -dc
+DECOMPRESS_COMMANDS = {
+    '.qp': ['qpress', '-do'],
+    '.zst': ['zstd', '-dc', '-q'],
+    '.lz4': ['lz4', '-dc', '-q'],
+}
+BUFFER_SIZE = 1024 * 1024
+# интервал проверки, живы ли потоки распаковки, пока очередь заполнена (секунды)
+PUT_CHECK_INTERVAL = 1
+
+
+class Decompression_engine:
+    """
+    Класс потоковой распаковки сжатых файлов бэкапа (.qp/.zst) во время копирования: сжатый файл читается из бэкапа
+    один раз и сразу записывается распакованным в целевую директорию (сжатая копия не создается, xtrabackup --decompress
+    не нужен). Задания передаются через ограниченную очередь: при отставании распаковки копирующие потоки ждут,
+    поэтому одновременно в работе не больше threads + queue_size файлов. Распаковываются только файлы, для которых
+    есть способ распаковки (zstandard или утилита в PATH), остальные сжатые файлы копируются как есть
+    и распаковываются xtrabackup --decompress
+    """
+    def __init__(self, uid, gid, threads=DECOMPRESS_THREADS, queue_size=DECOMPRESS_QUEUE_SIZE):
+        self.uid = uid
+        self.gid = gid
+        self.threads = threads
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.workers = []
+        self.errors = []
+        self.lock = threading.Lock()
+        self.stats = {'files': 0, 'bytes_in': 0, 'bytes_out': 0, 'zstandard': 0, 'external': 0}
+        self.suffixes = tuple(suffix for suffix, command in DECOMPRESS_COMMANDS.items()
+                              if (suffix == '.zst' and zstandard is not None) or shutil.which(command[0]))
+
+    def compressed(self, path):
+        """ Сжат ли файл поддерживаемым способом (возвращает суффикс или None) """
+        for suffix in self.suffixes:
+            if path.endswith(suffix):
+                return suffix
+        return None
+
+    def start(self):
+        for _ in range(self.threads):
+            worker = threading.Thread(target=self.work, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        return self
+
+    def submit(self, source, target):
+        """ Постановка файла в очередь распаковки (блокируется, если очередь заполнена). target - путь со сжатым суффиксом """
+        if self.errors:
+            raise self.errors[0]
+        self.put((source, target[:-len(self.compressed(target))]))
+
+    def put(self, job):
+        """ Постановка в очередь с ожиданием места, пока жив хотя бы один поток распаковки """
+        while True:
+            try:
+                return self.jobs.put(job, timeout=PUT_CHECK_INTERVAL)
+            except queue.Full:
+                if not any(worker.is_alive() for worker in self.workers):
+                    raise self.errors[0] if self.errors else RuntimeError("All decompression threads have stopped")
+
+    def finish(self):
+        """ Ожидание распаковки всех файлов, первая ошибка распаковки пробрасывается. Возвращает статистику """
+        try:
+            for _ in self.workers:
+                self.put(None)
+        finally:
+            for worker in self.workers:
+                worker.join()
+            self.workers = []
+        if self.errors:
+            raise self.errors[0]
+        return self.stats
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if self.errors:
+                continue # после первой ошибки очередь только вычерпывается
+            try:
+                self.decompress_file(*job)
+            except Exception as e:
+                # любая ошибка (в том числе zstandard.ZstdError поврежденного файла) останавливает копирование кластера
+                with self.lock:
+                    self.errors.append(e)
+
+    def decompress_file(self, source, target):
+        """
+        Распаковка одного файла с установкой владельца, прав и времени модификации исходного файла.
+        Недораспакованный файл при ошибке удаляется, чтобы не остаться в директории данных и не мешать повтору
+        """
+        source_stat = os.stat(source)
+        suffix = self.compressed(source)
+        target_fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL, source_stat.st_mode & 0o7777)
+        try:
+            with open(target_fd, 'wb') as target_file:
+                os.fchown(target_file.fileno(), self.uid, self.gid)
+                if suffix == '.zst' and zstandard is not None:
+                    with open(source, 'rb') as source_file:
+                        zstandard.ZstdDecompressor().copy_stream(source_file, target_file, read_size=BUFFER_SIZE, write_size=BUFFER_SIZE)
+                    method = 'zstandard'
+                else:
+                    command = DECOMPRESS_COMMANDS[suffix] + [source]
+                    result = subprocess.run(command, stdout=target_file, stderr=subprocess.PIPE, text=True)
+                    if result.returncode != 0:
+                        raise subprocess.CalledProcessError(result.returncode, command, stderr=result.stderr)
+                    method = 'external'
+                target_file.flush()
+                size = os.fstat(target_file.fileno()).st_size
+            os.utime(target, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+        except BaseException:
+            os.unlink(target)
+            raise
+        with self.lock:
+            self.stats['files'] += 1
+            self.stats['bytes_in'] += source_stat.st_size
+            self.stats['bytes_out'] += size
+            self.stats[method] += 1
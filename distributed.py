@@ -0,0 +1,338 @@
+import os
+import hmac
+import json
+import time
+import fcntl
+import socket
+import ipaddress
+import sqlite3
+import logging
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from mysqlconf import STATS_DIR, COORDINATOR_ADDRESS, COORDINATOR_PORT, COORDINATOR_TOKEN, JOB_LEASE_SECONDS
+from mysqlconf import JOB_MAX_ATTEMPTS, AGENT_POLL_INTERVAL
+
+# Блок отдельных функций
+def agent_name():
+    """ Имя агента: хост и pid (на одном хосте может работать несколько агентов) """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def loopback(address):
+    """ Адрес доступен только с этого хоста """
+    try:
+        return address == 'localhost' or ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+def lock_agent(file_path=None):
+    """
+    Блокировка единственного агента хоста (агенты без MULTI_INSTANCE восстанавливают кластеры в общий MYSQL_DATA_DIR):
+    возвращает открытый файл блокировки, None - на хосте уже работает агент
+    """
+    file_path = file_path or os.path.join(STATS_DIR, 'validation_agent.lock')
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    lock_file = open(file_path, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    return lock_file
+
+
+class Job_queue:
+    """
+    Постоянная очередь заданий координатора (SQLite STATS_DIR/validation_queue.db): задание - кластер запуска.
+    Агент получает задание с арендой на lease секунд и продлевает ее, пока работает. Задание с истекшей арендой
+    (агент или хост упал) возвращается в очередь, после max_attempts выдач - помечается 'failed'
+    """
+    def __init__(self, file_path=None, lease=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        self.file_path = file_path or os.path.join(STATS_DIR, 'validation_queue.db')
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        self.connection = sqlite3.connect(self.file_path, timeout=30, check_same_thread=False)
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs (job_id INTEGER PRIMARY KEY AUTOINCREMENT, run_id INTEGER, cluster TEXT, "
+            "state TEXT, agent TEXT, lease_until REAL, attempts INTEGER DEFAULT 0, result TEXT, updated_at REAL);"
+            "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (run_id, state);"
+        )
+        self.connection.commit()
+        self.run_id = None
+
+    def close(self):
+        self.connection.close()
+
+    def start(self, cluster_names, resume=False):
+        """
+        Новый запуск: задания по кластерам в порядке cluster_names. resume - продолжение последнего запуска
+        с незавершенными заданиями (выданные задания возвращаются в очередь). Возвращает run_id
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT run_id FROM jobs WHERE state IN ('queued', 'leased') "
+                                          "ORDER BY run_id DESC LIMIT 1").fetchone() if resume else None
+            if row is not None:
+                self.run_id = row[0]
+                self.connection.execute("UPDATE jobs SET state = 'queued', agent = NULL WHERE run_id = ? AND state = 'leased'",
+                                        (self.run_id,))
+            else:
+                self.run_id = (self.connection.execute("SELECT MAX(run_id) FROM jobs").fetchone()[0] or 0) + 1
+                self.connection.executemany("INSERT INTO jobs (run_id, cluster, state, updated_at) VALUES (?, ?, 'queued', ?)",
+                                            [(self.run_id, cluster_name, time.time()) for cluster_name in cluster_names])
+            self.connection.commit()
+        return self.run_id
+
+    def requeue_expired(self):
+        """ Возврат в очередь заданий с истекшей арендой, возвращает список (кластер, агент, состояние) """
+        now = time.time()
+        with self.lock:
+            expired = self.connection.execute("SELECT job_id, cluster, agent, attempts FROM jobs "
+                                              "WHERE run_id = ? AND state = 'leased' AND lease_until < ?",
+                                              (self.run_id, now)).fetchall()
+            requeued = []
+            for job_id, cluster_name, agent, attempts in expired:
+                state = 'failed' if attempts >= self.max_attempts else 'queued'
+                result = json.dumps({'exit_code': 1, 'error': f"lease of agent {agent} expired"}) if state == 'failed' else None
+                self.connection.execute("UPDATE jobs SET state = ?, agent = NULL, result = ?, updated_at = ? WHERE job_id = ?",
+                                        (state, result, now, job_id))
+                requeued.append((cluster_name, agent, state))
+            self.connection.commit()
+        return requeued
+
+    def claim(self, agent):
+        """ Выдача следующего задания агенту с арендой, None - очередь пуста """
+        self.requeue_expired()
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT job_id, cluster, attempts FROM jobs WHERE run_id = ? AND state = 'queued' "
+                                          "ORDER BY job_id LIMIT 1", (self.run_id,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE jobs SET state = 'leased', agent = ?, lease_until = ?, attempts = attempts + 1, "
+                                    "updated_at = ? WHERE job_id = ?", (agent, now + self.lease, now, row[0]))
+            self.connection.commit()
+        return {'job_id': row[0], 'cluster': row[1], 'attempt': row[2] + 1, 'lease': self.lease}
+
+    def renew(self, job_id, agent):
+        """ Продление аренды, False - задание уже не принадлежит агенту (аренда истекла и задание выдано заново) """
+        with self.lock:
+            cursor = self.connection.execute("UPDATE jobs SET lease_until = ? WHERE job_id = ? AND agent = ? AND state = 'leased'",
+                                             (time.time() + self.lease, job_id, agent))
+            self.connection.commit()
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, agent, result):
+        """ Результат задания от агента (статистика validate_cluster), результат чужой аренды не принимается """
+        with self.lock:
+            cursor = self.connection.execute("UPDATE jobs SET state = 'done', result = ?, updated_at = ? "
+                                             "WHERE job_id = ? AND agent = ? AND state = 'leased'",
+                                             (json.dumps(result), time.time(), job_id, agent))
+            self.connection.commit()
+        return cursor.rowcount == 1
+
+    def status(self):
+        """ Задания запуска: [{'cluster', 'state', 'agent', 'attempts', 'result'}] """
+        with self.lock:
+            rows = self.connection.execute("SELECT cluster, state, agent, attempts, result FROM jobs WHERE run_id = ? ORDER BY job_id",
+                                           (self.run_id,)).fetchall()
+        return [{'cluster': row[0], 'state': row[1], 'agent': row[2], 'attempts': row[3],
+                 'result': json.loads(row[4]) if row[4] else None} for row in rows]
+
+    def finished(self):
+        return all(job['state'] in ('done', 'failed') for job in self.status())
+
+
+class Coordinator_handler(BaseHTTPRequestHandler):
+    """ HTTP API координатора (JSON): POST /claim, /renew, /complete; GET /status """
+    def send_json(self, code, content=None):
+        body = json.dumps(content).encode() if content is not None else b''
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        token = self.server.token
+        return token is None or hmac.compare_digest(self.headers.get('Authorization', '').encode(), f"Bearer {token}".encode())
+
+    def do_GET(self):
+        if not self.authorized():
+            return self.send_json(403)
+        if self.path != '/status':
+            return self.send_json(404)
+        self.send_json(200, {'run_id': self.server.queue.run_id, 'jobs': self.server.queue.status()})
+
+    def do_POST(self):
+        if not self.authorized():
+            return self.send_json(403)
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        queue = self.server.queue
+        if self.path == '/claim':
+            job = queue.claim(request['agent'])
+            if job is not None:
+                logging.info(f"Job {job['job_id']} (cluster '{job['cluster']}', attempt {job['attempt']}) leased to agent {request['agent']}")
+            return self.send_json(200, job) if job is not None else self.send_json(204)
+        if self.path == '/renew':
+            return self.send_json(200 if queue.renew(request['job_id'], request['agent']) else 409)
+        if self.path == '/complete':
+            accepted = queue.complete(request['job_id'], request['agent'], request['result'])
+            logging.info(f"Job {request['job_id']} completed by agent {request['agent']}"
+                         f"{'' if accepted else ', result rejected: lease was lost'}")
+            return self.send_json(200 if accepted else 409)
+        self.send_json(404)
+
+    def log_message(self, format, *args):
+        logging.debug(f"Coordinator request from {self.address_string()}: {format % args}")
+
+
+class Coordinator:
+    """
+    Координатор распределенной валидации: очередь заданий (Job_queue) и HTTP API для агентов на хостах восстановления.
+    run() ждет, пока все задания не будут выполнены или не исчерпают попытки, и возвращает их состояние.
+    Без токена координатор слушает только loopback-адрес: иначе любой хост мог бы брать задания и присылать результаты
+    """
+    def __init__(self, queue, address=COORDINATOR_ADDRESS, port=COORDINATOR_PORT, token=COORDINATOR_TOKEN):
+        if token is None and not loopback(address):
+            raise ValueError(f"Coordinator on {address} requires COORDINATOR_TOKEN, without a token it listens on 127.0.0.1 only")
+        self.queue = queue
+        self.server = ThreadingHTTPServer((address, port), Coordinator_handler)
+        self.server.queue = queue
+        self.server.token = token
+
+    def run(self, interval=AGENT_POLL_INTERVAL):
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        logging.info(f"Coordinator of run {self.queue.run_id} listening on {self.server.server_address[0]}:{self.server.server_address[1]}")
+        try:
+            while not self.queue.finished():
+                for cluster_name, agent, state in self.queue.requeue_expired():
+                    logging.warning(f"Lease of cluster '{cluster_name}' by agent {agent} expired, job {state}")
+                time.sleep(interval)
+            # агенты, ожидающие между опросами, должны успеть узнать о завершении запуска
+            time.sleep(2 * interval)
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+        return self.queue.status()
+
+
+class Agent:
+    """
+    Агент хоста восстановления: получает задания координатора, выполняет validate(cluster_name) (полный цикл
+    валидации кластера, возвращает статистику) и отправляет результат. Аренда продлевается в отдельном потоке.
+    Агент завершается, когда все задания запуска выполнены (once=True) или работает до остановки.
+    exclusive - агент должен быть единственным на хосте (lock_agent), иначе запуск отклоняется
+    """
+    def __init__(self, url, validate, token=COORDINATOR_TOKEN, name=None, exclusive=False):
+        self.url = url.rstrip('/')
+        self.validate = validate
+        self.token = token
+        self.name = name or agent_name()
+        self.exclusive = exclusive
+
+    def request(self, path, content=None):
+        """ POST к координатору (GET без content), возвращает (код, JSON-ответ) """
+        headers = {'Content-Type': 'application/json'}
+        if self.token is not None:
+            headers['Authorization'] = f"Bearer {self.token}"
+        data = json.dumps(content).encode() if content is not None else None
+        request = urllib.request.Request(f"{self.url}{path}", data=data, headers=headers, method='POST' if data else 'GET')
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                body = response.read()
+                return response.status, json.loads(body) if body else None
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+    def heartbeat(self, job, stop):
+        """ Продление аренды каждую треть срока, пока задание выполняется """
+        while not stop.wait(job['lease'] / 3):
+            try:
+                code, _ = self.request('/renew', {'job_id': job['job_id'], 'agent': self.name})
+            except OSError as e:
+                logging.warning(f"Lease renewal of cluster '{job['cluster']}' failed: {e}")
+                continue
+            if code != 200:
+                logging.error(f"Lease of cluster '{job['cluster']}' was lost, the job is requeued by the coordinator")
+                return
+
+    def report(self, job, result, interval, attempts=3):
+        """ Отправка результата задания (повтор при недоступности координатора, иначе задание выполнится заново) """
+        for attempt in range(attempts):
+            try:
+                code, _ = self.request('/complete', {'job_id': job['job_id'], 'agent': self.name, 'result': result})
+            except OSError as e:
+                logging.warning(f"Result of cluster '{job['cluster']}' not sent: {e}")
+                time.sleep(interval)
+                continue
+            if code != 200:
+                logging.error(f"Result of cluster '{job['cluster']}' rejected by the coordinator: HTTP {code}")
+            return code == 200
+        return False
+
+    def run_finished(self):
+        """ Все задания запуска выполнены или исчерпали попытки, None - состояние запуска не получено """
+        try:
+            code, status = self.request('/status')
+        except OSError as e:
+            logging.warning(f"Run status from coordinator {self.url} not received: {e}")
+            return None
+        if code != 200 or not status:
+            return None
+        return all(job['state'] in ('done', 'failed') for job in status['jobs'])
+
+    def run(self, once=True, interval=AGENT_POLL_INTERVAL):
+        lock_file = lock_agent() if self.exclusive else None
+        if self.exclusive and lock_file is None:
+            raise RuntimeError("Another agent is already running on this host: agents without MULTI_INSTANCE share MYSQL_DATA_DIR")
+        try:
+            return self.serve(once=once, interval=interval)
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    def serve(self, once=True, interval=AGENT_POLL_INTERVAL):
+        logging.info(f"Agent {self.name} working for coordinator {self.url}")
+        unavailable_since = None
+        while True:
+            try:
+                code, job = self.request('/claim', {'agent': self.name})
+                unavailable_since = None
+            except OSError as e:
+                # координатор недоступен дольше срока аренды - запуск завершен или координатор остановлен
+                unavailable_since = unavailable_since or time.time()
+                if time.time() - unavailable_since > JOB_LEASE_SECONDS:
+                    logging.error(f"Coordinator {self.url} is unavailable for {JOB_LEASE_SECONDS} s, agent stopped")
+                    return False
+                logging.warning(f"Coordinator {self.url} is unavailable: {e}")
+                time.sleep(interval)
+                continue
+            if code == 204:
+                # очередь пуста: агент ждет, пока выданные задания не завершатся (аренда может истечь, и задание вернется)
+                # координатор, уже завершивший запуск, перестает отвечать - это обрабатывает следующий /claim
+                if once and self.run_finished():
+                    break
+                time.sleep(interval)
+                continue
+            if code != 200:
+                raise RuntimeError(f"Coordinator {self.url} rejected the agent: HTTP {code}")
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=self.heartbeat, args=(job, stop), daemon=True)
+            heartbeat.start()
+            try:
+                result = self.validate(job['cluster'])
+            except Exception as e:
+                logging.error(e)
+                result = {'exit_code': 1, 'error': str(e)}
+            finally:
+                stop.set()
+                heartbeat.join()
+            self.report(job, result, interval)
+        logging.info(f"Agent {self.name}: no more jobs")
+        return True
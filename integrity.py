@@ -0,0 +1,223 @@
+import os
+import re
+import mmap
+import random
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from mysqlconf import PREFLIGHT_SAMPLE_PAGES, PREFLIGHT_THREADS
+
+# crc32c - необязательная зависимость, без нее контрольные суммы страниц не проверяются (только структура страниц)
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
+# Смещения заголовка и окончания страницы InnoDB (fil0types.h, fsp0fsp.h)
+FIL_PAGE_OFFSET = 4
+FIL_PAGE_LSN = 16
+FIL_PAGE_TYPE = 24
+FIL_PAGE_FILE_FLUSH_LSN = 26
+FIL_PAGE_SPACE_ID = 34
+FIL_PAGE_DATA = 38
+FIL_PAGE_END_LSN_OLD_CHKSUM = 8
+FSP_SPACE_FLAGS = FIL_PAGE_DATA + 16
+BUF_NO_CHECKSUM_MAGIC = 0xDEADBEEF
+# сжатые/зашифрованные страницы (page compression, encryption) - тело и окончание страницы не проверяются
+OPAQUE_PAGE_TYPES = (14, 15, 16, 17)
+UT_HASH_RANDOM_MASK = 1463735687
+UT_HASH_RANDOM_MASK2 = 1653893711
+
+SYSTEM_SCHEMAS = ('mysql', 'performance_schema', 'sys', 'information_schema')
+COMPRESSED_SUFFIXES = ('.qp', '.zst', '.lz4')
+GALERA_INFO = re.compile(r'[0-9a-fA-F-]{36}:.+')
+
+# Блок отдельных функций
+def read_key_values(file_path):
+    """ Разбор служебного файла xtrabackup (строки 'ключ = значение'), если файла нет - None """
+    if not os.path.exists(file_path):
+        return None
+    values = {}
+    with open(file_path, 'r', errors='replace') as service_file:
+        for line in service_file:
+            key, separator, value = line.partition('=')
+            if separator:
+                values[key.strip()] = value.strip()
+    return values
+
+def backup_file(path_backup, name):
+    """ Путь к файлу бэкапа с учетом сжатия (name, name.qp, name.zst, name.lz4), None - файла нет """
+    for suffix in ('',) + COMPRESSED_SUFFIXES:
+        if os.path.exists(os.path.join(path_backup, name + suffix)):
+            return os.path.join(path_backup, name + suffix)
+    return None
+
+def check_metadata(path_backup, previous_to_lsn=None):
+    """
+    Проверка xtrabackup_checkpoints, xtrabackup_info и xtrabackup_galera_info: тип бэкапа, непрерывность LSN
+    (from_lsn <= to_lsn <= last_lsn, полный бэкап начинается с 0, совпадение с xtrabackup_info).
+    Возвращает (errors, warnings, last_lsn)
+    """
+    errors, warnings = [], []
+    checkpoints = read_key_values(os.path.join(path_backup, 'xtrabackup_checkpoints'))
+    if checkpoints is None:
+        return ["xtrabackup_checkpoints not found"], warnings, None
+    try:
+        from_lsn, to_lsn, last_lsn = (int(checkpoints[key]) for key in ('from_lsn', 'to_lsn', 'last_lsn'))
+    except (KeyError, ValueError):
+        return [f"xtrabackup_checkpoints is incomplete: {checkpoints}"], warnings, None
+    backup_type = checkpoints.get('backup_type')
+    if backup_type not in ('full-backuped', 'full-prepared', 'incremental', 'log-applied'):
+        errors.append(f"Unknown backup_type '{backup_type}' in xtrabackup_checkpoints")
+    elif backup_type != 'full-backuped':
+        warnings.append(f"Backup type is '{backup_type}', expected 'full-backuped'")
+    if backup_type and backup_type.startswith('full') and from_lsn != 0:
+        errors.append(f"Full backup starts from LSN {from_lsn}, expected 0")
+    if not from_lsn <= to_lsn <= last_lsn:
+        errors.append(f"LSN sequence is broken: from_lsn={from_lsn}, to_lsn={to_lsn}, last_lsn={last_lsn}")
+    if previous_to_lsn is not None and to_lsn < previous_to_lsn:
+        warnings.append(f"Backup to_lsn {to_lsn} is behind the previously validated backup ({previous_to_lsn})")
+
+    info = read_key_values(os.path.join(path_backup, 'xtrabackup_info'))
+    if info is None:
+        warnings.append("xtrabackup_info not found")
+    else:
+        for key, value in (('innodb_from_lsn', from_lsn), ('innodb_to_lsn', to_lsn)):
+            if key in info and info[key].isdigit() and int(info[key]) != value:
+                errors.append(f"xtrabackup_info {key}={info[key]} does not match xtrabackup_checkpoints ({value})")
+
+    galera_info = os.path.join(path_backup, 'xtrabackup_galera_info')
+    if not os.path.exists(galera_info):
+        errors.append("xtrabackup_galera_info not found")
+    else:
+        with open(galera_info, 'r', errors='replace') as galera_file:
+            content = galera_file.read().strip()
+        if not GALERA_INFO.fullmatch(content):
+            errors.append(f"xtrabackup_galera_info has unexpected content: '{content[:80]}'")
+    return errors, warnings, last_lsn
+
+def fold_binary(data):
+    """ ut_fold_binary - основа устаревшего алгоритма контрольных сумм innodb """
+    fold = 0
+    for byte in data:
+        fold = (((((fold ^ byte ^ UT_HASH_RANDOM_MASK2) << 8) + fold) ^ UT_HASH_RANDOM_MASK) + byte) & 0xFFFFFFFFFFFFFFFF
+    return fold
+
+def page_checksums(page):
+    """ Допустимые значения контрольной суммы страницы: crc32 (по умолчанию с 5.7.7) и устаревший innodb """
+    crc = crc32c.crc32c(page[FIL_PAGE_OFFSET:FIL_PAGE_FILE_FLUSH_LSN]) ^ crc32c.crc32c(page[FIL_PAGE_DATA:-FIL_PAGE_END_LSN_OLD_CHKSUM])
+    yield crc & 0xFFFFFFFF
+    yield (fold_binary(page[FIL_PAGE_OFFSET:FIL_PAGE_FILE_FLUSH_LSN]) + fold_binary(page[FIL_PAGE_DATA:-FIL_PAGE_END_LSN_OLD_CHKSUM])) & 0xFFFFFFFF
+
+def page_sizes(flags):
+    """ Логический и физический (ROW_FORMAT=COMPRESSED) размер страницы по флагам табличного пространства """
+    page_ssize, zip_ssize = (flags >> 6) & 0xF, (flags >> 1) & 0xF
+    logical = 16384 if page_ssize == 0 else 512 << page_ssize
+    return logical, (512 << zip_ssize) if zip_ssize else logical
+
+def check_page(page, page_no, space_id, last_lsn, full_page, encrypted):
+    """ Проверка страницы, возвращает описание ошибки или None. Пустая (нулевая) страница допустима """
+    if not page.strip(b'\x00'):
+        return None
+    number, = struct.unpack_from('>I', page, FIL_PAGE_OFFSET)
+    page_type, = struct.unpack_from('>H', page, FIL_PAGE_TYPE)
+    page_space, = struct.unpack_from('>I', page, FIL_PAGE_SPACE_ID)
+    lsn, = struct.unpack_from('>Q', page, FIL_PAGE_LSN)
+    if number != page_no:
+        return f"page {page_no}: header page number {number}"
+    if page_space != space_id:
+        return f"page {page_no}: space id {page_space}, expected {space_id}"
+    if last_lsn is not None and lsn > last_lsn:
+        return f"page {page_no}: LSN {lsn} is beyond the end of the backup ({last_lsn})"
+    if not full_page or encrypted or page_type in OPAQUE_PAGE_TYPES:
+        return None
+    trailer_lsn, = struct.unpack_from('>I', page, len(page) - 4)
+    if trailer_lsn != lsn & 0xFFFFFFFF:
+        return f"page {page_no}: torn page, header LSN {lsn} does not match trailer"
+    if crc32c is not None:
+        stored, = struct.unpack_from('>I', page, 0)
+        if stored != BUF_NO_CHECKSUM_MAGIC and stored not in page_checksums(page):
+            return f"page {page_no}: checksum mismatch"
+    return None
+
+def sample_file(file_path, last_lsn=None, sample_pages=PREFLIGHT_SAMPLE_PAGES):
+    """
+    Выборочная проверка страниц файла табличного пространства через mmap: страница 0, последняя и sample_pages
+    случайных (выборка воспроизводима для файла того же размера). Возвращает (проверено страниц, ошибки)
+    """
+    size = os.path.getsize(file_path)
+    if size == 0:
+        return 0, [f"{file_path}: empty tablespace file"]
+    with open(file_path, 'rb') as tablespace, mmap.mmap(tablespace.fileno(), 0, access=mmap.ACCESS_READ) as pages:
+        if size < FSP_SPACE_FLAGS + 4:
+            return 0, [f"{file_path}: file is too small ({size} bytes)"]
+        space_id, = struct.unpack_from('>I', pages, FIL_PAGE_SPACE_ID)
+        flags, = struct.unpack_from('>I', pages, FSP_SPACE_FLAGS)
+        logical, physical = page_sizes(flags)
+        if size % physical:
+            return 0, [f"{file_path}: size {size} is not a multiple of the page size {physical}"]
+        count = size // physical
+        sample = {0, count - 1} | set(random.Random(f"{file_path}:{size}").sample(range(count), min(count, sample_pages)))
+        if space_id == 0:
+            # буфер двойной записи в ibdata1 (2 экстента после первого) хранит копии страниц других пространств
+            extent = 1048576 // logical if logical <= 16384 else 64
+            sample -= set(range(extent, 3 * extent))
+        errors = []
+        for page_no in sorted(sample):
+            error = check_page(pages[page_no * physical:(page_no + 1) * physical], page_no, space_id, last_lsn,
+                               full_page=logical == physical, encrypted=bool(flags & (1 << 13)))
+            if error is not None:
+                errors.append(f"{file_path}: {error}")
+        return len(sample), errors
+
+def tablespace_files(path_backup):
+    """
+    Файлы табличных пространств бэкапа: первый файл системного (ibdata1, страницы ibdata2... нумеруются от конца
+    предыдущего файла), mysql.ibd, undo и .ibd в директориях БД.
+    Возвращает (несжатые файлы для проверки страниц, количество сжатых - их страницы до распаковки не проверяются)
+    """
+    files, compressed = [], 0
+    with os.scandir(path_backup) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                if entry.name in SYSTEM_SCHEMAS and entry.name != 'mysql':
+                    continue
+                with os.scandir(entry.path) as table_entries:
+                    names = [table_entry.name for table_entry in table_entries
+                             if table_entry.is_file() and table_entry.name.endswith(('.ibd',) + tuple('.ibd' + suffix for suffix in COMPRESSED_SUFFIXES))]
+                paths = [os.path.join(entry.path, name) for name in names]
+            elif entry.is_file() and (entry.name.startswith(('ibdata1.', 'undo', 'mysql.ibd')) or entry.name == 'ibdata1'):
+                paths = [entry.path]
+            else:
+                continue
+            for file_path in paths:
+                if file_path.endswith(COMPRESSED_SUFFIXES):
+                    compressed += 1
+                else:
+                    files.append(file_path)
+    return files, compressed
+
+def check_backup(path_backup, expected_tables=None, backup_tables=None, previous_to_lsn=None,
+                 sample_pages=PREFLIGHT_SAMPLE_PAGES, threads=PREFLIGHT_THREADS):
+    """
+    Предварительная проверка бэкапа до копирования: служебные файлы и LSN, наличие системного табличного пространства
+    и таблиц из описи (expected_tables - таблицы InnoDB прошлой валидации, backup_tables - таблицы текущего бэкапа),
+    выборочная проверка страниц несжатых табличных пространств параллельно в threads потоках.
+    Возвращает отчет {'errors', 'warnings', 'files', 'pages', 'compressed_files', 'checksums'}
+    """
+    errors, warnings, last_lsn = check_metadata(path_backup, previous_to_lsn)
+    if backup_file(path_backup, 'ibdata1') is None:
+        errors.append("System tablespace ibdata1 not found")
+    if expected_tables is not None and backup_tables is not None:
+        missing = sorted(f"{db}.{table}" for db, table in set(expected_tables) - set(backup_tables))
+        if missing:
+            warnings.append(f"{len(missing)} tables of the previous validation have no files in the backup: {', '.join(missing[:10])}")
+    files, compressed = tablespace_files(path_backup)
+    report = {'errors': errors, 'warnings': warnings, 'files': len(files), 'pages': 0, 'compressed_files': compressed,
+              'checksums': crc32c is not None}
+    # крупные файлы первыми: страницы читаются через mmap, потоки ждут ввода-вывода
+    files.sort(key=os.path.getsize, reverse=True)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for pages, file_errors in executor.map(lambda file_path: sample_file(file_path, last_lsn, sample_pages), files):
+            report['pages'] += pages
+            errors.extend(file_errors)
+    return report
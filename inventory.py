@@ -0,0 +1,263 @@
+import os
+import re
+import json
+import hashlib
+from models import decode_mysql_filename
+from mysqlconf import STATS_DIR, INVENTORY_CACHE
+
+SYSTEM_SCHEMAS = ('mysql', 'performance_schema', 'sys', 'information_schema')
+# файлы таблиц в бэкапе (в т.ч. сжатые): .ibd - InnoDB, .frm - описание таблицы 5.7, .MYD/.MYI - MyISAM
+TABLE_FILE = re.compile(r'(.+?)\.(ibd|frm|MYD|MYI)(\.qp|\.zst|\.lz4)?')
+DATA_EXTENSIONS = ('ibd', 'MYD', 'MYI')
+INTEGER_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'bigint')
+
+# Один запрос: таблицы, колонки и первые колонки индексов. Списки собираются GROUP_CONCAT из JSON_ARRAY
+# и разбираются json.loads, поэтому кавычки и запятые в именах не ломают разбор
+INVENTORY_SQL = """SET SESSION group_concat_max_len = 67108864;
+SELECT JSON_OBJECT(
+    'db', t.TABLE_SCHEMA, 'table', t.TABLE_NAME, 'engine', IFNULL(t.ENGINE, ''),
+    'data_length', IFNULL(t.DATA_LENGTH, 0), 'index_length', IFNULL(t.INDEX_LENGTH, 0), 'rows', IFNULL(t.TABLE_ROWS, 0),
+    'auto_increment', IFNULL(t.AUTO_INCREMENT, 0), 'update_time', IFNULL(CAST(t.UPDATE_TIME AS CHAR), ''),
+    'columns', CAST(c.columns AS JSON), 'indexes', CAST(IFNULL(s.indexes, '[]') AS JSON))
+FROM information_schema.TABLES t
+JOIN (SELECT TABLE_SCHEMA, TABLE_NAME,
+      CONCAT('[', GROUP_CONCAT(JSON_ARRAY(COLUMN_NAME, DATA_TYPE, IS_NULLABLE) ORDER BY ORDINAL_POSITION), ']') AS columns
+      FROM information_schema.COLUMNS GROUP BY TABLE_SCHEMA, TABLE_NAME) c
+  ON c.TABLE_SCHEMA = t.TABLE_SCHEMA AND c.TABLE_NAME = t.TABLE_NAME
+LEFT JOIN (SELECT TABLE_SCHEMA, TABLE_NAME,
+      CONCAT('[', GROUP_CONCAT(JSON_ARRAY(INDEX_NAME, NON_UNIQUE, COLUMN_NAME) ORDER BY INDEX_NAME), ']') AS indexes
+      FROM information_schema.STATISTICS WHERE SEQ_IN_INDEX = 1 GROUP BY TABLE_SCHEMA, TABLE_NAME) s
+  ON s.TABLE_SCHEMA = t.TABLE_SCHEMA AND s.TABLE_NAME = t.TABLE_NAME
+WHERE t.TABLE_SCHEMA NOT IN ('information_schema', 'mysql', 'performance_schema', 'sys') AND t.TABLE_TYPE = 'BASE TABLE'
+ORDER BY t.TABLE_SCHEMA, t.TABLE_NAME;"""
+
+# Блок отдельных функций
+def cache_path(cluster_name):
+    """ Путь к файлу кэша описи кластера """
+    return os.path.join(STATS_DIR, 'inventory', f"{cluster_name}.json")
+
+def read_backup_info(path_backup):
+    """ Разбор xtrabackup_info (строки 'ключ = значение'), если файла нет - пустой словарь """
+    file_path = os.path.join(path_backup, 'xtrabackup_info')
+    if not os.path.exists(file_path):
+        return {}
+    info = {}
+    with open(file_path, 'r', errors='replace') as info_file:
+        for line in info_file:
+            key, separator, value = line.partition('=')
+            if separator:
+                info[key.strip()] = value.strip()
+    return info
+
+def backup_checksum(path_backup):
+    """
+    Идентификатор бэкапа: sha256 от реального пути latest/ и содержимого xtrabackup_checkpoints и xtrabackup_info
+    (LSN и время снятия различаются у каждого бэкапа). Без этих файлов учитываются имена, размеры и mtime файлов корня
+    """
+    digest = hashlib.sha256(os.path.realpath(path_backup).encode())
+    service_files = [name for name in ('xtrabackup_checkpoints', 'xtrabackup_info') if os.path.exists(os.path.join(path_backup, name))]
+    for name in service_files:
+        with open(os.path.join(path_backup, name), 'rb') as service_file:
+            digest.update(service_file.read())
+    if not service_files:
+        with os.scandir(path_backup) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                stat = entry.stat()
+                digest.update(f"{entry.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+def scan_backup(path_backup):
+    """
+    Один проход по директориям БД в latest/: таблицы по файлам .ibd/.frm/.MYD/.MYI (в т.ч. сжатым),
+    секции партиционированных таблиц суммируются. Возвращает {(db, table): Table_info}
+    """
+    tables = {}
+    with os.scandir(path_backup) as db_entries:
+        for db_entry in db_entries:
+            if not db_entry.is_dir() or db_entry.name in SYSTEM_SCHEMAS:
+                continue
+            db = decode_mysql_filename(db_entry.name)
+            with os.scandir(db_entry.path) as entries:
+                for entry in entries:
+                    match = TABLE_FILE.fullmatch(entry.name)
+                    if match is None or not entry.is_file():
+                        continue
+                    key = (db, decode_mysql_filename(match.group(1)))
+                    table = tables.setdefault(key, Table_info(*key))
+                    if match.group(2) in DATA_EXTENSIONS:
+                        stat = entry.stat()
+                        table.file_size += stat.st_size
+                        table.file_mtime = max(table.file_mtime, int(stat.st_mtime))
+                        table.compressed = table.compressed or match.group(3) is not None
+    return tables
+
+def load_inventory(cluster_instance, live=True, use_cache=INVENTORY_CACHE):
+    """
+    Опись кластера для всех этапов валидации. Кэшируется в STATS_DIR/inventory по идентификатору бэкапа:
+    для того же бэкапа повторное сканирование каталога и information_schema не выполняется.
+    live=True - дополнить описью запущенного экземпляра (один запрос), иначе только файлы бэкапа
+    """
+    path_backup = os.path.join(cluster_instance.backupdir, cluster_instance.cluster_name, 'latest')
+    cluster_instance.dir_validate(path_backup)
+    checksum = backup_checksum(path_backup)
+    inventory = Inventory.load(cache_path(cluster_instance.cluster_name)) if use_cache else None
+    if inventory is None or inventory.backup_checksum != checksum:
+        inventory = Inventory(cluster_instance.cluster_name, checksum, read_backup_info(path_backup), scan_backup(path_backup))
+    if live and not inventory.live:
+        inventory.add_instance_tables(cluster_instance.iter_sql(INVENTORY_SQL, raw=True))
+    if use_cache and inventory.changed:
+        inventory.save(cache_path(cluster_instance.cluster_name))
+    return inventory
+
+
+class Table_info:
+    """
+    Описание таблицы: по файлам бэкапа (file_size, file_mtime, compressed) и по information_schema восстановленного
+    экземпляра (engine, размеры, оценка строк, колонки [(имя, тип, nullable)], первые колонки индексов [(индекс, non_unique, колонка)])
+    """
+    __slots__ = ('db', 'table', 'file_size', 'file_mtime', 'compressed', 'live', 'engine', 'data_length', 'index_length',
+                 'rows', 'auto_increment', 'update_time', 'columns', 'indexes')
+
+    def __init__(self, db, table, file_size=0, file_mtime=0, compressed=False, live=False, engine='', data_length=0,
+                 index_length=0, rows=0, auto_increment=0, update_time='', columns=None, indexes=None):
+        self.db = db
+        self.table = table
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+        self.compressed = compressed
+        self.live = live # таблица есть в information_schema
+        self.engine = engine
+        self.data_length = data_length
+        self.index_length = index_length
+        self.rows = rows
+        self.auto_increment = auto_increment
+        self.update_time = update_time
+        self.columns = columns or []
+        self.indexes = indexes or []
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @property
+    def size(self):
+        """ Размер таблицы: по information_schema, если он известен, иначе по файлам бэкапа """
+        return self.data_length + self.index_length if self.live else self.file_size
+
+    def column_names(self):
+        return [column[0] for column in self.columns]
+
+    def chunk_key(self):
+        """
+        Колонка для деления на диапазоны: первая колонка индекса целого типа NOT NULL, первичный ключ в приоритете,
+        затем уникальные индексы. None - подходящей колонки нет
+        """
+        types = {name: (data_type, nullable) for name, data_type, nullable in self.columns}
+        candidates = sorted((index != 'PRIMARY', int(non_unique), index, column) for index, non_unique, column in self.indexes
+                            if column in types and types[column][0] in INTEGER_TYPES and types[column][1] == 'NO')
+        return candidates[0][3] if candidates else None
+
+
+class Inventory:
+    """
+    Опись таблиц кластера: один разбор файлов бэкапа и один запрос к information_schema на бэкап.
+    Таблицы хранятся по ключу (db, table), представления для планировщика, инкрементального режима и контрольных сумм
+    строятся из описи без повторных запросов
+    """
+    def __init__(self, cluster_name, backup_checksum, backup_info, tables, live=False):
+        self.cluster_name = cluster_name
+        self.backup_checksum = backup_checksum
+        self.backup_info = backup_info
+        self.tables = tables
+        self.live = live
+        self.changed = True # опись изменилась после чтения из кэша
+
+    def add_instance_tables(self, rows):
+        """ Добавление описи экземпляра из строк INVENTORY_SQL (JSON-объект на строку) """
+        for (row,) in rows:
+            data = json.loads(row)
+            key = (data['db'], data['table'])
+            table = self.tables.setdefault(key, Table_info(*key))
+            table.live = True
+            for name in ('engine', 'data_length', 'index_length', 'rows', 'auto_increment', 'update_time'):
+                setattr(table, name, data[name])
+            table.columns = [tuple(column) for column in data['columns']]
+            table.indexes = [tuple(index) for index in data['indexes']]
+        self.live = True
+        self.changed = True
+        return self
+
+    def innodb_tables(self):
+        """ Таблицы InnoDB экземпляра - у каждой должен быть файл .ibd в бэкапе """
+        return {key for key, info in self.tables.items() if info.live and info.engine == 'InnoDB'}
+
+    def databases(self):
+        return sorted({db for db, table in self.tables})
+
+    def tables_in_dbs(self):
+        """ Список таблиц по БД, в виде {db: [tables]} (как MySQL_cluster.get_tables_in_dbs) """
+        dbs_tbls = {}
+        for db, table in sorted(self.tables):
+            dbs_tbls.setdefault(db, []).append(table)
+        return dbs_tbls
+
+    def iter_sizes(self, source='instance'):
+        """
+        Поток размеров таблиц для iter_tasks: (db, table, {'size', 'rows', 'mtime'}) в порядке описи.
+        source='backup' - по файлам бэкапа (строки неизвестны), иначе по information_schema
+        """
+        for (db, table), info in self.tables.items():
+            if source == 'backup':
+                if info.file_size or info.file_mtime:
+                    yield db, table, {'size': info.file_size, 'rows': 0, 'mtime': info.file_mtime}
+            elif info.live:
+                yield db, table, {'size': info.size, 'rows': info.rows, 'mtime': info.file_mtime}
+
+    def sizes(self, source='instance'):
+        """ Размеры таблиц для tasks_scheduling: {db: {table: {'size', 'rows', 'mtime'}}} (см. iter_sizes) """
+        dbs_tbls_sizes = {}
+        for db, table, info in sorted(self.iter_sizes(source), key=lambda item: item[:2]):
+            dbs_tbls_sizes.setdefault(db, {})[table] = info
+        return dbs_tbls_sizes
+
+    def metadata(self):
+        """ Метаданные таблиц экземпляра в формате MySQL_cluster.get_tables_metadata: {'db.table': {...}} """
+        return {f"{info.db}.{info.table}": {'db': info.db, 'table': info.table, 'size': info.size, 'table_rows': info.rows,
+                                            'auto_increment': info.auto_increment, 'update_time': info.update_time}
+                for info in self.tables.values() if info.live}
+
+    def columns(self):
+        """ Колонки таблиц в порядке следования, в виде {'db.table': [columns]} """
+        return {f"{info.db}.{info.table}": info.column_names() for info in self.tables.values() if info.live}
+
+    def chunk_key(self, db, table):
+        info = self.tables.get((db, table))
+        return info.chunk_key() if info is not None else None
+
+    def save(self, file_path):
+        """ Запись описи через временный файл """
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        content = {'cluster': self.cluster_name, 'backup_checksum': self.backup_checksum, 'backup_info': self.backup_info,
+                   'live': self.live, 'tables': [info.as_dict() for info in self.tables.values()]}
+        with open(f"{file_path}.tmp", 'w', encoding='utf-8') as cache_file:
+            json.dump(content, cache_file, ensure_ascii=False, separators=(',', ':'))
+        os.replace(f"{file_path}.tmp", file_path)
+        self.changed = False
+        return True
+
+    @classmethod
+    def load(cls, file_path):
+        """ Чтение описи из кэша, если файла нет или он поврежден - None """
+        try:
+            with open(file_path, 'r', encoding='utf-8') as cache_file:
+                content = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        tables = {}
+        for data in content['tables']:
+            data['columns'] = [tuple(column) for column in data['columns']]
+            data['indexes'] = [tuple(index) for index in data['indexes']]
+            info = Table_info(**data)
+            tables[(info.db, info.table)] = info
+        inventory = cls(content['cluster'], content['backup_checksum'], content['backup_info'], tables, content['live'])
+        inventory.changed = False
+        return inventory
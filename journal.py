@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from inventory import backup_checksum
+from mysqlconf import STATS_DIR
+
+# Блок отдельных функций
+def task_key(item):
+    """ Ключ задачи дампа в журнале: БД, таблицы и номер диапазона (задача tasks_scheduling или ее метрики) """
+    return f"{item['db']}\t{','.join(item['tables'])}\t{item.get('chunk', '')}"
+
+def datadir_fingerprint(cluster_instance):
+    """
+    Отпечаток восстановленной директории данных: идентификатор бэкапа и sha256 xtrabackup_checkpoints
+    в директории данных (после prepare). None - директория не восстановлена
+    """
+    checkpoints = os.path.join(cluster_instance.mysql_data_dir, 'xtrabackup_checkpoints')
+    if not os.path.exists(checkpoints):
+        return None
+    with open(checkpoints, 'rb') as checkpoints_file:
+        digest = hashlib.sha256(checkpoints_file.read()).hexdigest()
+    path_backup = os.path.join(cluster_instance.backupdir, cluster_instance.cluster_name, 'latest')
+    return {'backup': backup_checksum(path_backup), 'checkpoints': digest}
+
+
+class Run_journal:
+    """
+    Журнал запуска валидации (SQLite в STATS_DIR): завершенные этапы кластеров ('restored', 'done') и завершенные
+    задачи дампа. При resume продолжается последний незавершенный запуск: готовые кластеры пропускаются,
+    восстановленная директория данных того же бэкапа используется повторно, дамп запускается только для
+    незавершенных задач. Записи делаются из основного процесса (потоки - под блокировкой)
+    """
+    def __init__(self, file_path=None):
+        self.file_path = file_path or os.path.join(STATS_DIR, 'validation_journal.db')
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        self.connection = sqlite3.connect(self.file_path, timeout=30, check_same_thread=False)
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY AUTOINCREMENT, clusters TEXT, "
+            "started_at INTEGER, finished_at INTEGER);"
+            "CREATE TABLE IF NOT EXISTS stages (run_id INTEGER, cluster TEXT, stage TEXT, detail TEXT, finished_at INTEGER, "
+            "PRIMARY KEY (run_id, cluster, stage));"
+            "CREATE TABLE IF NOT EXISTS tasks (run_id INTEGER, cluster TEXT, task TEXT, result TEXT, finished_at INTEGER, "
+            "PRIMARY KEY (run_id, cluster, task));"
+        )
+        self.connection.commit()
+        self.run_id = None
+        self.resumed = False
+
+    def close(self):
+        self.connection.close()
+
+    def start(self, cluster_names, resume=False):
+        """ Начало запуска или (resume) продолжение последнего незавершенного. Возвращает run_id """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT run_id FROM runs WHERE finished_at IS NULL ORDER BY run_id DESC LIMIT 1").fetchone() if resume else None
+            if row is not None:
+                self.run_id, self.resumed = row[0], True
+            else:
+                cursor = self.connection.execute("INSERT INTO runs (clusters, started_at) VALUES (?, ?)",
+                                                 (json.dumps(cluster_names), int(time.time())))
+                self.run_id, self.resumed = cursor.lastrowid, False
+            self.connection.commit()
+        return self.run_id
+
+    def finish(self):
+        with self.lock:
+            self.connection.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (int(time.time()), self.run_id))
+            self.connection.commit()
+
+    def stage_done(self, cluster_name, stage, detail=None):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?)",
+                                    (self.run_id, cluster_name, stage, json.dumps(detail), int(time.time())))
+            self.connection.commit()
+
+    def stage_detail(self, cluster_name, stage):
+        """ Данные завершенного этапа, None - этап не завершен """
+        with self.lock:
+            row = self.connection.execute("SELECT detail FROM stages WHERE run_id = ? AND cluster = ? AND stage = ?",
+                                          (self.run_id, cluster_name, stage)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def datadir_reusable(self, cluster_instance):
+        """ Восстановлена ли директория данных в этом запуске из того же бэкапа (и не изменилась ли с тех пор) """
+        if not self.resumed:
+            return False
+        restored = self.stage_detail(cluster_instance.cluster_name, 'restored')
+        return restored is not None and restored == datadir_fingerprint(cluster_instance)
+
+    def task_done(self, cluster_name, key, result):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?)",
+                                    (self.run_id, cluster_name, key, json.dumps(result), int(time.time())))
+            self.connection.commit()
+
+    def done_tasks(self, cluster_name):
+        """ Результаты завершенных задач дампа кластера: {task_key: результат} """
+        with self.lock:
+            rows = self.connection.execute("SELECT task, result FROM tasks WHERE run_id = ? AND cluster = ?",
+                                           (self.run_id, cluster_name)).fetchall()
+        return {key: json.loads(result) for key, result in rows}
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import resource
+import threading
+import functools
+from mysqlconf import STATS_DIR
+from progress import progress
+
+# Блок отдельных функций
+def proc_io():
+    """ Счетчики ввода-вывода текущего процесса из /proc/self/io (байты, реально прочитанные/записанные на диск) """
+    try:
+        with open('/proc/self/io', 'r') as io_file:
+            return {key: int(value) for key, value in (line.split(': ') for line in io_file.read().splitlines())}
+    except OSError:
+        return {}
+
+def usage_snapshot():
+    """ Снимок счетчиков времени, CPU, памяти и ввода-вывода текущего процесса и завершенных дочерних процессов """
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    io = proc_io()
+    return {
+        'time': time.perf_counter(),
+        'children_user': children.ru_utime,
+        'children_system': children.ru_stime,
+        'children_inblock': children.ru_inblock,
+        'children_oublock': children.ru_oublock,
+        'children_maxrss': children.ru_maxrss,
+        'self_cpu': own.ru_utime + own.ru_stime,
+        'read_bytes': io.get('read_bytes', 0),
+        'write_bytes': io.get('write_bytes', 0),
+    }
+
+def usage_delta(before, after):
+    """
+    Разница двух снимков. Счетчики дочерних процессов общие для процесса: при параллельных этапах (конвейер,
+    несколько экземпляров) ресурсы одновременно завершившихся процессов попадают в оба этапа.
+    peak_rss_kb - максимальный RSS среди завершенных дочерних процессов за все время работы
+    """
+    return {
+        'wall': round(after['time'] - before['time'], 6),
+        'cpu_user': round(after['children_user'] - before['children_user'], 6),
+        'cpu_system': round(after['children_system'] - before['children_system'], 6),
+        'self_cpu': round(after['self_cpu'] - before['self_cpu'], 6),
+        'peak_rss_kb': after['children_maxrss'],
+        'read_bytes': (after['children_inblock'] - before['children_inblock']) * 512 + after['read_bytes'] - before['read_bytes'],
+        'write_bytes': (after['children_oublock'] - before['children_oublock']) * 512 + after['write_bytes'] - before['write_bytes'],
+    }
+
+def measure(function, task):
+    """
+    Запуск function(task) с замером ресурсов, для пула процессов: каждый процесс пула выполняет одну задачу за раз,
+    поэтому счетчики дочерних процессов относятся к этой задаче. Возвращает (результат, метрики)
+    """
+    before = usage_snapshot()
+    result = function(task)
+    metrics = usage_delta(before, usage_snapshot())
+    if isinstance(task, dict):
+        metrics.update(db=task['db'], tables=task['tables'], size=task.get('size', 0))
+        if 'chunk' in task:
+            metrics.update(chunk=task['chunk'], chunks=task['chunks'])
+    return result, metrics
+
+
+class Metrics_collector:
+    """
+    Класс накопления метрик этапов валидации и их вывода: JSON lines и файлы для Zabbix рядом с stanza_discovery
+    """
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+    def add(self, cluster_name, stage, metrics, **labels):
+        record = {'ts': round(time.time(), 3), 'cluster': cluster_name, 'stage': stage}
+        record.update(metrics)
+        record.update(labels)
+        with self.lock:
+            self.records.append(record)
+
+    def summary(self):
+        """
+        Сводка для Zabbix: {cluster: {stage: {...}}}. Этап dump_table агрегируется (количество, сумма и максимум времени)
+        """
+        summary = {}
+        for record in self.records:
+            stages = summary.setdefault(record['cluster'], {})
+            if record['stage'] == 'dump_table':
+                tables = stages.setdefault('dump_table', {'count': 0, 'wall': 0, 'max_wall': 0, 'read_bytes': 0, 'write_bytes': 0})
+                tables['count'] += 1
+                tables['wall'] = round(tables['wall'] + record['wall'], 6)
+                tables['max_wall'] = max(tables['max_wall'], record['wall'])
+                tables['read_bytes'] += record.get('read_bytes', 0)
+                tables['write_bytes'] += record.get('write_bytes', 0)
+            else:
+                stages[record['stage']] = {key: value for key, value in record.items() if key not in ('cluster', 'stage')}
+        return summary
+
+    def output(self, stats_dir=STATS_DIR):
+        """ Метод записи метрик в STATS_DIR """
+        with self.lock:
+            records = list(self.records)
+        with open(os.path.join(stats_dir, 'validation_metrics.jsonl'), 'a', encoding='utf-8') as metrics_file:
+            for record in records:
+                metrics_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        summary = self.summary()
+        with open(os.path.join(stats_dir, 'validation_stage_metrics'), 'w', encoding='utf-8') as metrics_file:
+            json.dump(summary, metrics_file, indent=2, ensure_ascii=False)
+        discovery = [{'{#STANZA}': cluster_name, '{#STAGE}': stage}
+                     for cluster_name, stages in summary.items() for stage in stages]
+        with open(os.path.join(stats_dir, 'stage_discovery'), 'w', encoding='utf-8') as stage_discovery:
+            json.dump(discovery, stage_discovery, indent=2, ensure_ascii=False)
+        return True
+
+stage_metrics = Metrics_collector()
+
+def instrumented(method):
+    """ Декоратор метода MySQL_cluster: замер этапа с именем метода в stage_metrics, этап отмечается в progress """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        progress.stage(getattr(self, 'cluster_name', None), method.__name__)
+        before = usage_snapshot()
+        status = 'error'
+        try:
+            result = method(self, *args, **kwargs)
+            status = 'ok'
+            return result
+        finally:
+            stage_metrics.add(getattr(self, 'cluster_name', None), method.__name__, usage_delta(before, usage_snapshot()),
+                              status=status)
+    return wrapper
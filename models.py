@@ -1,9 +1,34 @@
-import subprocess, threading, queue
+import subprocess, threading
+import asyncio
+import logging
 import shlex
 import os
 import time
 import json
+import re
+import math
+import copy
+import gzip
+import zlib
+import pwd
+import heapq
+import random
+import itertools
 from mysqlconf import BACKUP_DIR, MYSQL_DATA_DIR, CLUSTER_NAMES, STATS_DIR, TRUE_DUMP_DIR, TRUE_DUMP
+from mysqlconf import STAGING_DIR, STREAM_CHUNK_SIZE, STREAM_COMPRESS_LEVEL, STAGING_ENGINE, STAGING_HARDLINK_COMPRESSED
+from mysqlconf import DECOMPRESS_ENGINE
+from staging import Staging_engine
+from decompression import Decompression_engine
+from archive import Member_writer
+from integrity import check_backup
+from metrics import instrumented
+from progress import progress, count_streamed, disk_growth
+from commands import run_command, run_command_async, wait_ready, sudo_bash, iter_command_lines, stop_process_group
+from mysqlconf import COMMAND_DEADLINES
+from mysqlconf import DUMP_DEADLINE_THROUGHPUT, DUMP_RETRIES, DUMP_RETRY_BACKOFF, DUMP_RETRY_BACKOFF_MAX, DUMP_TRANSIENT_ERRORS
+from mysqlconf import VALIDATION_PROFILE, VALIDATION_PROFILE_FILE, VALIDATION_BUFFER_POOL_SHARE, VALIDATION_PROFILE_OPTIONS
+from mysqlconf import MYSQL_CONFIG, CLUSTER_INSTANCES, INSTANCES_DIR, INSTANCES_RUN_DIR, INSTANCE_START_TIMEOUT
+from mysqlconf import SMALL_TABLE_SIZE, SMALL_TABLES_BATCH_SIZE, SMALL_TABLES_BATCH_COUNT, CHUNKED_TABLE_SIZE, SCHEDULE_WINDOW
 
 # Блок отдельных функций
 def format_time(seconds):
@@ -13,50 +38,333 @@ def format_time(seconds):
     seconds = int(seconds % 60)
     return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
 
+def format_size(size):
+    """Преобразует байты в формат du -h (округление вверх, один знак после запятой до 10)"""
+    for unit in ('', 'K', 'M', 'G', 'T'):
+        if size < 1024 or unit == 'T':
+            break
+        size /= 1024
+    if unit and size < 10:
+        return f"{math.ceil(size * 10) / 10:.1f}{unit}"
+    return f"{math.ceil(size)}{unit}"
+
 def archive_file(source_file):
     """ Процедура архивирования файлов """
     source_file_path = os.path.join(TRUE_DUMP_DIR, source_file)
     #source_target_path = os.path.join(TRUE_DUMP_DIR, source_file)
     command = f"tar -czf {TRUE_DUMP_DIR}/{source_file}.tar.gz {source_file_path} --remove-files"
-    result = subprocess.run(
-        ["sudo", "bash", "-c", command],
-        capture_output=True,
-        text=True,
-        timeout=300
-    )
-    if result.returncode != 0:
-        raise subprocess.CalledProcessError(f"Error during archiving process: {result.stderr}")
-    else:
-        return True
+    run_command(sudo_bash(command), deadline=COMMAND_DEADLINES['files'])
+    return True
 
-def tasks_building(dbs_tbls_dict, param_list):
+def tasks_building(dbs_tbls, param_list):
     """ 
-    Функция создает список кортежей вида: [(db_name, table_name, [parametrs]),(db_name, table_name, [parametrs]),] 
+    Генератор команд дампа по одной таблице. Принимает словарь {db: [tables]} или поток пар (db, table)
+    (MySQL_cluster.iter_tables) - команды создаются по мере чтения, без списка всех команд в памяти
     """
-    tasks = []
-    for db, tables in dbs_tbls_dict.items():
-        if len(tables) > 0:
-            for table in tables:
-                if TRUE_DUMP:
-                    file_name = f"{db}_{table}.dump"
-                    file_path = f"--result-file='{os.path.join(TRUE_DUMP_DIR, file_name)}'"
-                else:
-                    file_path = ''
-                tasks.append(f"mysqldump {' '.join(param_list)} {db} {table} {file_path}")
-    return tasks
+    pairs = ((db, table) for db, tables in dbs_tbls.items() for table in tables) if isinstance(dbs_tbls, dict) else dbs_tbls
+    for db, table in pairs:
+        if TRUE_DUMP:
+            file_name = f"{db}_{table}.dump"
+            file_path = shlex.quote(f"--result-file={os.path.join(TRUE_DUMP_DIR, file_name)}")
+        else:
+            file_path = ''
+        yield f"mysqldump {' '.join(param_list)} {shlex.quote(db)} {shlex.quote(table)} {file_path}"
 
-def start_dump(command_str): 
+def quote_identifier(name):
+    """ Экранирование имени БД/таблицы/колонки обратными кавычками """
+    return "`" + name.replace("`", "``") + "`"
+
+def sql_escape(value):
+    """ Экранирование строкового значения для подстановки в SQL в одинарных кавычках """
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+def chunk_conditions(column, lower, upper, chunks):
+    """
+    Функция деления целочисленного диапазона ключа [lower, upper] на chunks частей, возвращает список условий WHERE
     """
-    Функция запуска команды дампа. Принимает строку команды оболочки shell
+    bounds = sorted(set(lower + (upper - lower + 1) * i // chunks for i in range(chunks + 1)))
+    return [f"{quote_identifier(column)} >= {low} AND {quote_identifier(column)} < {high}"
+            for low, high in zip(bounds, bounds[1:])]
+
+def merge_chunk_results(results):
     """
-    dump_result = subprocess.run(["sudo", "bash", "-c", command_str],
-        stdout=subprocess.DEVNULL,
-        timeout=300  # 5 минут таймаут
-    )
-    if dump_result.returncode != 0:
-        raise subprocess.CalledProcessError(f"Error dumping table")
+    Функция объединения результатов чтения диапазонов одной таблицы (ключи 'chunk'/'chunks') в один результат по таблице:
+    строки и байты суммируются, контрольная сумма - crc32 от контрольных сумм диапазонов по порядку
+    """
+    merged = []
+    chunked = {}
+    for result in results:
+        if 'chunk' in result:
+            chunked.setdefault((result['db'], result.get('table') or result['tables'][0]), []).append(result)
+        else:
+            merged.append(result)
+    for (db, table), parts in chunked.items():
+        parts.sort(key=lambda part: part['chunk'])
+        table_result = {'db': db, 'table': table, 'chunks': len(parts),
+                        'rows': sum(part['rows'] for part in parts),
+                        'checksum': zlib.crc32(b''.join(part['checksum'].to_bytes(4, 'big') for part in parts))}
+        if 'bytes' in parts[0]:
+            table_result['bytes'] = sum(part['bytes'] for part in parts)
+        if 'duration' in parts[0]:
+            table_result['duration'] = sum(part['duration'] for part in parts)
+        errors = [part['error'] for part in parts if 'error' in part]
+        if errors:
+            table_result['error'] = '; '.join(errors)
+        if len(parts) != parts[0]['chunks']:
+            table_result['error'] = f"only {len(parts)} of {parts[0]['chunks']} chunks were read"
+        merged.append(table_result)
+    return merged
+
+def decode_mysql_filename(name):
+    """
+    Преобразует имя файла таблицы в имя таблицы: убирает суффикс секции (#p#/#P#)
+    и декодирует спецсимволы вида @002d
+    """
+    name = re.split(r'#[pP]#', name, maxsplit=1)[0]
+    return re.sub(r'@([0-9a-fA-F]{4})', lambda m: chr(int(m.group(1), 16)), name)
+
+def task_command(task, param_list, result_file=TRUE_DUMP):
+    """
+    Команда mysqldump задачи (ключ 'command'), result_file=False - дамп пишется в stdout.
+    Команда выполняется через sudo bash -c, поэтому имена БД, таблиц и путь файла экранируются для shell
+    """
+    part = f"_part{task['chunk']}" if 'chunk' in task else ''
+    if result_file:
+        file_name = f"{task['db']}_{task['tables'][0]}{part}.dump"
+        file_path = shlex.quote(f"--result-file={os.path.join(TRUE_DUMP_DIR, file_name)}")
     else:
+        file_path = ''
+    where = shlex.quote(f"--where={task['where']}") if 'where' in task else ''
+    tables = ' '.join(shlex.quote(table) for table in task['tables'])
+    task['command'] = f"mysqldump {' '.join(param_list)} {where} {shlex.quote(task['db'])} --tables {tables} {file_path}"
+    return task
+
+def iter_tasks(tables, param_list, window=SCHEDULE_WINDOW, small_table_size=SMALL_TABLE_SIZE,
+               batch_size=SMALL_TABLES_BATCH_SIZE, batch_count=SMALL_TABLES_BATCH_COUNT, result_file=TRUE_DUMP,
+               chunks_of=None, chunked_table_size=CHUNKED_TABLE_SIZE):
+    """
+    Генератор задач дампа по потоку таблиц (db, table, {'size': bytes, 'rows': rows}) по мере их обнаружения.
+    Задачи проходят через окно из window задач, выдается крупнейшая задача окна (LPT в пределах окна): первая задача
+    выдается после window задач, а не после описи и деления на диапазоны всех таблиц, в памяти не больше window задач
+    и незаполненных пачек. window=None - окно без ограничения (точный LPT, задачи выдаются после всего потока).
+    Мелкие таблицы объединяются в пачки своей БД по мере поступления, крупные делятся на диапазоны (chunks_of)
+    """
+    window_heap, order = [], itertools.count()
+    batches = {}
+
+    def batch_task(db):
+        batch = batches.pop(db)
+        return {'db': db, 'tables': batch['tables'], 'size': batch['size'], 'rows': batch['rows']}
+
+    for db, table, info in tables:
+        created = []
+        conditions = chunks_of(db, table) if chunks_of is not None and info['size'] >= chunked_table_size else []
+        for chunk, where in enumerate(conditions):
+            created.append({'db': db, 'tables': [table], 'size': info['size'] // len(conditions),
+                            'rows': info['rows'] // len(conditions), 'where': where, 'chunk': chunk, 'chunks': len(conditions)})
+        if not conditions and info['size'] >= small_table_size:
+            created.append({'db': db, 'tables': [table], 'size': info['size'], 'rows': info['rows']})
+        elif not conditions:
+            batch = batches.get(db)
+            if batch and (len(batch['tables']) >= batch_count or batch['size'] + info['size'] > batch_size):
+                created.append(batch_task(db))
+            batch = batches.setdefault(db, {'tables': [], 'size': 0, 'rows': 0})
+            batch['tables'].append(table)
+            batch['size'] += info['size']
+            batch['rows'] += info['rows']
+        for task in created:
+            heapq.heappush(window_heap, (-task['size'], next(order), task_command(task, param_list, result_file)))
+            if window is not None and len(window_heap) > window:
+                yield heapq.heappop(window_heap)[2]
+    for db in list(batches):
+        task = task_command(batch_task(db), param_list, result_file)
+        heapq.heappush(window_heap, (-task['size'], next(order), task))
+    while window_heap:
+        yield heapq.heappop(window_heap)[2]
+
+def tasks_scheduling(dbs_tbls_sizes, param_list, small_table_size=SMALL_TABLE_SIZE,
+                     batch_size=SMALL_TABLES_BATCH_SIZE, batch_count=SMALL_TABLES_BATCH_COUNT, result_file=TRUE_DUMP,
+                     chunks_of=None, chunked_table_size=CHUNKED_TABLE_SIZE):
+    """
+    Функция планирования задач дампа по размеру таблиц (Longest Processing Time first).
+    Принимает словарь вида {db: {table: {'size': bytes, 'rows': rows}}}, мелкие таблицы
+    объединяет в пачки '--tables t1 t2 ...', возвращает список задач-словарей
+    {'db', 'tables', 'size', 'rows', 'command'}, отсортированный по убыванию размера.
+    result_file=False - команда пишет дамп в stdout (для потокового режима stream_dump).
+    chunks_of(db, table) - функция деления таблицы на диапазоны (MySQL_cluster.get_table_chunks): таблицы больше
+    chunked_table_size делятся на задачи-диапазоны с ключами 'where', 'chunk', 'chunks' (см. merge_chunk_results).
+    Потоковый вариант с ограниченным окном - iter_tasks
+    """
+    # мелкие таблицы в порядке убывания, чтобы пачки получались ровнее
+    tables = ((db, table, info) for db, db_tables in dbs_tbls_sizes.items()
+              for table, info in sorted(db_tables.items(), key=lambda item: item[1]['size'], reverse=True))
+    return list(iter_tasks(tables, param_list, window=None, small_table_size=small_table_size, batch_size=batch_size,
+                           batch_count=batch_count, result_file=result_file, chunks_of=chunks_of,
+                           chunked_table_size=chunked_table_size))
+
+def stream_dump(task, archive=TRUE_DUMP, chunk_size=STREAM_CHUNK_SIZE, timeout=None, streamed=None):
+    """
+    Функция потокового снятия дампа задачи (см. tasks_scheduling с result_file=False).
+    Вывод mysqldump читается через pipe порциями по chunk_size: считаются байты, строки и crc32 потока,
+    при archive=True поток сразу сжимается в TRUE_DUMP_DIR/<db>_<table>.dump.gz, archive - путь к архиву кластера
+    (archive.create_archive) - поток пишется членом архива, описание члена возвращается в ключе 'member'.
+    Количество строк - оценка по разделителям '),(' расширенного INSERT (совпадения внутри строковых данных тоже считаются).
+    timeout - ограничение времени (секунды), по умолчанию по размеру задачи (dump_deadline).
+    Прочитанные байты учитываются по ходу задачи в счетчике этапа (progress.count_streamed, streamed - для потоков).
+    Возвращает словарь {'db', 'tables', 'bytes', 'rows', 'checksum', 'archive'}
+    """
+    command_str = task['command']
+    timeout = dump_deadline(task) if timeout is None else timeout
+    part = f"_part{task['chunk']}" if 'chunk' in task else ''
+    member = f"{task['db']}_{task['tables'][0]}{part}"
+    archive_path = archive if isinstance(archive, str) else os.path.join(TRUE_DUMP_DIR, f"{member}.dump.gz") if archive else None
+    # своя группа процессов: по истечении времени завершается и mysqldump, а не только sudo
+    process = subprocess.Popen(sudo_bash(command_str), stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    stderr = []
+    stderr_reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()))
+    stderr_reader.start()
+    timed_out = []
+    killer = threading.Timer(timeout, lambda: (timed_out.append(True), stop_process_group(process)))
+    killer.start()
+    result = {'db': task['db'], 'tables': task['tables'], 'bytes': 0, 'rows': 0, 'checksum': 0, 'archive': archive_path}
+    if 'chunk' in task:
+        result.update(chunk=task['chunk'], chunks=task['chunks'])
+    # хвост предыдущей порции, чтобы не потерять разделители на границе порций
+    tail = b'\n'
+    try:
+        if isinstance(archive, str):
+            archive_stream = Member_writer(archive_path, member)
+        else:
+            archive_stream = gzip.open(archive_path, 'wb', compresslevel=STREAM_COMPRESS_LEVEL) if archive else None
+        try:
+            while True:
+                chunk = process.stdout.read(chunk_size)
+                if not chunk:
+                    break
+                result['bytes'] += len(chunk)
+                count_streamed(len(chunk), streamed)
+                result['checksum'] = zlib.crc32(chunk, result['checksum'])
+                result['rows'] += (tail + chunk).count(b'\nINSERT INTO ') + (tail[-2:] + chunk).count(b'),(')
+                tail = (tail + chunk)[-12:]
+                if archive_stream is not None:
+                    archive_stream.write(chunk)
+        finally:
+            if isinstance(archive_stream, Member_writer):
+                result['member'] = dict(archive_stream.close(), db=task['db'], tables=task['tables'], chunk=task.get('chunk', 0))
+            elif archive_stream is not None:
+                archive_stream.close()
+        process.wait()
+    finally:
+        killer.cancel()
+        stderr_reader.join()
+    if timed_out:
+        raise subprocess.TimeoutExpired(command_str, timeout, stderr=b''.join(stderr).decode(errors='replace'))
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command_str, stderr=b''.join(stderr).decode(errors='replace'))
+    return result
+
+def render_mysql_config(config):
+    """
+    Функция формирует текст конфигурационного файла my.cnf из словаря вида {'section': {'option': value}}.
+    Опция со значением True записывается без значения (например skip-networking)
+    """
+    lines = []
+    for section, options in config.items():
+        lines.append(f"[{section}]")
+        for option, value in options.items():
+            lines.append(option if value is True else f"{option} = {value}")
+        lines.append('')
+    return '\n'.join(lines)
+
+def host_memory_mb():
+    """ Объем памяти хоста (МБ) из /proc/meminfo """
+    with open('/proc/meminfo', 'r') as meminfo:
+        for line in meminfo:
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1]) // 1024
+    raise ValueError("MemTotal not found in /proc/meminfo")
+
+def validation_profile(memory=None):
+    """
+    Функция формирования профиля одноразового экземпляра проверки на основе MYSQL_CONFIG и VALIDATION_PROFILE_OPTIONS.
+    memory - размер буферного пула (МБ), по умолчанию доля VALIDATION_BUFFER_POOL_SHARE памяти хоста
+    """
+    config = copy.deepcopy(MYSQL_CONFIG)
+    for section, options in VALIDATION_PROFILE_OPTIONS.items():
+        config.setdefault(section, {}).update(options)
+    if memory is None:
+        memory = int(host_memory_mb() * VALIDATION_BUFFER_POOL_SHARE)
+    config['mysqld']['innodb_buffer_pool_size'] = f"{memory}M"
+    return config
+
+def start_dump(command_str): 
+    """
+    Функция запуска команды дампа. Принимает строку команды оболочки shell (или задачу tasks_scheduling)
+    """
+    deadline = COMMAND_DEADLINES['dump']
+    if isinstance(command_str, dict):
+        deadline = dump_deadline(command_str)
+        command_str = command_str['command']
+    # зависший mysqldump завершается по истечении deadline, stderr пишется в лог по мере поступления
+    run_command(sudo_bash(command_str), deadline=deadline, stdout=subprocess.DEVNULL)
+    return True
+
+def dump_deadline(task):
+    """ Ограничение времени задачи дампа: COMMAND_DEADLINES['dump'] плюс время чтения ее размера на скорости DUMP_DEADLINE_THROUGHPUT """
+    return COMMAND_DEADLINES['dump'] + task.get('size', 0) / DUMP_DEADLINE_THROUGHPUT
+
+def error_tail(error, lines=20):
+    """ Последние строки stderr ошибки команды (или текст исключения) для результата задачи """
+    stderr = error.stderr if isinstance(error, subprocess.SubprocessError) else None
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode(errors='replace')
+    return '\n'.join(stderr.strip().splitlines()[-lines:]) if stderr and stderr.strip() else str(error)
+
+def transient_error(error):
+    """ Временная ли ошибка дампа: превышение времени или код из DUMP_TRANSIENT_ERRORS в выводе mysqldump """
+    if isinstance(error, subprocess.TimeoutExpired):
         return True
+    codes = re.findall(r'(?:[Ee]rror:?|ERROR) (\d{4})', error_tail(error))
+    return any(int(code) in DUMP_TRANSIENT_ERRORS for code in codes)
+
+def isolated_dump(dump_function, task, retries=DUMP_RETRIES):
+    """
+    Одна попытка задачи дампа dump_function(task) с изоляцией ошибок: ошибка задачи (в том числе OSError записи архива
+    или gzip) не прерывает пул, а возвращается результатом {'db', 'tables', 'status': 'failed'/'timeout',
+    'error': хвост stderr, 'attempts'}. После временной ошибки (transient_error), если повторы (retries) не исчерпаны,
+    возвращается 'status': 'retry' с задачей для повтора в 'task': процесс пула не ждет паузу, задача ставится
+    в очередь заново (requeue_dump) и выполняется не раньше 'not_before'. Пауза DUMP_RETRY_BACKOFF * 2^n (не более
+    DUMP_RETRY_BACKOFF_MAX, со случайным разбросом). Успешный результат дополняется 'status': 'ok' и 'attempts'
+    """
+    attempt = task.get('attempt', 1)
+    try:
+        result = dump_function(task)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+        status = 'timeout' if isinstance(e, subprocess.TimeoutExpired) else 'failed'
+        result = {'db': task['db'], 'tables': task['tables'], 'status': status, 'error': error_tail(e),
+                  'attempts': attempt, 'bytes': 0, 'rows': 0, 'checksum': 0}
+        if 'chunk' in task:
+            result.update(chunk=task['chunk'], chunks=task['chunks'])
+        if attempt <= retries and transient_error(e):
+            pause = min(DUMP_RETRY_BACKOFF * 2 ** (attempt - 1), DUMP_RETRY_BACKOFF_MAX) * random.uniform(0.5, 1)
+            result.update(status='retry', failure=status, task=dict(task, attempt=attempt + 1, not_before=time.time() + pause))
+        return result
+    if not isinstance(result, dict):
+        result = {'db': task['db'], 'tables': task['tables']}
+        if 'chunk' in task:
+            result.update(chunk=task['chunk'], chunks=task['chunks'])
+    result.update(status='ok', attempts=attempt)
+    return result
+
+def requeue_dump(result):
+    """ Задача для повторной постановки в очередь (результат isolated_dump со статусом 'retry') или None """
+    if not isinstance(result, dict) or result.get('status') != 'retry':
+        return None
+    task = result['task']
+    logging.warning(f"Dump of tables {', '.join(task['tables'])} DB '{task['db']}' {result['failure']} "
+                    f"(attempt {result['attempts']}), retrying in {max(0, task['not_before'] - time.time()):.0f} s: "
+                    f"{result['error'].splitlines()[-1] if result['error'] else ''}")
+    return task
 
 # Классы описывающие калстера
 class MySQL_cluster:
@@ -67,12 +375,21 @@ class MySQL_cluster:
     backupdir = BACKUP_DIR
     stats_dir = STATS_DIR
     true_dump_dir = TRUE_DUMP_DIR
+    staging_root = STAGING_DIR
+    mysql_socket = None
+    staging_stats = None
+    decompressed = False # сжатые файлы распакованы при копировании (Decompression_engine)
     username = 'mysql'
 
     val_durations = {}
+    start_durations = {}
+    dump_durations = {}
+    preflight = {}
     exit_codes = {}
     restor_durations = {}
     sizes = {}
+    backup_bytes = {}
+    deferred = {}
     discovery = [{'{#STANZA}': cl_name} for cl_name in CLUSTER_NAMES]
 
     @classmethod
@@ -85,6 +402,11 @@ class MySQL_cluster:
                         "RESTORE_DURATIONS: " + "; ".join(f"{key}:{value}" for key, value in cls.restor_durations.items()) + "\n"
                         "SIZES: " + "; ".join(f"{key}:{value}" for key, value in cls.sizes.items()) + "\n"
                         "VAL_DURATIONS: " + "; ".join(f"{key}:{value}" for key, value in cls.val_durations.items()) + "\n"
+                        "START_DURATIONS: " + "; ".join(f"{key}:{value}" for key, value in cls.start_durations.items()) + "\n"
+                        "DUMP_DURATIONS: " + "; ".join(f"{key}:{value}" for key, value in cls.dump_durations.items()) + "\n"
+                        "PROFILE: " + ("validation" if VALIDATION_PROFILE else "default") + "\n"
+                        "PREFLIGHT: " + "; ".join(f"{key}:{value}" for key, value in cls.preflight.items()) + "\n"
+                        "DEFERRED: " + "; ".join(f"{key}:{value}" for key, value in cls.deferred.items()) + "\n"
                     )
             with open(file_path, 'w') as validation_info:
                 validation_info.write(content)
@@ -97,16 +419,8 @@ class MySQL_cluster:
 
     @classmethod
     def get_nproc(cls):
-        """ Метод получения количества ядер """
-        nproc = subprocess.run(
-            ["bash", "-c", "nproc"], 
-            check=True, 
-            capture_output=True, 
-            text=True
-            )
-        if nproc.returncode != 0:
-            raise subprocess.CalledProcessError(f"Error executing command nproc: {nproc.stderr}")
-        return int(nproc.stdout.strip())
+        """ Метод получения количества ядер (доступных процессу, как nproc) """
+        return len(os.sched_getaffinity(0))
 
     @classmethod
     def dir_validate(cls, path_dir):
@@ -127,145 +441,315 @@ class MySQL_cluster:
     @staticmethod
     def status_cluster():
         """ Метод проверки статуса кластера """
-        result_cmd = subprocess.run(
-            ["sudo", "systemctl", "is-active", "mysql"],
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
+        result_cmd = run_command(["sudo", "systemctl", "is-active", "mysql"], deadline=COMMAND_DEADLINES['status'], check=False)
         if result_cmd.returncode not in [0, 3, 4]:
-            raise subprocess.CalledProcessError(f"Error getting service status: {result_cmd.stderr}")
+            raise subprocess.CalledProcessError(result_cmd.returncode, result_cmd.args, stderr=result_cmd.stderr)
         else:
             return True if result_cmd.stdout.strip() == 'active' else False
 
-    @staticmethod
-    def stop_cluster():
-        """ Метод остановки кластера """
-        result_cmd = subprocess.run(
-            ["sudo", "systemctl", "stop", "mysql"],
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
-        time.sleep(2)
-        if result_cmd.returncode != 0:
-            raise subprocess.CalledProcessError(f"Service mysql stop failed: {result_cmd.stderr}")
-        else:
-            return True
+    async def ping(self):
+        """ Проверка готовности экземпляра принимать подключения (mysqladmin ping) """
+        command = f"mysqladmin {' '.join(self.client_params())} --connect-timeout=2 ping"
+        try:
+            result = await run_command_async(sudo_bash(command), deadline=COMMAND_DEADLINES['status'], check=False)
+        except subprocess.TimeoutExpired:
+            return False
+        return result.returncode == 0
+
+    async def stopped(self):
+        return not await self.ping()
+
+    @classmethod
+    def apply_validation_profile(cls):
+        """
+        Метод записи (VALIDATION_PROFILE) или удаления профиля валидации для сервиса mysql, применяется при запуске.
+        Файл в /etc/mysql/conf.d пишется через sudo, как и остальные действия с правами root
+        """
+        if not VALIDATION_PROFILE:
+            return cls.remove_validation_profile()
+        write_cmd = f"printf '%s' {shlex.quote(render_mysql_config(validation_profile()))} > {shlex.quote(VALIDATION_PROFILE_FILE)}"
+        run_command(sudo_bash(write_cmd), deadline=COMMAND_DEADLINES['files'])
+        return True
+
+    @classmethod
+    def remove_validation_profile(cls):
+        """
+        Метод удаления профиля валидации: после остановки сервиса и по окончании работы скрипта, чтобы штатный
+        запуск mysql на хосте не получил skip-grant-tables и отключенный doublewrite
+        """
+        run_command(sudo_bash(f"rm -f {shlex.quote(VALIDATION_PROFILE_FILE)}"), deadline=COMMAND_DEADLINES['files'])
+        return True
+
+    @instrumented
+    def stop_cluster(self):
+        """ Метод остановки кластера с ожиданием, пока mysqld перестанет отвечать, профиль валидации удаляется """
+        try:
+            run_command(["sudo", "systemctl", "stop", "mysql"], deadline=COMMAND_DEADLINES['service'])
+            return wait_ready(self.stopped, COMMAND_DEADLINES['ready'], description="mysql stop")
+        finally:
+            self.remove_validation_profile()
     
-    @staticmethod
-    def start_cluster():
+    @instrumented
+    def start_cluster(self):
         """ Метод запуска кластера """
-        result_cmd = subprocess.run(
-            ["sudo", "systemctl", "start", "mysql"],
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
-        time.sleep(2)
-        if result_cmd.returncode != 0:
-            raise subprocess.CalledProcessError(f"Service mysql start failed: {result_cmd.stderr}")
-        else:
-            return True
+        self.apply_validation_profile()
+        run_command(["sudo", "systemctl", "start", "mysql"], deadline=COMMAND_DEADLINES['service'])
+        # вместо фиксированной паузы - опрос готовности принимать подключения
+        return wait_ready(self.ping, COMMAND_DEADLINES['ready'], description="mysql start")
 
-    @classmethod
-    def clear_data_dir(cls):
+    @instrumented
+    def clear_data_dir(self):
         """ Метод очистки директории с данными """
-        if cls.dir_validate(cls.mysql_data_dir):
-            command = f"rm -rf {shlex.quote(cls.mysql_data_dir)}/* {shlex.quote(cls.mysql_data_dir)}/.* 2>/dev/null || true"
-            result = subprocess.run(
-                ["sudo", "-u", cls.username, "bash", "-c", command],
-                capture_output=True,
-                text=True,
-                timeout=120
-            )
-            if result.returncode != 0:
-                raise subprocess.CalledProcessError(f"Warning: Some files may not have been deleted: {result.stderr}")
-            else:
-                return True
+        if self.dir_validate(self.mysql_data_dir):
+            command = f"rm -rf {shlex.quote(self.mysql_data_dir)}/* {shlex.quote(self.mysql_data_dir)}/.* 2>/dev/null || true"
+            run_command(sudo_bash(command, self.username), deadline=COMMAND_DEADLINES['files'])
+            return True
 
-    @classmethod
-    def extract_uuid_smth(cls):
+    def extract_uuid_smth(self):
         """ Метод извлечения значений uuid, smth из файла xtrabackup_galera_info. """
-        file_path = os.path.join(cls.mysql_data_dir, 'xtrabackup_galera_info')
-        if cls.file_validate(file_path):
+        file_path = os.path.join(self.mysql_data_dir, 'xtrabackup_galera_info')
+        if self.file_validate(file_path):
             with open(file_path, 'r') as xtrabackup_galera_info:
                 content = xtrabackup_galera_info.read().strip()
             uuid = content.split(':')[0]
             smth = content.split(':')[-1]
-            file_path = os.path.join(cls.mysql_data_dir, 'grastate.dat')
+            file_path = os.path.join(self.mysql_data_dir, 'grastate.dat')
             content = f"# GALERA saved state\nversion: 2.1\nuuid: {uuid}\nseqno: -1\nsafe_to_bootstrap: 1"
             with open(file_path, 'w') as grastate:
                 grastate.write(content)
         return True
     
-    @classmethod
-    def get_active_databases(cls):
+    def get_active_databases(self):
         """
         Метод получения списка БД из активного кластера
         """
         exclude_db = ['mysql', 'performance_schema', 'sys', 'information_schema']
-        command = "mysql --execute='SHOW DATABASES;' --skip-column-names --batch --silent"
-        show_databases_cmd = subprocess.run(["sudo", "bash", "-c", command], capture_output=True, text=True, timeout=2)
-        databases = [db for db in show_databases_cmd.stdout.strip().split('\n') if db not in exclude_db]
+        databases = [row[0] for row in self.run_sql("SHOW DATABASES;") if row[0] not in exclude_db]
         return sorted(databases)
 
-    @classmethod
-    def get_tables_in_dbs(cls):
+    def get_tables_in_dbs(self):
         """
         Метод получения списка таблиц из каждой БД активного кластера, в виде: {'database: [table_list]'}
         """
-        sql = "SELECT TABLE_SCHEMA, JSON_ARRAYAGG(TABLE_NAME) FROM information_schema.TABLES \
-        WHERE TABLE_SCHEMA NOT IN ('information_schema', 'mysql', 'performance_schema', 'sys') \
-        GROUP BY TABLE_SCHEMA ORDER BY TABLE_SCHEMA;"
-        command = f'mysql --execute="{sql}" --skip-column-names --batch --silent'
-        show_tables_cmd = subprocess.run(["sudo", "bash", "-c", command], capture_output=True, text=True, timeout=2)
-        if show_tables_cmd.returncode != 0:
-            raise subprocess.CalledProcessError(f"Failed to retrieve data for tables: {result.stderr}")
-        dbs_tbls = {db.strip().split('\t', 1)[0]:db.strip().split('\t', 1)[1].strip('[]"').split('", "') for db in show_tables_cmd.stdout.strip().split('\n')}
+        dbs_tbls = {}
+        for db, table in self.iter_tables():
+            dbs_tbls.setdefault(db, []).append(table)
         return dbs_tbls
 
+    def iter_tables(self):
+        """
+        Генератор пар (db, table) активного кластера по мере вывода клиента mysql (первая таблица доступна сразу,
+        список всех таблиц в памяти не собирается)
+        """
+        sql = "SELECT TABLE_SCHEMA, TABLE_NAME FROM information_schema.TABLES \
+        WHERE TABLE_SCHEMA NOT IN ('information_schema', 'mysql', 'performance_schema', 'sys') \
+        ORDER BY TABLE_SCHEMA;"
+        for db, table in self.iter_sql(sql):
+            yield db, table
+
+    def sql_command(self, sql, raw=False):
+        """
+        Аргументы запуска клиента mysql для запроса sql.
+        raw=True - значения без экранирования спецсимволов (--raw), для результатов в виде JSON
+        """
+        command = f"mysql {' '.join(self.client_params())} --execute={shlex.quote(sql)} --skip-column-names --batch --silent"
+        if raw:
+            command += " --raw"
+        return sudo_bash(command)
+
+    def run_sql(self, sql, timeout=COMMAND_DEADLINES['sql'], raw=False):
+        """
+        Метод выполнения SQL-запроса клиентом mysql, возвращает строки результата в виде списков значений
+        """
+        result = run_command(self.sql_command(sql, raw), deadline=timeout)
+        return [line.split('\t') for line in result.stdout.split('\n') if line]
+
+    def iter_sql(self, sql, timeout=COMMAND_DEADLINES['sql'], raw=False):
+        """ Генератор строк результата SQL-запроса по мере вывода клиента mysql (для больших результатов) """
+        for line in iter_command_lines(self.sql_command(sql, raw), deadline=timeout):
+            if line:
+                yield line.split('\t')
+
+    def get_tables_sizes(self):
+        """
+        Метод получения размеров таблиц активного кластера из information_schema, в виде: {db: {table: {'size': bytes, 'rows': rows}}}
+        """
+        sql = "SELECT TABLE_SCHEMA, TABLE_NAME, IFNULL(DATA_LENGTH, 0) + IFNULL(INDEX_LENGTH, 0), IFNULL(TABLE_ROWS, 0) \
+        FROM information_schema.TABLES \
+        WHERE TABLE_SCHEMA NOT IN ('information_schema', 'mysql', 'performance_schema', 'sys') \
+        ORDER BY TABLE_SCHEMA;"
+        dbs_tbls_sizes = {}
+        for db, table, size, rows in self.run_sql(sql):
+            dbs_tbls_sizes.setdefault(db, {})[table] = {'size': int(size), 'rows': int(rows)}
+        return dbs_tbls_sizes
+
+    def get_tables_metadata(self):
+        """
+        Метод получения метаданных таблиц, по которым определяется, менялась ли таблица:
+        размер, оценка количества строк, AUTO_INCREMENT, UPDATE_TIME. В виде {'db.table': {...}}
+        """
+        sql = "SELECT TABLE_SCHEMA, TABLE_NAME, IFNULL(DATA_LENGTH, 0), IFNULL(INDEX_LENGTH, 0), IFNULL(TABLE_ROWS, 0), \
+        IFNULL(AUTO_INCREMENT, 0), IFNULL(UPDATE_TIME, '') FROM information_schema.TABLES \
+        WHERE TABLE_SCHEMA NOT IN ('information_schema', 'mysql', 'performance_schema', 'sys') AND TABLE_TYPE = 'BASE TABLE';"
+        return {f"{db}.{table}": {'db': db, 'table': table, 'size': int(data) + int(index), 'table_rows': int(rows),
+                                  'auto_increment': int(auto_increment), 'update_time': update_time}
+                for db, table, data, index, rows, auto_increment, update_time in self.run_sql(sql)}
+
+    def get_table_chunks(self, db, table, chunks, key=False):
+        """
+        Метод деления таблицы на диапазоны для параллельного чтения. Ключ - первая колонка первичного ключа
+        (или другого индекса) целого типа NOT NULL, границы - из MIN/MAX по индексу.
+        key - колонка ключа из описи (Inventory.chunk_key, None - ключа нет), по умолчанию определяется запросом.
+        Возвращает список условий WHERE, пустой список - таблицу делить нельзя
+        """
+        if chunks < 2 or key is None:
+            return []
+        if key is not False:
+            return self.chunk_bounds(db, table, key, chunks)
+        sql = f"SELECT s.COLUMN_NAME FROM information_schema.STATISTICS s \
+        JOIN information_schema.COLUMNS c ON c.TABLE_SCHEMA = s.TABLE_SCHEMA AND c.TABLE_NAME = s.TABLE_NAME AND c.COLUMN_NAME = s.COLUMN_NAME \
+        WHERE s.TABLE_SCHEMA = '{sql_escape(db)}' AND s.TABLE_NAME = '{sql_escape(table)}' AND s.SEQ_IN_INDEX = 1 \
+        AND c.IS_NULLABLE = 'NO' AND c.DATA_TYPE IN ('tinyint', 'smallint', 'mediumint', 'int', 'bigint') \
+        ORDER BY s.INDEX_NAME = 'PRIMARY' DESC, s.NON_UNIQUE, s.INDEX_NAME LIMIT 1;"
+        key = self.run_sql(sql)
+        if not key:
+            return []
+        return self.chunk_bounds(db, table, key[0][0], chunks)
+
+    def chunk_bounds(self, db, table, column, chunks):
+        """ Условия WHERE диапазонов таблицы по колонке column (границы - MIN/MAX по индексу) """
+        bounds = self.run_sql(f"SELECT MIN({quote_identifier(column)}), MAX({quote_identifier(column)}) "
+                              f"FROM {quote_identifier(db)}.{quote_identifier(table)};")
+        if not bounds or bounds[0][0] == 'NULL':
+            return []
+        return chunk_conditions(column, int(bounds[0][0]), int(bounds[0][1]), chunks)
+
     def __new__(cls, *args, **kwargs):
         cls.dir_validate(os.path.join(cls.backupdir, args[0]))
         return super().__new__(cls)
 
     def __init__(self, cluster_name):
         self.cluster_name = cluster_name
+
+    def client_params(self):
+        """ Параметры подключения клиентов mysql/mysqldump к экземпляру (по умолчанию - сокет из my.cnf) """
+        return [] if self.mysql_socket is None else [f"--socket={shlex.quote(self.mysql_socket)}"]
     
-    def copy_backup_in_datadir(self):
+    def python_staging(self):
+        """ Используется ли копирование движком Staging_engine (нужны права root) """
+        return STAGING_ENGINE == 'python' and os.geteuid() == 0
+
+    @instrumented
+    def copy_backup_in_datadir(self, target_dir=None):
         """
-        Метод копирования файлов бэкапа в директорию данных и изменение владельца на mysql
+        Метод копирования файлов бэкапа в директорию данных (или в target_dir) и изменение владельца на mysql
         """
-        copy_cmd = f"cp -Rp {shlex.quote(self.backupdir)}/{self.cluster_name}/latest/. {shlex.quote(self.mysql_data_dir)}/"
-        result = subprocess.run(["sudo", "bash", "-c", copy_cmd], check=True)
-        if result.returncode != 0:
-            raise subprocess.CalledProcessError(f"Copy failed: {result.stderr}")
-        chown_cmd = f"chown -R {self.username}:{self.username} {shlex.quote(self.mysql_data_dir)}"
-        result = subprocess.run(["sudo", "bash", "-c", chown_cmd], check=True)
-        if result.returncode != 0:
-            raise subprocess.CalledProcessError(f"Owner change error: {result.stderr}")
+        target_dir = self.mysql_data_dir if target_dir is None else target_dir
+        if self.python_staging():
+            # один параллельный проход: владелец устанавливается при копировании, отдельный chown -R не нужен
+            user = pwd.getpwnam(self.username)
+            os.chown(target_dir, user.pw_uid, user.pw_gid)
+            decompressor = Decompression_engine(user.pw_uid, user.pw_gid) if DECOMPRESS_ENGINE == 'python' else None
+            engine = Staging_engine(user.pw_uid, user.pw_gid, link_compressed=STAGING_HARDLINK_COMPRESSED, decompressor=decompressor,
+                                    progress=progress.reporter(self.cluster_name))
+            self.staging_stats = engine.copy_tree(os.path.join(self.backupdir, self.cluster_name, 'latest'), target_dir)
+            # сжатые файлы, которые распаковщик не распознал, распаковывает xtrabackup --decompress
+            self.decompressed = decompressor is not None and not self.staging_stats['compressed']
+            return True
+        # cp ничего не выводит: ход копирования - прирост занятого места в целевой файловой системе
+        progress.watch(self.cluster_name, disk_growth(target_dir), counts=True)
+        copy_cmd = f"cp -Rp {shlex.quote(self.backupdir)}/{self.cluster_name}/latest/. {shlex.quote(target_dir)}/"
+        run_command(sudo_bash(copy_cmd), deadline=COMMAND_DEADLINES['files'])
+        chown_cmd = f"chown -R {self.username}:{self.username} {shlex.quote(target_dir)}"
+        run_command(sudo_bash(chown_cmd), deadline=COMMAND_DEADLINES['files'])
         return True
-        
-    def xtrabackup_restore(self):
+
+    @instrumented
+    def xtrabackup_decompress(self, target_dir=None):
         """
-        Метод восстановления директории данных (когда файлы из бэкапа уже скопированы)
+        Метод распаковки сжатых файлов бэкапа в директории данных (или в target_dir).
+        Если файлы уже распакованы при копировании (DECOMPRESS_ENGINE = 'python'), повторный проход не выполняется
+        """
+        if self.decompressed:
+            return True
+        target_dir = self.mysql_data_dir if target_dir is None else target_dir
+        nproc = self.get_nproc()
+        decompress_cmd = f"xtrabackup --parallel={nproc} --decompress --remove-original --target-dir={shlex.quote(target_dir)}"
+        progress.watch(self.cluster_name, disk_growth(target_dir))
+        run_command(sudo_bash(decompress_cmd, self.username), deadline=COMMAND_DEADLINES['xtrabackup'], capture=False,
+                    on_line=lambda: progress.heartbeat(self.cluster_name))
+        return True
+
+    @instrumented
+    def xtrabackup_prepare(self):
+        """
+        Метод подготовки (prepare) распакованных файлов в директории данных
         """
         nproc = self.get_nproc()
-        decompress_cmd = f"xtrabackup --parallel={nproc} --decompress --remove-original --target-dir={shlex.quote(self.mysql_data_dir)}"
-        result = subprocess.run(["sudo", "-u", self.username, "bash", "-c", decompress_cmd], check=True)
-        if result.returncode != 0:
-            raise subprocess.CalledProcessError(f"Data decompression error: {result.stderr}")
         restore_cmd = f"xtrabackup --prepare --rebuild-threads={nproc} --target-dir={shlex.quote(self.mysql_data_dir)}"
-        result = subprocess.run(["sudo", "-u", self.username, "bash", "-c", restore_cmd], check=True)
-        if result.returncode != 0:
-            raise subprocess.CalledProcessError(f"Restore failed: {result.stderr}")
+        # ход prepare - строки вывода xtrabackup (применение журнала пишет на место, занятое место не меняется)
+        progress.watch(self.cluster_name)
+        run_command(sudo_bash(restore_cmd, self.username), deadline=COMMAND_DEADLINES['xtrabackup'], capture=False,
+                    on_line=lambda: progress.heartbeat(self.cluster_name))
         self.extract_uuid_smth()
+        if self.python_staging():
+            # файлы уже принадлежат mysql (скопированы Staging_engine, созданы xtrabackup от mysql), кроме grastate.dat
+            user = pwd.getpwnam(self.username)
+            os.chown(os.path.join(self.mysql_data_dir, 'grastate.dat'), user.pw_uid, user.pw_gid)
+            return True
         chown_cmd = f"chown -R {self.username}:{self.username} {shlex.quote(self.mysql_data_dir)}"
-        result = subprocess.run(["sudo", "bash", "-c", chown_cmd], check=True)
-        if result.returncode != 0:
-            raise subprocess.CalledProcessError(f"Owner change error: {result.stderr}")
+        run_command(sudo_bash(chown_cmd), deadline=COMMAND_DEADLINES['files'])
+        return True
+
+    def xtrabackup_restore(self):
+        """
+        Метод восстановления директории данных (когда файлы из бэкапа уже скопированы)
+        """
+        self.xtrabackup_decompress()
+        return self.xtrabackup_prepare()
+
+    @property
+    def staging_dir(self):
+        """ Директория промежуточной подготовки бэкапа кластера """
+        return os.path.join(self.staging_root, self.cluster_name)
+
+    @instrumented
+    def stage_backup(self):
+        """
+        Метод копирования бэкапа в (предварительно очищенную) промежуточную директорию.
+        Выполняется параллельно с восстановлением/дампом предыдущего кластера
+        """
+        command = f"rm -rf {shlex.quote(self.staging_dir)} && mkdir -p {shlex.quote(self.staging_dir)}"
+        run_command(sudo_bash(command), deadline=COMMAND_DEADLINES['files'])
+        return self.copy_backup_in_datadir(target_dir=self.staging_dir)
+
+    def remove_staging(self):
+        """ Метод удаления промежуточной директории (подготовка бэкапа больше не нужна или завершилась ошибкой) """
+        run_command(sudo_bash(f"rm -rf {shlex.quote(self.staging_dir)}"), deadline=COMMAND_DEADLINES['files'])
+        return True
+
+    @instrumented
+    def swap_staging_in_datadir(self):
+        """
+        Метод переноса подготовленных файлов из промежуточной директории в (очищенную) директорию данных.
+        Промежуточная директория должна находиться в той же файловой системе, тогда mv - это rename
+        """
+        self.dir_validate(self.staging_dir)
+        command = (f"find {shlex.quote(self.staging_dir)} -mindepth 1 -maxdepth 1 "
+                   f"-exec mv -t {shlex.quote(self.mysql_data_dir)} {{}} + && rmdir {shlex.quote(self.staging_dir)}")
+        run_command(sudo_bash(command), deadline=COMMAND_DEADLINES['files'])
         return True
 
+    @instrumented
+    def preflight_check(self, expected_tables=None, backup_tables=None, previous_to_lsn=None):
+        """
+        Метод предварительной проверки бэкапа до копирования (integrity.check_backup): служебные файлы xtrabackup,
+        непрерывность LSN, наличие файлов таблиц из описи, выборочная проверка страниц .ibd. Возвращает отчет
+        """
+        path_backup = os.path.join(self.backupdir, self.cluster_name, 'latest')
+        self.dir_validate(path_backup)
+        return check_backup(path_backup, expected_tables, backup_tables, previous_to_lsn)
+
     def get_databases_in_backup(self):
         """
         Метод получения списка БД из директорий БД в бэкапе
@@ -280,6 +764,29 @@ class MySQL_cluster:
                     directories.append(entry.name)
         return sorted(directories)
 
+    def get_tables_sizes_in_backup(self):
+        """
+        Метод получения размеров таблиц по файлам .ibd (в т.ч. сжатым .ibd.qp/.ibd.zst/.ibd.lz4) в бэкапе,
+        в виде: {db: {table: {'size': bytes, 'rows': 0, 'mtime': seconds}}}. Секции партиционированных таблиц суммируются
+        """
+        dbs_tbls_sizes = {}
+        path_backup = os.path.join(self.backupdir, self.cluster_name, 'latest')
+        for db in self.get_databases_in_backup():
+            tables = {}
+            with os.scandir(os.path.join(path_backup, db)) as entries:
+                for entry in entries:
+                    match = re.fullmatch(r'(.+)\.ibd(\.qp|\.zst|\.lz4)?', entry.name)
+                    if not entry.is_file() or match is None:
+                        continue
+                    table = decode_mysql_filename(match.group(1))
+                    tables.setdefault(table, {'size': 0, 'rows': 0, 'mtime': 0})
+                    stat = entry.stat()
+                    tables[table]['size'] += stat.st_size
+                    tables[table]['mtime'] = max(tables[table]['mtime'], int(stat.st_mtime))
+            dbs_tbls_sizes[decode_mysql_filename(db)] = tables
+        return dbs_tbls_sizes
+
+    @instrumented
     def start_dump(self, param_list=None, dump_filename=None):
         """
         Метод запуска процесса снятия дампа. Если список параметров не передан, то снимается только схема данных без самих данных.
@@ -301,47 +808,143 @@ class MySQL_cluster:
             ]
         if dump_filename is not None:
             param_list.append(f"--result-file='{os.path.join(self.true_dump_dir, dump_filename)}'") 
-        dump_cmd = "mysqldump " + " ".join(param_list) 
-        dump_result = subprocess.run(["sudo", "bash", "-c", dump_cmd],
-            stdout=subprocess.DEVNULL,
-            timeout=300  # 5 минут таймаут
-        )
-        if dump_result.returncode != 0:
-            raise subprocess.CalledProcessError(f"Dump error: {dump_result.stderr}")
+        dump_cmd = "mysqldump " + " ".join(self.client_params() + param_list)
+        run_command(sudo_bash(dump_cmd), deadline=COMMAND_DEADLINES['schema_dump'], stdout=subprocess.DEVNULL)
         return True
 
     def get_size_cluster(self):
         """
-        Метод получения размера экземпляра бэкапа
+        Метод получения размера экземпляра бэкапа (для отчета, в формате du -h по размеру get_backup_bytes)
         """
-        size_cmd = f"du -sh {os.path.join(self.backupdir, self.cluster_name, 'latest')}"
-        size_result = subprocess.run(["sudo", "bash", "-c", size_cmd], capture_output=True, text=True, check=True)
-        if size_result.returncode != 0:
-            raise subprocess.CalledProcessError(f"Error getting directory size: {size_result.stderr}")
-        return size_result.stdout.split()[0].strip()
+        return format_size(self.get_backup_bytes())
+
+    def get_backup_bytes(self):
+        """
+        Метод получения размера бэкапа в байтах (для прогноза длительности валидации и отчета).
+        Бэкап измеряется один раз за запуск (обычно планировщиком), дальше используется сохраненное значение
+        """
+        if self.cluster_name not in self.backup_bytes:
+            size_cmd = f"du -sb {shlex.quote(os.path.join(self.backupdir, self.cluster_name, 'latest'))}/"
+            size_result = run_command(sudo_bash(size_cmd), deadline=COMMAND_DEADLINES['size'])
+            self.backup_bytes[self.cluster_name] = int(size_result.stdout.split()[0])
+        return self.backup_bytes[self.cluster_name]
 
 
 class Worker(threading.Thread):
     def __init__(self, queue):
         threading.Thread.__init__(self)
         self.queue = queue
+        self.outcomes = [] # (команда, 'ok'/'failed'/'timeout', хвост stderr)
         
     def run(self):
         while True:
+            command_str = self.queue.get() # результат в виде кортежа, None - команд больше не будет
+            if command_str is None:
+                self.queue.task_done()
+                break
             try:
-                command_str = self.queue.get(True, 1) # результат в виде кортежа
                 self.start_dump(command_str[0]) # первый и единственный элемент кортежа
-                
+                self.outcomes.append((command_str[0], 'ok', None))
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                # ошибка одной таблицы не останавливает поток, очередь разбирается до конца
+                status = 'timeout' if isinstance(e, subprocess.TimeoutExpired) else 'failed'
+                self.outcomes.append((command_str[0], status, error_tail(e)))
+                logging.error(f"Dump command {status}: {error_tail(e, 1)}")
+            finally:
                 self.queue.task_done()
-            except queue.Empty:
-                break
 
     def start_dump(self, command_str): 
-        dump_result = subprocess.run(["sudo", "bash", "-c", command_str],
-            stdout=subprocess.DEVNULL,
-            timeout=300  # 5 минут таймаут
-        )
-        if dump_result.returncode != 0:
-            raise subprocess.CalledProcessError(f"Error dumping table")
-        else:
-            return True
+        return start_dump(command_str)
+
+
+class MySQL_instance(MySQL_cluster):
+    """
+    Класс отдельного экземпляра mysqld для параллельной валидации кластера:
+    своя директория данных, порт, сокет и бюджет памяти из CLUSTER_INSTANCES
+    """
+    run_dir = INSTANCES_RUN_DIR
+
+    def __init__(self, cluster_name, instance_config=None):
+        super().__init__(cluster_name)
+        if instance_config is None:
+            instance_config = CLUSTER_INSTANCES[cluster_name]
+        self.port = instance_config['port']
+        self.memory = instance_config['memory'] # МБ
+        self.mysql_data_dir = instance_config.get('datadir', os.path.join(INSTANCES_DIR, cluster_name))
+        self.instance_dir = os.path.join(self.run_dir, cluster_name)
+        self.mysql_socket = os.path.join(self.instance_dir, 'mysqld.sock')
+        self.pid_file = os.path.join(self.instance_dir, 'mysqld.pid')
+        self.config_file = os.path.join(self.instance_dir, 'my.cnf')
+
+    def instance_config(self):
+        """ Метод формирования настроек экземпляра на основе MYSQL_CONFIG (или профиля валидации) """
+        config = validation_profile(self.memory) if VALIDATION_PROFILE else copy.deepcopy(MYSQL_CONFIG)
+        config.setdefault('mysqld', {}).update({
+            'datadir': self.mysql_data_dir,
+            'port': self.port,
+            'socket': self.mysql_socket,
+            'pid-file': self.pid_file,
+            'log-error': os.path.join(self.instance_dir, 'mysqld.err'),
+            'loose-mysqlx': 'OFF', # X Protocol не нужен, а его порт общий для всех экземпляров
+            'innodb_buffer_pool_size': f"{self.memory}M",
+        })
+        return config
+
+    def create_instance_dirs(self):
+        """
+        Метод создания директорий экземпляра и его конфигурационного файла. Директории после chown принадлежат
+        пользователю mysql, поэтому конфигурационный файл пишется через sudo, как и остальная подготовка экземпляра
+        """
+        command = (f"mkdir -p {shlex.quote(self.mysql_data_dir)} {shlex.quote(self.instance_dir)} && "
+                   f"chown {self.username}:{self.username} {shlex.quote(self.mysql_data_dir)} {shlex.quote(self.instance_dir)} && "
+                   f"printf '%s' {shlex.quote(render_mysql_config(self.instance_config()))} > {shlex.quote(self.config_file)}")
+        run_command(sudo_bash(command), deadline=COMMAND_DEADLINES['files'])
+        return True
+
+    def clear_data_dir(self):
+        """ Метод очистки директории с данными экземпляра (директории создаются при необходимости) """
+        self.create_instance_dirs()
+        return super().clear_data_dir()
+
+    def status_cluster(self):
+        """ Метод проверки статуса экземпляра (отвечает ли mysqld на сокете) """
+        return asyncio.run(self.ping())
+
+    async def pid_file_removed(self):
+        return not os.path.exists(self.pid_file)
+
+    @instrumented
+    def start_cluster(self):
+        """ Метод запуска экземпляра с ожиданием готовности принимать подключения """
+        command = f"mysqld --defaults-file={shlex.quote(self.config_file)} --user={self.username} --daemonize"
+        run_command(sudo_bash(command), deadline=INSTANCE_START_TIMEOUT)
+        return wait_ready(self.ping, INSTANCE_START_TIMEOUT, description=command)
+
+    @instrumented
+    def stop_cluster(self):
+        """ Метод остановки экземпляра с ожиданием завершения процесса mysqld """
+        command = f"mysqladmin {' '.join(self.client_params())} shutdown"
+        run_command(sudo_bash(command), deadline=COMMAND_DEADLINES['service'])
+        return wait_ready(self.pid_file_removed, INSTANCE_START_TIMEOUT, description=command)
+
+
+class Memory_budget:
+    """
+    Бюджет памяти (МБ) для одновременно запущенных экземпляров mysqld.
+    Экземпляр, который больше всего бюджета, допускается только когда остальные остановлены
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, amount):
+        with self.condition:
+            while self.used and self.used + amount > self.limit:
+                self.condition.wait()
+            self.used += amount
+
+    def release(self, amount):
+        with self.condition:
+            self.used -= amount
+            self.condition.notify_all()
@@ -6,7 +6,179 @@ TRUE_DUMP_DIR = '/test_dump'
 TRUE_DUMP = True
 CLUSTER_NAMES = ['crm_prod', 'any_test_db']
 
-# Конфигурационные настройки MySQL в скрипте валидации не используются, это задел на будущее
+# Потоковый режим дампа: вывод mysqldump читается через pipe порциями, считаются байты, строки и контрольная сумма.
+# При TRUE_DUMP поток сразу сжимается в TRUE_DUMP_DIR/<db>_<table>.dump.gz, несжатый файл на диск не пишется
+STREAM_DUMP = False
+STREAM_CHUNK_SIZE = 1024 * 1024
+STREAM_COMPRESS_LEVEL = 6
+
+# Архив дампов кластера (archive.py): при TRUE_DUMP дампы всех таблиц потоково сжимаются в один файл
+# TRUE_DUMP_DIR/<cluster_name>.dumps с индексом экстентов, блоки сжимаются параллельно (gzip или zstd при наличии zstandard)
+DUMP_ARCHIVE = False # по умолчанию выключено: дампы пишутся отдельными файлами, как раньше
+ARCHIVE_CODEC = 'zstd'
+ARCHIVE_ZSTD_LEVEL = 3
+ARCHIVE_BLOCK_SIZE = 4 * 1024 * 1024
+ARCHIVE_THREADS = 2 # потоков сжатия на каждый процесс дампа
+
+# Распределенная валидация (--coordinator / --agent URL): координатор хранит очередь кластеров запуска
+# (STATS_DIR/validation_queue.db) и выдает их агентам на хостах восстановления с арендой на JOB_LEASE_SECONDS,
+# агент продлевает аренду, пока работает. Задание с истекшей арендой возвращается в очередь (не более JOB_MAX_ATTEMPTS выдач).
+# Каталоги бэкапов должны быть примонтированы на всех хостах агентов. Без MULTI_INSTANCE на хосте работает один агент
+# (общий MYSQL_DATA_DIR), второй агент хоста не запускается
+COORDINATOR_ADDRESS = '127.0.0.1' # для агентов на других хостах - адрес интерфейса, тогда обязателен COORDINATOR_TOKEN
+COORDINATOR_PORT = 8765
+COORDINATOR_TOKEN = None # общий токен координатора и агентов (заголовок Authorization: Bearer), None - без проверки (только 127.0.0.1)
+JOB_LEASE_SECONDS = 300
+JOB_MAX_ATTEMPTS = 3
+AGENT_POLL_INTERVAL = 10
+COORDINATOR_AGENTS = 1 # агентов, одновременно выполняющих задания запуска (дорожек планировщика в режиме --coordinator)
+
+# Ход валидации (progress.py): этап каждого кластера, выполненные таблицы и байты относительно итогов описи,
+# сглаженная скорость и оценка окончания. Каждые PROGRESS_INTERVAL секунд переписывается STATS_DIR/validation_progress.json,
+# при заданных PROGRESS_HTTP_PORT (только 127.0.0.1) или PROGRESS_SOCKET то же состояние отдается по GET.
+# Этап копирования, дампа или выборки без продвижения дольше PROGRESS_STALL_SECONDS помечается stalled
+PROGRESS_INTERVAL = 10
+PROGRESS_SMOOTHING = 0.3 # вес нового замера скорости в экспоненциальном среднем
+PROGRESS_STALL_SECONDS = 900
+PROGRESS_HTTP_PORT = None
+PROGRESS_SOCKET = None # например '/run/backup_validation/progress.sock'
+
+# Планировщик порядка кластеров (planner.py): длительность валидации прогнозируется по размеру бэкапа и истории
+# запусков (медиана секунд на байт последних PLANNER_HISTORY_RUNS успешных запусков), кластеры упорядочиваются
+# по приоритету (меньше - важнее) и укладываются в окно VALIDATION_WINDOW (секунды, None - без ограничения).
+# Не поместившиеся откладываются (DEFERRED в отчете) и в следующий раз идут первыми среди кластеров своего приоритета,
+# критичные (приоритет <= CRITICAL_PRIORITY) не откладываются никогда
+CLUSTER_PRIORITIES = {'crm_prod': 0}
+DEFAULT_CLUSTER_PRIORITY = 100
+CRITICAL_PRIORITY = 0
+VALIDATION_WINDOW = 8 * 3600
+PLANNER_LANES = None # одновременно валидируемых кластеров, None - COORDINATOR_AGENTS при --coordinator, MAX_PARALLEL_INSTANCES при MULTI_INSTANCE, иначе 1
+PLANNER_HISTORY_RUNS = 10
+PLANNER_DEFAULT_THROUGHPUT = 20 * 1024 * 1024 # байт бэкапа в секунду, пока истории нет
+PLANNER_SAFETY_FACTOR = 1.2
+
+# Конвейерная обработка кластеров: копирование и распаковка следующего кластера в STAGING_DIR
+# идет параллельно с восстановлением и дампом текущего. STAGING_DIR должна быть в той же ФС, что и MYSQL_DATA_DIR
+PIPELINE_STAGING = False # по умолчанию выключено: кластеры копируются по очереди, как раньше
+STAGING_DIR = '/data/mysql_staging'
+# Движок копирования бэкапа: 'cp' (cp -Rp + chown -R) или 'python' (один проход по latest/, параллельное копирование
+# reflink/copy_file_range с установкой владельца при копировании; требует запуска от root, иначе используется cp)
+STAGING_ENGINE = 'cp' # по умолчанию - прежний cp -Rp + chown -R
+STAGING_COPY_THREADS = 8
+STAGING_HARDLINK_COMPRESSED = False # сжатые .qp/.zst/.lz4 связываются жесткой ссылкой (бэкап и данные в одной ФС)
+# Движок распаковки: 'xtrabackup' (xtrabackup --decompress --remove-original после копирования) или 'python'
+# (потоковая распаковка .qp/.zst/.lz4 во время копирования движком Staging_engine, один проход чтения бэкапа;
+# нужны qpress/zstd/lz4 или пакет zstandard, файлы без способа распаковки распаковывает xtrabackup).
+# Очередь ограничивает число файлов, ожидающих распаковки
+DECOMPRESS_ENGINE = 'xtrabackup' # по умолчанию - прежний xtrabackup --decompress
+DECOMPRESS_THREADS = 8
+DECOMPRESS_QUEUE_SIZE = 16
+
+# Движок проверки читаемости таблиц: 'mysqldump' или 'native' (постоянные подключения через pymysql,
+# чтение строк серверным курсором). При TRUE_DUMP всегда используется mysqldump - нужен файл дампа
+READER_ENGINE = 'mysqldump'
+READER_BATCH_ROWS = 10000
+READER_READ_TIMEOUT = 600 # секунд ожидания ответа сервера на подключении читателя (время таблицы ограничено dump_deadline)
+MYSQL_USER = 'root'
+MYSQL_PASSWORD = None
+MYSQL_SOCKET = '/var/run/mysqld/mysqld.sock'
+
+# Предварительная проверка бэкапа до копирования (integrity.py): xtrabackup_checkpoints/_info/_galera_info, непрерывность LSN,
+# наличие файлов, выборочная проверка страниц несжатых .ibd (контрольные суммы - при установленном пакете crc32c).
+# Кластер с ошибками не восстанавливается, его место в очереди занимает следующий
+PREFLIGHT_CHECK = True
+PREFLIGHT_SAMPLE_PAGES = 16 # случайных страниц на файл (плюс первая и последняя)
+PREFLIGHT_THREADS = 8
+
+# Опись таблиц кластера (inventory.py): файлы бэкапа + один запрос к information_schema, кэшируется
+# в STATS_DIR/inventory по идентификатору бэкапа (xtrabackup_checkpoints/xtrabackup_info) и используется всеми этапами
+INVENTORY_CACHE = True
+
+# Контрольные суммы содержимого таблиц восстановленного экземпляра: манифест по кластеру в STATS_DIR/manifests
+# сравнивается с манифестом предыдущего запуска или с манифестом, снятым на источнике (CHECKSUM_BASELINE_DIR)
+CHECKSUM_TABLES = False
+CHECKSUM_CONCURRENCY = 4 # количество одновременных запросов контрольных сумм
+CHECKSUM_BASELINE_DIR = None # директория с манифестами источника <cluster_name>.json, None - предыдущий запуск
+# Доля таблиц с неизменными метаданными, которые все равно пересчитываются (давно не проверявшиеся первыми):
+# отличие данных у такой таблицы - повреждение (corrupt) и при сравнении с предыдущим запуском
+CHECKSUM_VERIFY_SHARE = 1 / 7
+
+# Инкрементальная валидация (--incremental): полностью читаются только изменившиеся таблицы и доля неизменных
+# (давно не проверявшиеся первыми), чтобы за 1 / INCREMENTAL_SAMPLE_FRACTION запусков был пройден весь набор.
+# Отпечатки таблиц хранятся в SQLite STATS_DIR/validation_state.db. ibd_mtime по умолчанию не сравнивается:
+# xtrabackup выставляет время копирования, и в каждом новом бэкапе оно другое
+INCREMENTAL_SAMPLE_FRACTION = 1 / 7
+INCREMENTAL_FINGERPRINT = ('ibd_size', 'table_rows', 'auto_increment', 'update_time')
+
+# Выборочная проверка (--sample) вместо полного дампа: таблица делится на сегменты по SAMPLE_SEGMENT_ROWS строк,
+# читаются следующие непройденные сегменты (вся таблица - за SAMPLE_CYCLE_DAYS запусков) и случайные - до доли
+# SAMPLE_FRACTION или до уровня доверия SAMPLE_CONFIDENCE обнаружить повреждение доли SAMPLE_DEFECT_RATE сегментов.
+# 1 / SAMPLE_CYCLE_DAYS таблиц за запуск проверяется целиком (CHECK TABLE ... QUICK, количество строк по индексам)
+SAMPLE_SEGMENT_ROWS = 100000
+SAMPLE_FRACTION = 0.05
+SAMPLE_CONFIDENCE = 0.95
+SAMPLE_DEFECT_RATE = 0.01
+SAMPLE_CYCLE_DAYS = 7
+SAMPLE_CONCURRENCY = 4
+
+# Адаптивное количество одновременных дампов (AIMD): +1 пока пропускная способность не падает,
+# уменьшение вдвое при насыщении: iowait хоста, Threads_running сервера или load average выше порогов
+ADAPTIVE_CONCURRENCY = False
+CONCURRENCY_MIN = 1
+CONCURRENCY_MAX = 32
+CONCURRENCY_INTERVAL = 5 # период пересчета, секунд
+CONCURRENCY_IOWAIT_LIMIT = 0.3 # доля времени CPU в iowait
+CONCURRENCY_THREADS_RUNNING_FACTOR = 2 # Threads_running > ядер * factor - сервер насыщен
+CONCURRENCY_LOAD_FACTOR = 2 # load average за 1 минуту > ядер * factor - хост насыщен
+
+# Параметры планировщика задач дампа (крупные таблицы первыми, мелкие - пачками)
+DUMP_SIZE_SOURCE = 'information_schema' # источник размеров таблиц: 'information_schema' или 'backup' (.ibd файлы в latest/)
+SMALL_TABLE_SIZE = 1024 * 1024 # таблицы меньше этого размера (байт) объединяются в пачки
+SMALL_TABLES_BATCH_SIZE = 64 * 1024 * 1024 # максимальный суммарный размер пачки мелких таблиц (байт)
+SMALL_TABLES_BATCH_COUNT = 50 # максимальное количество таблиц в одной пачке
+CHUNKED_TABLE_SIZE = 1024 * 1024 * 1024 # таблицы больше этого размера читаются параллельно по диапазонам ключа
+TABLE_CHUNKS = 4 # количество диапазонов (параллельных читателей) одной крупной таблицы
+SCHEDULE_WINDOW = 64 # окно планирования при потоковой выдаче задач (iter_tasks): крупнейшая из стольких задач выдается первой
+
+# Слой запуска команд (commands.py): ограничения времени по видам команд (секунды, None - без ограничения),
+# интервал опроса готовности вместо фиксированных пауз, уровень записи вывода команд в лог
+COMMAND_DEADLINES = {
+    'status': 60,       # systemctl is-active, mysqladmin ping
+    'service': 300,     # systemctl start/stop
+    'ready': 600,       # ожидание готовности/остановки mysqld после systemctl
+    'sql': 600,         # запросы клиентом mysql (в т.ч. списки БД и таблиц)
+    'files': 3600,      # очистка, копирование, перенос директорий
+    'xtrabackup': None, # распаковка и prepare
+    'dump': 300,        # дамп одной задачи
+    'schema_dump': 1800,
+    'size': 600,        # du
+}
+READINESS_PROBE_INTERVAL = 0.5
+COMMAND_KILL_GRACE = 10 # секунд между SIGTERM и SIGKILL при превышении ограничения времени
+COMMAND_OUTPUT_LOG_LEVEL = 'DEBUG'
+
+# Изоляция ошибок дампа: ограничение времени задачи растет с ее размером (COMMAND_DEADLINES['dump'] + размер / скорость),
+# временные ошибки (потеря соединения, блокировки, превышение времени) повторяются с растущей паузой
+DUMP_DEADLINE_THROUGHPUT = 4 * 1024 * 1024 # минимальная ожидаемая скорость дампа (байт/с)
+DUMP_RETRIES = 2 # повторов задачи после временной ошибки
+DUMP_RETRY_BACKOFF = 5 # пауза перед первым повтором (секунды), удваивается
+DUMP_RETRY_BACKOFF_MAX = 60
+DUMP_TRANSIENT_ERRORS = (1040, 1205, 1213, 2002, 2003, 2006, 2013) # коды ошибок MySQL, после которых задача повторяется
+
+# Режим нескольких экземпляров: каждый кластер валидируется своим mysqld (директория данных, порт, сокет, память),
+# одновременно запускается не более MAX_PARALLEL_INSTANCES экземпляров с суммарной памятью не более INSTANCES_MEMORY_LIMIT (МБ)
+MULTI_INSTANCE = False
+MAX_PARALLEL_INSTANCES = 2
+INSTANCES_MEMORY_LIMIT = 8192
+INSTANCES_DIR = '/data/mysql_instances' # директории данных экземпляров по умолчанию: INSTANCES_DIR/<cluster_name>
+INSTANCES_RUN_DIR = '/run/mysqld_validation' # сокеты, pid и конфигурационные файлы экземпляров
+INSTANCE_START_TIMEOUT = 600
+CLUSTER_INSTANCES = {
+    'crm_prod': {'port': 3307, 'memory': 4096},
+    'any_test_db': {'port': 3308, 'memory': 1024, 'datadir': '/data/mysql_instances/any_test_db'},
+}
+
+# Конфигурационные настройки MySQL: основа для конфигурации экземпляров (MULTI_INSTANCE) и профиля валидации
 MYSQL_CONFIG_FILE = '/etc/mysql/my.cnf'
 MYSQL_CONFIG = {
     'mysqld':{
@@ -14,5 +186,30 @@ MYSQL_CONFIG = {
     },
 }
 
+# Профиль одноразового экземпляра проверки: сохранность данных при сбое не нужна (doublewrite, сброс журнала
+# при коммите, binlog), проверка прав и сеть не нужны, буферный пул - доля памяти хоста (или бюджет экземпляра).
+# Для сервиса mysql профиль записывается в VALIDATION_PROFILE_FILE (подключается через !includedir /etc/mysql/conf.d/)
+# и удаляется после остановки. Включать только на выделенном хосте проверки: если скрипт будет убит (SIGKILL,
+# отключение питания), штатный mysqld хоста запустится со skip-grant-tables. Экземпляры MULTI_INSTANCE
+# получают профиль через свой --defaults-file, системный conf.d не меняется
+VALIDATION_PROFILE = False
+VALIDATION_PROFILE_FILE = '/etc/mysql/conf.d/zz-validation.cnf'
+VALIDATION_BUFFER_POOL_SHARE = 0.5
+VALIDATION_PROFILE_OPTIONS = {
+    'mysqld': {
+        'innodb_doublewrite': 0,
+        'innodb_flush_log_at_trx_commit': 0,
+        'sync_binlog': 0,
+        'loose-disable-log-bin': True,
+        'skip-grant-tables': True,
+        'skip-networking': True,
+        'innodb_read_io_threads': 16,
+        'innodb_buffer_pool_load_at_startup': 0,
+        'innodb_buffer_pool_dump_at_shutdown': 0,
+        'performance_schema': 0,
+        'loose-wsrep_provider': 'none', # экземпляр проверки не должен присоединяться к кластеру Galera
+    },
+}
+
 if __name__ == "__main__":
     print('This is a configuration file')
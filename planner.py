@@ -0,0 +1,95 @@
+import os
+import time
+import sqlite3
+import statistics
+from mysqlconf import STATS_DIR, CLUSTER_PRIORITIES, DEFAULT_CLUSTER_PRIORITY, CRITICAL_PRIORITY, VALIDATION_WINDOW
+from mysqlconf import PLANNER_HISTORY_RUNS, PLANNER_DEFAULT_THROUGHPUT, PLANNER_SAFETY_FACTOR
+
+# Блок отдельных функций
+def parse_time(value):
+    """ Обратное преобразование format_time: 'чч:мм:сс' в секунды """
+    hours, minutes, seconds = (int(part) for part in value.split(':'))
+    return hours * 3600 + minutes * 60 + seconds
+
+def plan_order(predictions, priorities=None, window=VALIDATION_WINDOW, lanes=1, overdue=()):
+    """
+    Порядок валидации кластеров в окне window (секунды, None - без ограничения) на lanes одновременных линиях.
+    Кластеры сортируются по приоритету (меньше - важнее), отложенные в прошлый раз (overdue) - раньше прочих того же
+    приоритета, затем по убыванию прогноза (LPT). Кластер ставится на наименее загруженную линию, если не помещается
+    в окно - откладывается (кроме критичных, priority <= CRITICAL_PRIORITY).
+    predictions - {кластер: прогноз в секундах}. Возвращает (порядок, отложенные, прогноз окончания в секундах)
+    """
+    priorities = CLUSTER_PRIORITIES if priorities is None else priorities
+    ordered = sorted(predictions, key=lambda name: (priorities.get(name, DEFAULT_CLUSTER_PRIORITY), name not in overdue,
+                                                    -predictions[name]))
+    loads = [0.0] * lanes
+    planned, deferred = [], []
+    for name in ordered:
+        lane = loads.index(min(loads))
+        critical = priorities.get(name, DEFAULT_CLUSTER_PRIORITY) <= CRITICAL_PRIORITY
+        if window is not None and loads[lane] + predictions[name] > window and not critical:
+            deferred.append(name)
+            continue
+        loads[lane] += predictions[name]
+        planned.append(name)
+    return planned, deferred, max(loads)
+
+
+class Run_history:
+    """
+    История валидаций кластеров (SQLite STATS_DIR/validation_state.db): размер бэкапа и длительности этапов
+    каждого запуска, а также отложенные планировщиком кластеры. Используется для прогноза времени валидации
+    """
+    def __init__(self, file_path=None):
+        self.file_path = file_path or os.path.join(STATS_DIR, 'validation_state.db')
+        self.connection = sqlite3.connect(self.file_path, timeout=30)
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS cluster_history (cluster TEXT, finished_at INTEGER, backup_bytes INTEGER, "
+            "restore_seconds INTEGER, start_seconds INTEGER, dump_seconds INTEGER, val_seconds INTEGER, exit_code INTEGER);"
+            "CREATE INDEX IF NOT EXISTS cluster_history_cluster ON cluster_history (cluster, finished_at);"
+            "CREATE TABLE IF NOT EXISTS cluster_deferrals (cluster TEXT PRIMARY KEY, deferred_at INTEGER);"
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, cluster_name, backup_bytes, stats):
+        """ Запись завершенной валидации (stats - статистика кластера, см. cluster_stats) """
+        self.connection.execute(
+            "INSERT INTO cluster_history VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (cluster_name, int(time.time()), backup_bytes, parse_time(stats['restor_duration']), parse_time(stats['start_duration']),
+             parse_time(stats['dump_duration']), parse_time(stats['val_duration']), stats['exit_code'])
+        )
+        self.connection.execute("DELETE FROM cluster_deferrals WHERE cluster = ?", (cluster_name,))
+        self.connection.commit()
+        return True
+
+    def defer(self, cluster_names):
+        self.connection.executemany("INSERT OR IGNORE INTO cluster_deferrals VALUES (?, ?)",
+                                    [(cluster_name, int(time.time())) for cluster_name in cluster_names])
+        self.connection.commit()
+
+    def overdue(self):
+        """ Кластеры, отложенные в прошлых запусках и с тех пор не валидированные """
+        return {row[0] for row in self.connection.execute("SELECT cluster FROM cluster_deferrals")}
+
+    def rates(self, cluster_name=None, runs=PLANNER_HISTORY_RUNS):
+        """ Секунды валидации на байт бэкапа в последних runs успешных запусках кластера (или всех кластеров) """
+        sql = "SELECT val_seconds, backup_bytes FROM cluster_history WHERE exit_code = 0 AND backup_bytes > 0"
+        params = ()
+        if cluster_name is not None:
+            sql += " AND cluster = ?"
+            params = (cluster_name,)
+        rows = self.connection.execute(sql + " ORDER BY finished_at DESC LIMIT ?", params + (runs,)).fetchall()
+        return [val_seconds / backup_bytes for val_seconds, backup_bytes in rows]
+
+    def predict(self, cluster_name, backup_bytes):
+        """
+        Прогноз длительности валидации (секунды): размер бэкапа, умноженный на медиану секунд на байт
+        в истории кластера, без истории - всех кластеров, без истории вообще - PLANNER_DEFAULT_THROUGHPUT.
+        С запасом PLANNER_SAFETY_FACTOR
+        """
+        rates = self.rates(cluster_name) or self.rates()
+        rate = statistics.median(rates) if rates else 1 / PLANNER_DEFAULT_THROUGHPUT
+        return backup_bytes * rate * PLANNER_SAFETY_FACTOR
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from mysqlconf import STATS_DIR, PROGRESS_INTERVAL, PROGRESS_SMOOTHING, PROGRESS_STALL_SECONDS
+from mysqlconf import PROGRESS_HTTP_PORT, PROGRESS_SOCKET
+
+# счетчик байт, прочитанных из вывода дампов (multiprocessing.Value), в процессах пула задается attach_counter
+worker_counter = None
+
+# Блок отдельных функций
+def attach_counter(counter):
+    """ Инициализатор процесса пула дампа: счетчик прочитанных байт этапа """
+    global worker_counter
+    worker_counter = counter
+
+def count_streamed(size, counter=None):
+    """ Учет байт, прочитанных из вывода дампа по ходу задачи (counter - для потоков, иначе счетчик процесса пула) """
+    counter = counter if counter is not None else worker_counter
+    if counter is not None:
+        with counter.get_lock():
+            counter.value += size
+
+def disk_growth(path):
+    """ Проба хода этапа, пишущего в path: изменение занятого места файловой системы с момента вызова """
+    baseline = shutil.disk_usage(path).used
+    return lambda: shutil.disk_usage(path).used - baseline
+
+
+class Progress_handler(BaseHTTPRequestHandler):
+    """ GET / - текущее состояние (Progress_tracker.snapshot) в JSON """
+    def do_GET(self):
+        body = json.dumps(self.server.tracker.snapshot(), ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # у unix-сокета нет адреса клиента
+        logging.debug(f"Progress request: {format % args}")
+
+
+class Progress_unix_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('local', 0)
+
+
+class Progress_tracker:
+    """
+    Класс отслеживания хода валидации: текущий этап каждого кластера, выполненные таблицы и байты этапа
+    относительно итогов описи, сглаженная скорость (экспоненциальное среднее) и оценка времени окончания.
+    Состояние периодически переписывается в STATS_DIR/validation_progress.json (для Zabbix) и, если задано,
+    отдается по HTTP на 127.0.0.1:PROGRESS_HTTP_PORT или через unix-сокет PROGRESS_SOCKET.
+    Этап с измеряемым ходом (итоги или watch) без продвижения дольше PROGRESS_STALL_SECONDS помечается 'stalled'.
+    Продвижением считаются и признаки активности внутри задачи: байты из вывода дампа, изменение занятого места
+    при копировании и распаковке, строки вывода xtrabackup (heartbeat)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clusters = {}
+        self.run = {'started': None, 'clusters': []}
+        self.stopped = threading.Event()
+        self.writer = None
+        self.servers = []
+        self.socket_path = None
+
+    def plan(self, cluster_names):
+        with self.lock:
+            self.run = {'started': time.time(), 'clusters': list(cluster_names)}
+
+    def stage(self, cluster_name, stage, tables=None, bytes=None):
+        """ Начало этапа кластера, tables и bytes - итоги этапа (если известны) """
+        if cluster_name is None:
+            return
+        now = time.time()
+        with self.lock:
+            self.clusters[cluster_name] = {
+                'stage': stage, 'stage_started': now, 'updated': now, 'started': self.clusters.get(cluster_name, {}).get('started', now),
+                'tables_total': tables, 'tables_done': 0, 'bytes_total': bytes, 'bytes_done': 0,
+                'rate': None, 'sampled_bytes': 0, 'sampled_at': now, 'exit_code': None,
+                'watched': False, 'probe': None, 'probed': 0, 'counts': False, 'activity_bytes': 0,
+            }
+
+    def watch(self, cluster_name, probe=None, counts=False):
+        """
+        Отслеживание хода текущего этапа без итогов: probe() - накопленные байты этапа (disk_growth, счетчик дампа),
+        опрашивается при каждой записи состояния. counts - значение пробы и есть выполненные байты этапа
+        """
+        with self.lock:
+            entry = self.clusters.get(cluster_name)
+            if entry is not None:
+                entry.update(watched=True, probe=probe, counts=counts)
+
+    def heartbeat(self, cluster_name):
+        """ Признак активности этапа без учета объема (строка вывода команды) """
+        self.advance(cluster_name)
+
+    def total(self, cluster_name, tables=None, bytes=None):
+        """ Итоги текущего этапа, ставшие известными после его начала """
+        with self.lock:
+            entry = self.clusters.get(cluster_name)
+            if entry is not None:
+                if tables is not None:
+                    entry['tables_total'] = tables
+                if bytes is not None:
+                    entry['bytes_total'] = bytes
+
+    def advance(self, cluster_name, tables=0, bytes=0):
+        with self.lock:
+            entry = self.clusters.get(cluster_name)
+            if entry is not None:
+                entry['tables_done'] += tables
+                entry['bytes_done'] += bytes
+                entry['updated'] = time.time()
+
+    def reporter(self, cluster_name):
+        """ Функция продвижения для Staging_engine: (байт скопировано[, итог байт]) """
+        def report(size, total=None):
+            if total is not None:
+                self.total(cluster_name, bytes=total)
+            else:
+                self.advance(cluster_name, bytes=size)
+        return report
+
+    def finish(self, cluster_name, exit_code):
+        if cluster_name is None:
+            return
+        self.stage(cluster_name, 'done')
+        with self.lock:
+            self.clusters[cluster_name]['exit_code'] = exit_code
+
+    def sample_rates(self, smoothing=PROGRESS_SMOOTHING):
+        """ Опрос проб этапов и пересчет сглаженной скорости по байтам, выполненным с прошлого пересчета """
+        now = time.time()
+        with self.lock:
+            for entry in self.clusters.values():
+                if entry['probe'] is not None:
+                    try:
+                        value = entry['probe']()
+                    except OSError:
+                        value = entry['probed']
+                    if value != entry['probed']:
+                        entry['activity_bytes'] += abs(value - entry['probed'])
+                        entry['probed'], entry['updated'] = value, now
+                        if entry['counts']:
+                            entry['bytes_done'] = max(0, value)
+                elapsed = now - entry['sampled_at']
+                if elapsed <= 0:
+                    continue
+                rate = (entry['bytes_done'] - entry['sampled_bytes']) / elapsed
+                entry['rate'] = rate if entry['rate'] is None else smoothing * rate + (1 - smoothing) * entry['rate']
+                entry['sampled_bytes'], entry['sampled_at'] = entry['bytes_done'], now
+
+    def snapshot(self):
+        """ Состояние запуска и кластеров для файла состояния и HTTP """
+        now = time.time()
+        with self.lock:
+            clusters = {}
+            for cluster_name, entry in self.clusters.items():
+                state = {
+                    'stage': entry['stage'],
+                    'stage_seconds': round(now - entry['stage_started']),
+                    'tables_done': round(entry['tables_done'], 2),
+                    'tables_total': entry['tables_total'],
+                    'bytes_done': entry['bytes_done'],
+                    'bytes_total': entry['bytes_total'],
+                    'bytes_per_second': round(entry['rate'] or 0),
+                    'eta_seconds': None,
+                    'activity_bytes': entry['activity_bytes'],
+                    'idle_seconds': round(now - entry['updated']),
+                    # зависание определяется только для этапов с измеряемым ходом (копирование, распаковка, prepare, дамп, выборка)
+                    'stalled': (entry['watched'] or entry['tables_total'] is not None or entry['bytes_total'] is not None)
+                               and now - entry['updated'] > PROGRESS_STALL_SECONDS,
+                }
+                if entry['bytes_total'] and entry['rate']:
+                    state['eta_seconds'] = round(max(0, entry['bytes_total'] - entry['bytes_done']) / entry['rate'])
+                elif entry['tables_total'] and entry['tables_done']:
+                    # этап без объема в байтах - по средней длительности таблицы
+                    state['eta_seconds'] = round(max(0, entry['tables_total'] - entry['tables_done'])
+                                                 * (now - entry['stage_started']) / entry['tables_done'])
+                if entry['exit_code'] is not None:
+                    state['exit_code'] = entry['exit_code']
+                clusters[cluster_name] = state
+            done = sum(1 for entry in self.clusters.values() if entry['stage'] == 'done')
+            return {'updated': round(now), 'run_seconds': round(now - self.run['started']) if self.run['started'] else 0,
+                    'clusters_total': len(self.run['clusters']), 'clusters_done': done, 'clusters': clusters}
+
+    def write(self, file_path):
+        """ Перезапись файла состояния через временный файл """
+        with open(f"{file_path}.tmp", 'w', encoding='utf-8') as progress_file:
+            json.dump(self.snapshot(), progress_file, indent=2, ensure_ascii=False)
+        os.replace(f"{file_path}.tmp", file_path)
+
+    def start(self, stats_dir=STATS_DIR, interval=PROGRESS_INTERVAL, http_port=PROGRESS_HTTP_PORT, socket_path=PROGRESS_SOCKET):
+        """ Запуск фоновой записи файла состояния и (если заданы) HTTP/unix-сокета """
+        file_path = os.path.join(stats_dir, 'validation_progress.json')
+
+        def write_periodically():
+            while not self.stopped.wait(interval):
+                self.sample_rates()
+                try:
+                    self.write(file_path)
+                except OSError as e:
+                    logging.warning(f"Progress file '{file_path}' not written: {e}")
+            try:
+                self.write(file_path)
+            except OSError as e:
+                logging.warning(f"Progress file '{file_path}' not written: {e}")
+
+        self.stopped.clear()
+        self.writer = threading.Thread(target=write_periodically, daemon=True)
+        self.writer.start()
+        if http_port is not None:
+            self.servers.append(ThreadingHTTPServer(('127.0.0.1', http_port), Progress_handler))
+        if socket_path is not None:
+            self.socket_path = socket_path
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.servers.append(Progress_unix_server(socket_path, Progress_handler))
+        for server in self.servers:
+            server.tracker = self
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        return True
+
+    def stop(self):
+        self.stopped.set()
+        if self.writer is not None:
+            self.writer.join()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+        if self.socket_path is not None and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+            self.socket_path = None
+
+progress = Progress_tracker()
@@ -0,0 +1,131 @@
+import threading, queue
+import zlib
+import time
+from models import quote_identifier, merge_chunk_results, dump_deadline
+from mysqlconf import READER_BATCH_ROWS, READER_READ_TIMEOUT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_SOCKET
+
+# pymysql - необязательная зависимость, без нее доступен только движок mysqldump
+try:
+    import pymysql
+    import pymysql.cursors
+except ImportError:
+    pymysql = None
+
+def connect(socket=None, read_timeout=READER_READ_TIMEOUT):
+    """
+    Функция подключения к экземпляру через unix-сокет и открытия транзакции с согласованным снимком данных.
+    read_timeout - ожидание ответа сервера на каждое чтение из сокета
+    """
+    if pymysql is None:
+        raise ImportError("Native reader engine requires the pymysql package")
+    connection = pymysql.connect(
+        unix_socket=socket or MYSQL_SOCKET,
+        user=MYSQL_USER,
+        password=MYSQL_PASSWORD or '',
+        charset='utf8mb4',
+        autocommit=True,
+        read_timeout=read_timeout
+    )
+    with connection.cursor() as cursor:
+        cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+    return connection
+
+def read_table(connection, db, table, where=None, batch_rows=READER_BATCH_ROWS, deadline=None):
+    """
+    Функция чтения всех строк таблицы серверным курсором порциями по batch_rows.
+    where - необязательное условие отбора строк (например диапазон первичного ключа).
+    deadline - ограничение времени чтения (секунды), при превышении - TimeoutError.
+    Возвращает словарь {'db', 'table', 'rows', 'checksum', 'duration'}, checksum - crc32 от представления строк
+    """
+    start_time = time.perf_counter()
+    sql = f"SELECT * FROM {quote_identifier(db)}.{quote_identifier(table)}"
+    if where:
+        sql += f" WHERE {where}"
+    rows = 0
+    checksum = 0
+    with connection.cursor(pymysql.cursors.SSCursor) as cursor:
+        cursor.execute(sql)
+        while True:
+            batch = cursor.fetchmany(batch_rows)
+            if not batch:
+                break
+            rows += len(batch)
+            checksum = zlib.crc32(repr(batch).encode(), checksum)
+            if deadline is not None and time.perf_counter() - start_time > deadline:
+                raise TimeoutError(f"Reading {db}.{table} exceeded the deadline of {deadline:.0f} s")
+    return {'db': db, 'table': table, 'rows': rows, 'checksum': checksum, 'duration': time.perf_counter() - start_time}
+
+
+class Table_reader(threading.Thread):
+    """
+    Поток чтения таблиц через постоянное подключение (без запуска mysqldump на каждую таблицу).
+    Берет задачи tasks_scheduling из очереди и складывает результаты по каждой таблице (или диапазону) в results,
+    None в очереди - признак завершения
+    """
+    def __init__(self, queue, results, socket=None):
+        threading.Thread.__init__(self)
+        self.queue = queue
+        self.results = results
+        self.socket = socket
+        self.connection = None
+
+    def run(self):
+        try:
+            while True:
+                task = self.queue.get()
+                if task is None:
+                    self.queue.task_done()
+                    break
+                try:
+                    for table in task['tables']:
+                        result = self.read(task['db'], table, task.get('where'), dump_deadline(task))
+                        if 'chunk' in task:
+                            result.update(chunk=task['chunk'], chunks=task['chunks'])
+                        self.results.append(result)
+                finally:
+                    self.queue.task_done()
+        finally:
+            if self.connection is not None:
+                self.connection.close()
+
+    def read(self, db, table, where=None, deadline=None):
+        """
+        Чтение одной таблицы (диапазона) не дольше deadline. При любой ошибке (MySQL, сокет, преобразование значений,
+        превышение времени) подключение пересоздается, ошибка записывается в результат, поток продолжает работу
+        """
+        try:
+            if self.connection is None:
+                self.connection = connect(self.socket)
+            return read_table(self.connection, db, table, where, deadline=deadline)
+        except Exception as e:
+            if self.connection is not None:
+                try:
+                    self.connection.close()
+                except Exception:
+                    pass
+                self.connection = None
+            return {'db': db, 'table': table, 'rows': 0, 'checksum': 0, 'duration': 0, 'error': f"{type(e).__name__}: {e}"}
+
+def read_tables(tasks, connections, socket=None):
+    """
+    Функция чтения таблиц задач (см. tasks_scheduling) в connections постоянных подключениях.
+    Порядок задач сохраняется: крупные таблицы читаются первыми. Диапазоны одной таблицы читаются
+    параллельно разными подключениями и объединяются в один результат. tasks - список или генератор (iter_tasks):
+    задачи передаются читателям через ограниченную очередь по мере планирования. Возвращает список результатов по таблицам
+    """
+    task_queue = queue.Queue(maxsize=connections * 2)
+    results = []
+    readers = [Table_reader(task_queue, results, socket) for _ in range(connections)]
+    for reader in readers:
+        reader.start()
+    try:
+        for task in tasks:
+            task_queue.put(task)
+    finally:
+        # по одному признаку завершения на читателя
+        for _ in readers:
+            task_queue.put(None)
+        for reader in readers:
+            reader.join()
+    return merge_chunk_results(results)
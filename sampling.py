@@ -0,0 +1,169 @@
+import os
+import json
+import math
+import time
+import random
+import sqlite3
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from models import quote_identifier
+from checksums import checksum_sql
+from progress import progress
+from mysqlconf import STATS_DIR, SAMPLE_SEGMENT_ROWS, SAMPLE_FRACTION, SAMPLE_CONFIDENCE, SAMPLE_DEFECT_RATE
+from mysqlconf import SAMPLE_CYCLE_DAYS, SAMPLE_CONCURRENCY
+
+# Блок отдельных функций
+def confidence_samples(confidence=SAMPLE_CONFIDENCE, defect_rate=SAMPLE_DEFECT_RATE):
+    """
+    Количество случайных сегментов, после проверки которых без ошибок с вероятностью confidence
+    в таблице нет повреждения, затрагивающего долю defect_rate сегментов: 1 - (1 - defect_rate)^n >= confidence
+    """
+    return math.ceil(math.log(1 - confidence) / math.log(1 - defect_rate))
+
+def sample_segments(segments, covered, cycle_days=SAMPLE_CYCLE_DAYS, fraction=SAMPLE_FRACTION, rng=random):
+    """
+    Выбор сегментов таблицы для проверки: следующие по порядку еще не пройденные в текущем цикле
+    (1 / cycle_days сегментов - за cycle_days запусков проходится вся таблица) и случайные сегменты до доли fraction
+    или до достижения уровня доверия (что наступит раньше). Возвращает отсортированный список номеров сегментов
+    """
+    uncovered = [segment for segment in range(segments) if segment not in covered]
+    selected = set(uncovered[:math.ceil(segments / cycle_days)])
+    target = min(segments, max(len(selected), min(math.ceil(segments * fraction), confidence_samples())))
+    rest = [segment for segment in range(segments) if segment not in selected]
+    selected.update(rng.sample(rest, target - len(selected)))
+    return sorted(selected)
+
+
+class Coverage_state:
+    """
+    Хранилище покрытия выборочной проверки (SQLite STATS_DIR/validation_state.db): количество сегментов таблицы,
+    сегменты, пройденные в текущем цикле, начало цикла и время последней проверки таблицы целиком (CHECK TABLE)
+    """
+    def __init__(self, file_path=None):
+        self.file_path = file_path or os.path.join(STATS_DIR, 'validation_state.db')
+        self.connection = sqlite3.connect(self.file_path, timeout=30)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS sample_coverage (cluster TEXT, db TEXT, tbl TEXT, segments INTEGER, covered TEXT, "
+            "cycle_started INTEGER, checked_at INTEGER, PRIMARY KEY (cluster, db, tbl))"
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def load(self, cluster_name):
+        """ Покрытие таблиц кластера: {(db, table): {'segments', 'covered', 'cycle_started', 'checked_at'}} """
+        rows = self.connection.execute(
+            "SELECT db, tbl, segments, covered, cycle_started, checked_at FROM sample_coverage WHERE cluster = ?", (cluster_name,))
+        return {(row[0], row[1]): {'segments': row[2], 'covered': set(json.loads(row[3])), 'cycle_started': row[4],
+                                   'checked_at': row[5]} for row in rows}
+
+    def record(self, cluster_name, coverage):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO sample_coverage VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(cluster_name, db, table, entry['segments'], json.dumps(sorted(entry['covered'])), entry['cycle_started'],
+              entry['checked_at']) for (db, table), entry in coverage.items()]
+        )
+        self.connection.commit()
+        return True
+
+
+class Sampling_engine:
+    """
+    Класс выборочной проверки восстановленного экземпляра (режим --sample) вместо полного дампа.
+    Таблица делится на сегменты по SAMPLE_SEGMENT_ROWS строк по целочисленному ключу (Inventory.chunk_key), строки
+    выбранных сегментов (sample_segments) читаются запросом контрольной суммы. Доля 1 / SAMPLE_CYCLE_DAYS таблиц
+    (давно не проверявшиеся первыми) проверяется целиком: CHECK TABLE ... QUICK и сверка количества строк
+    по первичному ключу и по каждому вторичному индексу. Покрытие сохраняется в Coverage_state
+    """
+    def __init__(self, cluster_instance, inventory, concurrency=SAMPLE_CONCURRENCY, segment_rows=SAMPLE_SEGMENT_ROWS,
+                 cycle_days=SAMPLE_CYCLE_DAYS):
+        self.cluster_instance = cluster_instance
+        self.inventory = inventory
+        self.concurrency = concurrency
+        self.segment_rows = segment_rows
+        self.cycle_days = cycle_days
+
+    def segment_conditions(self, info):
+        """ Условия WHERE сегментов таблицы, [None] - таблицу делить нельзя (читается одним сегментом) """
+        key = info.chunk_key()
+        segments = math.ceil(info.rows / self.segment_rows)
+        if key is None or segments < 2:
+            return [None]
+        return self.cluster_instance.chunk_bounds(info.db, info.table, key, segments) or [None]
+
+    def read_segment(self, info, where):
+        """ Чтение строк сегмента (контрольная сумма всех колонок): поврежденная страница дает ошибку запроса """
+        rows, checksum = self.cluster_instance.run_sql(checksum_sql(info.db, info.table, info.column_names(), where), timeout=None)[0]
+        return int(rows)
+
+    def check_table(self, info):
+        """ CHECK TABLE ... QUICK и сверка количества строк по индексам, возвращает список ошибок """
+        name = f"{quote_identifier(info.db)}.{quote_identifier(info.table)}"
+        errors = [f"CHECK TABLE: {msg_text}" for _, _, msg_type, msg_text in self.cluster_instance.run_sql(f"CHECK TABLE {name} QUICK;")
+                  if msg_type.lower() == 'error' or (msg_type.lower() == 'status' and msg_text != 'OK')]
+        indexes = sorted({index for index, _, _ in info.indexes})
+        if 'PRIMARY' in indexes and len(indexes) > 1:
+            counts = {index: int(self.cluster_instance.run_sql(
+                f"SELECT COUNT(*) FROM {name} FORCE INDEX ({quote_identifier(index)});", timeout=None)[0][0]) for index in indexes}
+            errors += [f"index {index} has {count} rows, PRIMARY has {counts['PRIMARY']}"
+                       for index, count in counts.items() if count != counts['PRIMARY']]
+        return errors
+
+    def sample_table(self, info, entry, full_check):
+        """
+        Проверка одной таблицы: выбранные сегменты и (full_check) проверка целиком.
+        Возвращает (результат таблицы, покрытие для Coverage_state)
+        """
+        result = {'db': info.db, 'table': info.table, 'segments': 0, 'sampled': 0, 'rows': 0, 'errors': []}
+        try:
+            conditions = self.segment_conditions(info)
+            if entry is None or entry['segments'] != len(conditions):
+                # новая таблица или изменилось количество сегментов - цикл покрытия начинается заново
+                entry = {'segments': len(conditions), 'covered': set(), 'cycle_started': int(time.time()),
+                         'checked_at': entry['checked_at'] if entry is not None else 0}
+            selected = sample_segments(len(conditions), entry['covered'], self.cycle_days)
+            result.update(segments=len(conditions), sampled=len(selected))
+            for segment in selected:
+                result['rows'] += self.read_segment(info, conditions[segment])
+            if full_check:
+                result['errors'] += self.check_table(info)
+                entry['checked_at'] = int(time.time())
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            result['errors'].append(str(e))
+            return result, entry
+        if not result['errors']:
+            entry['covered'].update(selected)
+        if len(entry['covered']) >= entry['segments']:
+            # таблица пройдена целиком за цикл, следующий цикл начинается с первого сегмента
+            result['cycle_completed'] = True
+            entry.update(covered=set(), cycle_started=int(time.time()))
+        result['coverage'] = len(entry['covered']) / entry['segments']
+        result['confidence'] = 1 - (1 - SAMPLE_DEFECT_RATE) ** len(selected) if len(selected) < len(conditions) else 1.0
+        return result, entry
+
+    def run(self):
+        """ Выборочная проверка всех таблиц InnoDB кластера, возвращает список результатов по таблицам """
+        cluster_name = self.cluster_instance.cluster_name
+        state = Coverage_state()
+        try:
+            coverage = state.load(cluster_name)
+            tables = [self.inventory.tables[key] for key in self.inventory.innodb_tables()]
+            # проверка целиком - давно не проверявшиеся таблицы, 1 / cycle_days всех таблиц за запуск
+            by_age = sorted(tables, key=lambda info: (coverage.get((info.db, info.table)) or {}).get('checked_at') or 0)
+            full_checks = {(info.db, info.table) for info in by_age[:math.ceil(len(tables) / self.cycle_days)]}
+            progress.stage(cluster_name, 'sample', tables=len(tables))
+            results, updated = [], {}
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                futures = [executor.submit(self.sample_table, info, coverage.get((info.db, info.table)),
+                                           (info.db, info.table) in full_checks) for info in tables]
+                for future in futures:
+                    result, entry = future.result()
+                    progress.advance(cluster_name, tables=1)
+                    results.append(result)
+                    if entry is not None:
+                        updated[(result['db'], result['table'])] = entry
+            state.record(cluster_name, updated)
+        finally:
+            state.close()
+        return results
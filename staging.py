@@ -0,0 +1,134 @@
+import os
+import errno
+import fcntl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from mysqlconf import STAGING_COPY_THREADS
+
+FICLONE = 0x40049409 # ioctl reflink-копирования (btrfs, xfs с reflink=1)
+COMPRESSED_SUFFIXES = ('.qp', '.zst', '.lz4')
+# ошибки, после которых способ копирования (reflink, жесткая ссылка, copy_file_range) больше не пробуется
+UNSUPPORTED_ERRORS = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EPERM)
+
+
+class Staging_engine:
+    """
+    Класс копирования директории бэкапа за один проход: файлы копируются параллельно (reflink, если ФС поддерживает,
+    иначе copy_file_range/sendfile без копирования через пользовательское пространство), владелец устанавливается
+    сразу при создании файла. Сжатые файлы при link_compressed связываются жесткой ссылкой: xtrabackup --decompress
+    --remove-original удалит только ссылку. При заданном decompressor (Decompression_engine) сжатые файлы
+    не копируются, а распаковываются сразу в целевую директорию, сжатые файлы без способа распаковки копируются
+    как есть (stats['compressed'] - их количество, для них нужен xtrabackup --decompress). progress - функция (байт[, итог байт]),
+    которой сообщается ход копирования (Progress_tracker.reporter). Требует запуска от root
+    """
+    def __init__(self, uid, gid, threads=STAGING_COPY_THREADS, link_compressed=False, decompressor=None, progress=None):
+        self.uid = uid
+        self.gid = gid
+        self.threads = threads
+        self.link_compressed = link_compressed
+        self.decompressor = decompressor
+        self.progress = progress
+        self.reflink = True
+        self.copy_range = True
+        self.lock = threading.Lock()
+        self.stats = {'files': 0, 'bytes': 0, 'cloned': 0, 'linked': 0, 'copied': 0, 'compressed': 0}
+
+    def count(self, method, size):
+        with self.lock:
+            self.stats['files'] += 1
+            self.stats['bytes'] += size
+            self.stats[method] += 1
+        if self.progress is not None:
+            self.progress(size)
+
+    def copy_tree(self, source_dir, target_dir):
+        """ Копирование содержимого source_dir в существующую target_dir, возвращает статистику """
+        files = []
+        for root, dirs, names in os.walk(source_dir):
+            target_root = os.path.join(target_dir, os.path.relpath(root, source_dir))
+            for name in dirs:
+                source, target = os.path.join(root, name), os.path.join(target_root, name)
+                if os.path.islink(source):
+                    self.copy_symlink(source, target)
+                    continue
+                os.mkdir(target, os.stat(source).st_mode & 0o7777)
+                os.chown(target, self.uid, self.gid)
+            for name in names:
+                source, target = os.path.join(root, name), os.path.join(target_root, name)
+                if os.path.islink(source):
+                    self.copy_symlink(source, target)
+                else:
+                    files.append((source, target, os.path.getsize(source)))
+        # крупные файлы первыми, чтобы хвост копирования состоял из мелких
+        files.sort(key=lambda item: item[2], reverse=True)
+        if self.progress is not None:
+            self.progress(0, sum(size for _, _, size in files))
+        if self.decompressor is not None:
+            self.decompressor.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                for _ in executor.map(lambda item: self.copy_file(*item[:2]), files):
+                    pass
+        finally:
+            if self.decompressor is not None:
+                self.stats['decompress'] = self.decompressor.finish()
+        return self.stats
+
+    def copy_symlink(self, source, target):
+        os.symlink(os.readlink(source), target)
+        os.lchown(target, self.uid, self.gid)
+
+    def copy_file(self, source, target):
+        """ Копирование одного файла с сохранением прав и времени модификации """
+        if self.decompressor is not None and self.decompressor.compressed(source):
+            self.decompressor.submit(source, target)
+            # сжатый файл учитывается в ходе копирования при передаче распаковщику
+            if self.progress is not None:
+                self.progress(os.path.getsize(source))
+            return
+        source_stat = os.stat(source)
+        if source.endswith(COMPRESSED_SUFFIXES):
+            with self.lock:
+                self.stats['compressed'] += 1
+        if self.link_compressed and source.endswith(COMPRESSED_SUFFIXES):
+            try:
+                os.link(source, target)
+                self.count('linked', source_stat.st_size)
+                return
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRORS:
+                    raise
+                self.link_compressed = False
+        with open(source, 'rb') as source_file, \
+                open(os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL, source_stat.st_mode & 0o7777), 'wb') as target_file:
+            os.fchown(target_file.fileno(), self.uid, self.gid)
+            method = self.transfer(source_file.fileno(), target_file.fileno(), source_stat.st_size)
+        os.utime(target, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+        self.count(method, source_stat.st_size)
+
+    def transfer(self, source_fd, target_fd, size):
+        """ Перенос данных: reflink, затем copy_file_range, затем sendfile. Возвращает использованный способ """
+        if self.reflink:
+            try:
+                fcntl.ioctl(target_fd, FICLONE, source_fd)
+                return 'cloned'
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRORS:
+                    raise
+                self.reflink = False
+        offset = 0
+        while offset < size:
+            if self.copy_range:
+                try:
+                    copied = os.copy_file_range(source_fd, target_fd, size - offset)
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED_ERRORS:
+                        raise
+                    self.copy_range = False
+                    continue
+            else:
+                copied = os.sendfile(target_fd, source_fd, offset, size - offset)
+            if copied == 0:
+                break
+            offset += copied
+        return 'copied'
@@ -0,0 +1,81 @@
+import os
+import math
+import sqlite3
+import time
+from mysqlconf import STATS_DIR, INCREMENTAL_SAMPLE_FRACTION, INCREMENTAL_FINGERPRINT
+
+# Блок отдельных функций
+def table_fingerprints(backup_sizes, metadata):
+    """
+    Функция формирования отпечатков таблиц: размер и mtime файлов .ibd в бэкапе (get_tables_sizes_in_backup)
+    и метаданные восстановленного экземпляра (get_tables_metadata). Возвращает {(db, table): {...}}
+    """
+    fingerprints = {}
+    for meta in metadata.values():
+        ibd = backup_sizes.get(meta['db'], {}).get(meta['table'], {})
+        fingerprints[(meta['db'], meta['table'])] = {
+            'ibd_size': ibd.get('size', 0),
+            'ibd_mtime': ibd.get('mtime', 0),
+            'table_rows': meta['table_rows'],
+            'auto_increment': meta['auto_increment'],
+            'update_time': meta['update_time'],
+        }
+    return fingerprints
+
+
+class Validation_state:
+    """
+    Хранилище отпечатков таблиц последней успешной валидации (SQLite в STATS_DIR)
+    """
+    columns = ('ibd_size', 'ibd_mtime', 'table_rows', 'auto_increment', 'update_time')
+
+    def __init__(self, file_path=None):
+        self.file_path = file_path or os.path.join(STATS_DIR, 'validation_state.db')
+        self.connection = sqlite3.connect(self.file_path, timeout=30)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS tables (cluster TEXT, db TEXT, tbl TEXT, ibd_size INTEGER, ibd_mtime INTEGER, "
+            "table_rows INTEGER, auto_increment INTEGER, update_time TEXT, checksum INTEGER, verified_at INTEGER, "
+            "PRIMARY KEY (cluster, db, tbl))"
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def load(self, cluster_name):
+        """ Отпечатки таблиц кластера из последней успешной валидации: {(db, table): {...}} """
+        rows = self.connection.execute(
+            f"SELECT db, tbl, {', '.join(self.columns)}, checksum, verified_at FROM tables WHERE cluster = ?", (cluster_name,)
+        )
+        return {(row[0], row[1]): dict(zip(self.columns + ('checksum', 'verified_at'), row[2:])) for row in rows}
+
+    def select_tables(self, cluster_name, fingerprints, sample_fraction=INCREMENTAL_SAMPLE_FRACTION,
+                      compared=INCREMENTAL_FINGERPRINT):
+        """
+        Метод выбора таблиц для чтения: изменившиеся (по полям compared) и новые - все, из неизменных - доля
+        sample_fraction, начиная с давно не проверявшихся. Возвращает (changed, sampled) - множества (db, table)
+        """
+        stored = self.load(cluster_name)
+        changed, unchanged = set(), []
+        for key, fingerprint in fingerprints.items():
+            previous = stored.get(key)
+            if previous is None or any(previous[field] != fingerprint[field] for field in compared):
+                changed.add(key)
+            else:
+                unchanged.append((previous['verified_at'] or 0, key))
+        unchanged.sort()
+        sampled = {key for _, key in unchanged[:math.ceil(len(unchanged) * sample_fraction)]}
+        return changed, sampled
+
+    def record(self, cluster_name, fingerprints, checksums=None):
+        """ Метод сохранения отпечатков успешно проверенных таблиц, checksums - {(db, table): checksum} """
+        checksums = checksums or {}
+        verified_at = int(time.time())
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO tables (cluster, db, tbl, {', '.join(self.columns)}, checksum, verified_at) "
+            f"VALUES (?, ?, ?, {', '.join('?' for _ in self.columns)}, ?, ?)",
+            [(cluster_name, db, table, *(fingerprint[field] for field in self.columns), checksums.get((db, table)), verified_at)
+             for (db, table), fingerprint in fingerprints.items()]
+        )
+        self.connection.commit()
+        return True
@@ -6,59 +6,69 @@ import logging
 import subprocess
 import time
 from models import MySQL_cluster, format_time, archive_file, tasks_building
+from commands import iter_command_lines_async
 from mysqlconf import CLUSTER_NAMES, TRUE_DUMP_DIR
 import asyncio
 
 logging.basicConfig(level=logging.INFO, filename="x_validation.log",filemode="w",
                     format="%(asctime)s %(levelname)s %(message)s")
 
-async def producer_async(task_queue, task):
-    await task_queue.put(task)
+async def producer_async(task_queue, workers):
+    """
+    Один продюсер: таблицы читаются из вывода клиента mysql по мере поступления, команды создаются по одной
+    и кладутся в ограниченную очередь (продюсер ждет, пока потребители не освободят место)
+    """
+    sql = "SELECT TABLE_SCHEMA, TABLE_NAME FROM information_schema.TABLES \
+    WHERE TABLE_SCHEMA NOT IN ('information_schema', 'mysql', 'performance_schema', 'sys') ORDER BY TABLE_SCHEMA;"
+    try:
+        async for line in iter_command_lines_async(cluster_instance.sql_command(sql)):
+            if line:
+                for command_str in tasks_building([line.split('\t')], parametrs):
+                    await task_queue.put(command_str)
+    finally:
+        # по одному признаку завершения на потребителя
+        for _ in range(workers):
+            await task_queue.put(None)
 
 
 async def start_dump(task_queue): 
     while True:
         command_str = await task_queue.get()
+        if command_str is None:
+            task_queue.task_done()
+            break
         process = await asyncio.create_subprocess_shell(
             f"sudo {command_str}",
             stdout=asyncio.subprocess.DEVNULL,
             stderr=asyncio.subprocess.PIPE
             )
         stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            logging.error(f"Dump command failed: {stderr.decode(errors='replace').strip()}")
         task_queue.task_done()
 
+# базовые параметры для снятия дампа только данных одной таблицы
+parametrs = [
+        "--no-create-info",
+        "--single-transaction",
+        "--set-gtid-purged=OFF",
+        "--skip-triggers",
+        "--compact", 
+        "--complete-insert"
+    ]
+
 async def main_queue():
-    dbs_tables = cluster_instance.get_tables_in_dbs()
-    # базовые параметры для снятия дампа только данных одной таблицы
-    parametrs = [
-            "--no-create-info",
-            "--single-transaction",
-            "--set-gtid-purged=OFF",
-            "--skip-triggers",
-            "--compact", 
-            "--complete-insert"
-        ]
-    tasks = tasks_building(dbs_tables, parametrs)
     task_queue = asyncio.Queue(maxsize=20)
 
     optimal_workers = 20  # Не более 20 потоков
-    producers = [asyncio.create_task(producer_async(task_queue, task)) for task in tasks]
     consumers = [asyncio.create_task(start_dump(task_queue)) for _ in range(optimal_workers)]
 
-    # Ждем, пока продюсеры добавят все элементы
-    await asyncio.gather(*producers)
-    print("-- Продюсеры завершили --")
-
-    await task_queue.join()
-    print("-- Все элементы обработаны --")
-
-    # Аккуратно останавливаем потребителей (т.к. они в бесконечном цикле)
-    for c in consumers:
-        c.cancel()
+    # Дамп первой таблицы начинается сразу после ее получения, в памяти не более maxsize команд
+    await producer_async(task_queue, optimal_workers)
+    print("-- Продюсер завершил --")
 
-    # Даем возможность задачам обработать отмену
-    await asyncio.gather(*consumers, return_exceptions=True)
-    print("-- Потребители остановлены --")
+    await asyncio.gather(*consumers)
+    print("-- Все элементы обработаны, потребители остановлены --")
 
 if __name__ == "__main__":
     cluster_name = 'crm_prod'
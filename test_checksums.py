@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+from checksums import Checksum_engine, diff_manifests
+from mysqlconf import CHUNKED_TABLE_SIZE
+
+class Fake_cluster:
+    """
+    Экземпляр без MySQL: мелкая таблица shop.small и таблица shop.big размером CHUNKED_TABLE_SIZE,
+    которая делится на два диапазона по колонке id. Контрольная сумма - по тексту запроса (salt - "поврежденные" данные)
+    """
+    cluster_name = 'fake'
+
+    def __init__(self, salt=0):
+        self.salt = salt
+
+    def get_tables_metadata(self):
+        return {
+            'shop.small': {'db': 'shop', 'table': 'small', 'size': 1024, 'table_rows': 10, 'update_time': None},
+            'shop.big': {'db': 'shop', 'table': 'big', 'size': CHUNKED_TABLE_SIZE, 'table_rows': 1000, 'update_time': None},
+        }
+
+    def run_sql(self, sql, timeout=None):
+        if sql.startswith("SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME"):
+            return [['shop', 'small', 'id'], ['shop', 'small', 'name'], ['shop', 'big', 'id'], ['shop', 'big', 'payload']]
+        return [[10, hash((sql, self.salt)) & 0xffffffff]]
+
+    def get_table_chunks(self, db, table, chunks, key=False):
+        return ["`id` < 500", "`id` >= 500"]
+
+
+def check_chunked_table():
+    """ Таблица не меньше CHUNKED_TABLE_SIZE считается по диапазонам и попадает в манифест под своим ключом 'db.table' """
+    manifest = Checksum_engine(Fake_cluster(), chunks=2).build_manifest()
+    assert set(manifest['tables']) == {'shop.small', 'shop.big'}, manifest['tables'].keys()
+    assert [chunk['where'] for chunk in manifest['tables']['shop.big']['chunks']] == ["`id` < 500", "`id` >= 500"]
+    assert 'chunks' not in manifest['tables']['shop.small']
+    return manifest
+
+def check_corruption_detected(previous):
+    """ Таблица с неизменными метаданными, пересчитанная по ротации, с другими данными - corrupt """
+    manifest = Checksum_engine(Fake_cluster(salt=1), chunks=2, verify_share=1).build_manifest(previous)
+    report = diff_manifests(previous, manifest)
+    assert {result['status'] for result in report.values()} == {'corrupt'}, report
+    assert report['shop.big']['chunks'] == [0, 1], report
+
+def check_rotation(previous):
+    """ Без ротации таблицы с неизменными метаданными переносятся из предыдущего манифеста """
+    manifest = Checksum_engine(Fake_cluster(salt=1), chunks=2, verify_share=0).build_manifest(previous)
+    assert all(entry.get('skipped') for entry in manifest['tables'].values())
+
+
+if __name__ == "__main__":
+    previous = check_chunked_table()
+    check_corruption_detected(previous)
+    check_rotation(previous)
+    print("checksums: OK")
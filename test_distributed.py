@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import tempfile
+import threading
+import multiprocessing
+from distributed import Job_queue, Coordinator, Agent, lock_agent
+
+CLUSTER_NAMES = ['crm_prod', 'any_test_db', 'billing', 'shop']
+TOKEN = 'test-token'
+
+def validate(cluster_name, marker):
+    """ Валидация без MySQL: агент, первым получивший crm_prod, падает вместе с процессом (аренда не продлевается) """
+    if cluster_name == 'crm_prod' and not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    time.sleep(0.2)
+    return {'val_duration': 0.2, 'exit_code': 0, 'pid': os.getpid()}
+
+def run_agent(url, marker):
+    Agent(url, lambda cluster_name: validate(cluster_name, marker), token=TOKEN).run(interval=0.2)
+
+
+def check_agents(work_dir, agents=3):
+    """
+    Координатор и несколько локальных процессов-агентов: все кластеры выполнены, задание упавшего агента
+    возвращается в очередь по истечении аренды и выполняется другим агентом
+    """
+    queue = Job_queue(os.path.join(work_dir, 'validation_queue.db'), lease=1)
+    queue.start(CLUSTER_NAMES)
+    coordinator = Coordinator(queue, address='127.0.0.1', port=0, token=TOKEN)
+    url = f"http://127.0.0.1:{coordinator.server.server_address[1]}"
+    jobs = []
+    thread = threading.Thread(target=lambda: jobs.extend(coordinator.run(interval=0.2)))
+    thread.start()
+    processes = [multiprocessing.Process(target=run_agent, args=(url, os.path.join(work_dir, 'crashed'))) for _ in range(agents)]
+    for process in processes:
+        process.start()
+    thread.join(60)
+    for process in processes:
+        process.join(30)
+    queue.close()
+    assert not thread.is_alive(), "coordinator did not finish"
+    assert [job['state'] for job in jobs] == ['done'] * len(CLUSTER_NAMES), jobs
+    crashed = next(job for job in jobs if job['cluster'] == 'crm_prod')
+    assert crashed['attempts'] == 2, crashed
+    assert sorted(process.exitcode for process in processes) == [0] * (agents - 1) + [1], [process.exitcode for process in processes]
+
+def check_token(work_dir):
+    """ Координатор без токена слушает только loopback, агент с чужим токеном отклоняется """
+    queue = Job_queue(os.path.join(work_dir, 'token_queue.db'))
+    queue.start(CLUSTER_NAMES)
+    try:
+        Coordinator(queue, address='0.0.0.0', port=0, token=None)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("coordinator without a token listens on all interfaces")
+    coordinator = Coordinator(queue, address='127.0.0.1', port=0, token=TOKEN)
+    threading.Thread(target=coordinator.server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{coordinator.server.server_address[1]}"
+    try:
+        assert Agent(url, None, token='wrong').request('/status')[0] == 403
+        assert Agent(url, None, token=TOKEN).request('/status')[0] == 200
+    finally:
+        coordinator.server.shutdown()
+        coordinator.server.server_close()
+        queue.close()
+
+def check_agent_lock(work_dir):
+    """ Второй агент хоста без MULTI_INSTANCE не запускается, после остановки первого блокировка свободна """
+    file_path = os.path.join(work_dir, 'validation_agent.lock')
+    first = lock_agent(file_path)
+    assert first is not None
+    with multiprocessing.Pool(1) as pool:
+        assert pool.apply(lock_agent, (file_path,)) is None
+    first.close()
+    second = lock_agent(file_path)
+    assert second is not None
+    second.close()
+
+def check_coordinator_gone(work_dir):
+    """ Агент, не получивший состояние запуска от остановленного координатора, не падает """
+    agent = Agent('http://127.0.0.1:9', None, token=TOKEN)
+    assert agent.run_finished() is None
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as work_dir:
+        check_agents(work_dir)
+        check_token(work_dir)
+        check_agent_lock(work_dir)
+        check_coordinator_gone(work_dir)
+    print("distributed: OK")
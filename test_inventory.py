@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import json
+import shlex
+from inventory import Inventory
+from models import iter_tasks, tasks_building
+from mysqlconf import SMALL_TABLE_SIZE
+
+# имена с кавычками, запятыми и символами shell - такие имена разбирает INVENTORY_SQL (JSON_ARRAY/GROUP_CONCAT)
+NAMES = [('shop', "o'rders, 2024"), ('shop', 'pay`ments $(id); "x"'), ("my db", 'plain')]
+
+def instance_rows():
+    """ Строки INVENTORY_SQL: крупные таблицы (по одной в задаче) и мелкая (в пачке своей БД) """
+    rows = []
+    for number, (db, table) in enumerate(NAMES):
+        size = SMALL_TABLE_SIZE * 4 if number < 2 else 1024
+        rows.append((json.dumps({'db': db, 'table': table, 'engine': 'InnoDB', 'data_length': size, 'index_length': 0,
+                                 'rows': 10, 'auto_increment': 0, 'update_time': '',
+                                 'columns': [['id', 'int', 'NO']], 'indexes': [['PRIMARY', 0, 'id']]}),))
+    return rows
+
+
+def check_quoted_names():
+    """ Имена из описи передаются mysqldump отдельными аргументами без изменений, в том числе в пути --result-file """
+    inventory = Inventory('fake', 'checksum', {}, {}).add_instance_tables(instance_rows())
+    assert set(inventory.tables) == set(NAMES), inventory.tables.keys()
+    seen = set()
+    for task in iter_tasks(inventory.iter_sizes(), ['--compact'], result_file=True):
+        args = shlex.split(task['command'])
+        assert args[args.index('--tables') - 1] == task['db'], args
+        assert args[args.index('--tables') + 1:-1] == task['tables'], args
+        assert args[-1].startswith('--result-file=') and task['tables'][0] in args[-1], args
+        seen.update((task['db'], table) for table in task['tables'])
+    assert seen == set(NAMES), seen
+
+def check_tasks_building():
+    """ Команды по одной таблице (tasks_building) экранируются так же """
+    for (db, table), command in zip(NAMES, tasks_building(iter(NAMES), ['--compact'])):
+        assert shlex.split(command)[2:4] == [db, table], command
+
+
+if __name__ == "__main__":
+    check_quoted_names()
+    check_tasks_building()
+    print("inventory: OK")
@@ -21,7 +21,6 @@ exit_code = 0
 
 # Снятие дампа
 try:
-    dbs_tables = cluster_instance.get_tables_in_dbs()
     # базовые параметры для снятия дампа только данных одной таблицы
     parametrs = [
             "--no-create-info",
@@ -31,11 +30,10 @@ try:
             "--compact", 
             "--complete-insert"
         ]
-    tasks = tasks_building(dbs_tables, parametrs)
-    task_queue = queue.Queue()
-    for task in tasks:
-        task_queue.put((task,))
-    optimal_workers = min(20, task_queue.qsize())  # Не более 20 потоков
+    tasks = tasks_building(cluster_instance.iter_tables(), parametrs)
+    # ограниченная очередь: команды создаются по мере разбора потоками, дамп начинается с первой таблицы
+    task_queue = queue.Queue(maxsize=100)
+    optimal_workers = 20  # Не более 20 потоков
     # снятие только дампа схемы
     if cluster_instance.start_dump(dump_filename=f"schema_only_{cluster_name}.dump"): # для тестирования, добавить параметр dump_filename='schema_only_crm_prod.dump'
         logging.info(f"Taking dump schema from cluster '{cluster_name}' completed successfully")
@@ -43,9 +41,22 @@ try:
     workers = [Worker(task_queue) for _ in range(optimal_workers)] # не более 20 потоков для операций с БД
     for worker in workers:  
         worker.start()
+    tasks_count = 0
+    try:
+        for task in tasks:
+            task_queue.put((task,))
+            tasks_count += 1
+    finally:
+        # потоки завершаются и при ошибке чтения списка таблиц
+        for worker in workers:
+            task_queue.put(None)
 
     for worker in workers:
         worker.join()
+    failed = [outcome for worker in workers for outcome in worker.outcomes if outcome[1] != 'ok']
+    if failed:
+        exit_code = 1
+        logging.error(f"Dump failed for {len(failed)} of {tasks_count} tables")
 
 except subprocess.CalledProcessError as e:
     exit_code = 1
@@ -1,97 +1,526 @@
 #!/usr/bin/env python3
 
+import argparse
 import logging
+import os
+import multiprocessing
 import subprocess
+import threading
 import time
-from models import MySQL_cluster, format_time
-from mysqlconf import CLUSTER_NAMES
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from models import MySQL_cluster, MySQL_instance, Memory_budget, format_time, iter_tasks, start_dump, stream_dump
+from models import merge_chunk_results, isolated_dump, requeue_dump
+from collections import Counter
+from readers import read_tables, pymysql
+from metrics import stage_metrics, measure
+from progress import progress, attach_counter
+from concurrency import Concurrency_controller, run_adaptive, Task_feed
+from state import Validation_state, table_fingerprints
+from inventory import load_inventory, Inventory, cache_path
+from archive import create_archive, write_index
+from sampling import Sampling_engine
+from distributed import Job_queue, Coordinator, Agent
+from planner import Run_history, plan_order
+from journal import Run_journal, task_key, datadir_fingerprint
+from checksums import Checksum_engine, load_manifest, save_manifest, manifest_path, diff_manifests
+from mysqlconf import CLUSTER_NAMES, DUMP_SIZE_SOURCE, PIPELINE_STAGING, STREAM_DUMP, TRUE_DUMP, READER_ENGINE, TABLE_CHUNKS
+from mysqlconf import CHECKSUM_TABLES, CHECKSUM_BASELINE_DIR, ADAPTIVE_CONCURRENCY
+from mysqlconf import MULTI_INSTANCE, MAX_PARALLEL_INSTANCES, INSTANCES_MEMORY_LIMIT
+from mysqlconf import VALIDATION_PROFILE, VALIDATION_PROFILE_FILE, PREFLIGHT_CHECK, DUMP_ARCHIVE, TRUE_DUMP_DIR
+from mysqlconf import VALIDATION_WINDOW, PLANNER_LANES, COORDINATOR_AGENTS
 
 logging.basicConfig(level=logging.INFO, filename="x_validation.log",filemode="w",
                     format="%(asctime)s %(levelname)s %(message)s")
 
-logging.info(f"Running validation script. List of clusters: {', '.join(CLUSTER_NAMES)}")
+def stage_cluster(cluster_name, stop=None):
+    """
+    Фоновая подготовка бэкапа кластера в промежуточной директории (копирование и распаковка).
+    stop - threading.Event отмены (discard_staged): проверяется перед копированием и перед распаковкой.
+    Возвращает длительность распаковки, она входит во время восстановления, None - подготовка отменена
+    """
+    if stop is not None and stop.is_set():
+        return None
+    cluster_instance = MySQL_cluster(cluster_name)
+    if cluster_instance.stage_backup():
+        logging.info(f"Copying backup files '{cluster_name}' to staging directory '{cluster_instance.staging_dir}' completed successfully")
+        if cluster_instance.staging_stats is not None:
+            logging.info(f"Staging engine statistics '{cluster_name}': {cluster_instance.staging_stats}")
+    if stop is not None and stop.is_set():
+        return None
+    start_time = time.time()
+    if cluster_instance.xtrabackup_decompress(target_dir=cluster_instance.staging_dir):
+        logging.info(f"Backup '{cluster_name}' decompressed in staging directory")
+    return time.time() - start_time
 
-for cluster_name in CLUSTER_NAMES:
-    
-    val_start_time = time.time()
+def submit_staging(executor, cluster_name):
+    """ Постановка подготовки бэкапа кластера в executor, у future есть событие отмены stop (см. discard_staged) """
+    stop = threading.Event()
+    staged_future = executor.submit(stage_cluster, cluster_name, stop)
+    staged_future.stop = stop
+    return staged_future
+
+def discard_staged(cluster_instance, staged_future):
+    """
+    Отмена ненужной подготовки бэкапа (директория данных восстановлена ранее, кластер завершился ошибкой).
+    Future.cancel() не останавливает уже начатую подготовку: она прерывается на границе этапов, ее окончание
+    дожидается, промежуточная директория удаляется, чтобы копия не осталась на диске
+    """
+    if staged_future.cancel():
+        return
+    stop = getattr(staged_future, 'stop', None)
+    if stop is not None:
+        stop.set()
+    try:
+        staged_future.result()
+    except Exception as e:
+        logging.warning(f"Discarded staging of cluster '{cluster_instance.cluster_name}' failed: {e}")
+    try:
+        if cluster_instance.remove_staging():
+            logging.info(f"Staging directory '{cluster_instance.staging_dir}' removed")
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+        logging.error(e)
+
+def preflight_clusters(cluster_names):
+    """
+    Предварительная проверка бэкапов до копирования (секунды на кластер): кластеры с ошибками не восстанавливаются,
+    их место в очереди занимает следующий. Таблицы сверяются с описью прошлой валидации. Возвращает прошедшие проверку
+    """
+    passed = []
+    for cluster_name in cluster_names:
+        start_time = time.time()
+        try:
+            cluster_instance = MySQL_cluster(cluster_name)
+            previous = Inventory.load(cache_path(cluster_name))
+            current = load_inventory(cluster_instance, live=False)
+            previous_to_lsn = previous.backup_info.get('innodb_to_lsn', '') if previous is not None else ''
+            report = cluster_instance.preflight_check(
+                expected_tables=previous.innodb_tables() if previous is not None and previous.live else None,
+                backup_tables=current.tables,
+                previous_to_lsn=int(previous_to_lsn) if previous_to_lsn.isdigit() else None)
+        except (OSError, ValueError) as e:
+            report = {'errors': [str(e)], 'warnings': []}
+        for warning in report['warnings']:
+            logging.warning(f"Preflight of cluster '{cluster_name}': {warning}")
+        for error in report['errors']:
+            logging.error(f"Preflight of cluster '{cluster_name}': {error}")
+        if report['errors']:
+            MySQL_cluster.preflight[cluster_name] = 'failed'
+            MySQL_cluster.exit_codes[cluster_name] = 1
+            logging.error(f"Backup of cluster '{cluster_name}' failed preflight checks, restore skipped")
+        else:
+            MySQL_cluster.preflight[cluster_name] = 'ok'
+            passed.append(cluster_name)
+            logging.info(f"Preflight of cluster '{cluster_name}' passed in {format_time(time.time() - start_time)}: "
+                         f"{report['files']} tablespace files, {report['pages']} pages sampled"
+                         f"{'' if report['checksums'] else ' (page checksums skipped, crc32c is not installed)'}, "
+                         f"{report['compressed_files']} compressed files not sampled")
+    return passed
+
+def restore_cluster(cluster_instance, staged_future=None):
+    """
+    Остановка, очистка директории данных и восстановление в нее бэкапа кластера.
+    staged_future - результат stage_cluster (бэкап уже скопирован и распакован в промежуточной директории).
+    Ошибки движков копирования и распаковки (OSError: нет места, нет qpress/zstd) отмечают кластер как неуспешный.
+    Возвращает (код завершения, длительность восстановления)
+    """
+    cluster_name = cluster_instance.cluster_name
+    restor_duration = 0
     exit_code = 0
     # Если кластер активен, то выключаем его
-    cluster_instance = MySQL_cluster(cluster_name)    
-    logging.info(f"Working with the '{cluster_name}' cluster'")
     if cluster_instance.status_cluster():
-        logging.info(f"MySQL service is active")
+        logging.info("MySQL service is active")
         try:
             if cluster_instance.stop_cluster():
                 logging.info(f"MySQL service stoped. Cluster '{cluster_name}'")
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
             exit_code = 1
             logging.error(e)
-    else: logging.info(f"MySQL service is inactive")
-        
+    else: logging.info("MySQL service is inactive")
+
     # Очистка директории с данными
     try:
         if cluster_instance.clear_data_dir():
             logging.info(f"Successfully cleared '{cluster_instance.mysql_data_dir}'")
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
         exit_code = 1
         logging.error(e)
 
-    # Копирование файлов бэкапа в директорию данных
+    if staged_future is not None:
+        # Перенос подготовленного бэкапа из промежуточной директории и восстановление данных
+        try:
+            decompress_duration = staged_future.result()
+            if decompress_duration is None:
+                raise RuntimeError(f"Staging of cluster '{cluster_name}' was cancelled")
+            if cluster_instance.swap_staging_in_datadir():
+                logging.info(f"Staged backup files '{cluster_name}' moved to data directory '{cluster_instance.mysql_data_dir}'")
+            start_time = time.time()
+            if cluster_instance.xtrabackup_prepare():
+                restor_duration = decompress_duration + time.time() - start_time
+                logging.info(f"Cluster '{cluster_name}' recovery completed successfully")
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError, RuntimeError) as e:
+            exit_code = 1
+            logging.error(e)
+            # недоделанная копия в промежуточной директории не нужна
+            discard_staged(cluster_instance, staged_future)
+    else:
+        # Копирование файлов бэкапа в директорию данных
+        try:
+            if cluster_instance.copy_backup_in_datadir():
+                logging.info(f"Copying backup files '{cluster_name}' to data directory '{cluster_instance.mysql_data_dir}' completed successfully ")
+                if cluster_instance.staging_stats is not None:
+                    logging.info(f"Staging engine statistics '{cluster_name}': {cluster_instance.staging_stats}")
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+            exit_code = 1
+            logging.error(e)
+
+        # Восстановление данных
+        try:
+            start_time = time.time()
+            if cluster_instance.xtrabackup_restore():
+                end_time = time.time()
+                restor_duration = end_time - start_time
+                logging.info(f"Cluster '{cluster_name}' recovery completed successfully")
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+            exit_code = 1
+            logging.error(e)
+    return exit_code, restor_duration
+
+def cluster_stats(cluster_name):
+    """ Статистика валидации кластера для журнала запуска и координатора """
+    return {
+        'exit_code': MySQL_cluster.exit_codes[cluster_name],
+        'val_duration': MySQL_cluster.val_durations[cluster_name],
+        'restor_duration': MySQL_cluster.restor_durations[cluster_name],
+        'start_duration': MySQL_cluster.start_durations[cluster_name],
+        'dump_duration': MySQL_cluster.dump_durations[cluster_name],
+        'size': MySQL_cluster.sizes[cluster_name],
+        'backup_bytes': MySQL_cluster.backup_bytes.get(cluster_name, 0),
+    }
+
+def restore_stats(cluster_name, detail):
+    """ Статистика кластера, валидированного в прерванном запуске (этап 'done' журнала) или агентом """
+    MySQL_cluster.exit_codes[cluster_name] = detail['exit_code']
+    MySQL_cluster.val_durations[cluster_name] = detail['val_duration']
+    MySQL_cluster.restor_durations[cluster_name] = detail['restor_duration']
+    MySQL_cluster.start_durations[cluster_name] = detail['start_duration']
+    MySQL_cluster.dump_durations[cluster_name] = detail['dump_duration']
+    MySQL_cluster.sizes[cluster_name] = detail['size']
+    MySQL_cluster.backup_bytes[cluster_name] = detail.get('backup_bytes', 0)
+
+def record_history(cluster_name):
+    """ Запись длительностей валидации кластера в историю для прогнозов планировщика """
+    history = Run_history()
     try:
-        if cluster_instance.copy_backup_in_datadir():
-            logging.info(f"Copying backup files '{cluster_name}' to data directory '{cluster_instance.mysql_data_dir}' completed successfully ")
-    except subprocess.CalledProcessError as e:
-        exit_code = 1
-        logging.error(e)
+        history.record(cluster_name, MySQL_cluster.backup_bytes.get(cluster_name, 0), cluster_stats(cluster_name))
+    finally:
+        history.close()
 
-    # Восстановление данных
+def plan_clusters(cluster_names, coordinator=False):
+    """
+    Порядок валидации: по приоритету и прогнозу длительности (размер бэкапа и история) в окне VALIDATION_WINDOW.
+    Не помещающиеся в окно кластеры откладываются. Возвращает кластеры в порядке валидации.
+    coordinator - кластеры выполняют COORDINATOR_AGENTS агентов одновременно. Измеренный размер бэкапа
+    сохраняется в MySQL_cluster.backup_bytes и используется в отчете без повторного du.
+    Кластер без директории бэкапа (не примонтирована) помечается неуспешным и не планируется, а на координаторе,
+    где директорий бэкапов может не быть, планируется без размера - проверят агенты
+    """
+    history = Run_history()
     try:
-        start_time = time.time()
-        if cluster_instance.xtrabackup_restore():
-            end_time = time.time()
-            restor_duration = end_time - start_time
-            logging.info(f"Cluster '{cluster_name}' recovery completed successfully")
-    except subprocess.CalledProcessError as e:
-        exit_code = 1
-        logging.error(e)
+        predictions = {}
+        for cluster_name in cluster_names:
+            try:
+                backup_bytes = MySQL_cluster(cluster_name).get_backup_bytes()
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired, ValueError) as e:
+                logging.error(e)
+                backup_bytes = 0
+            except OSError as e:
+                if not coordinator:
+                    MySQL_cluster.exit_codes[cluster_name] = 1
+                    logging.error(f"Cluster '{cluster_name}' failed: backup is not available: {e}")
+                    continue
+                logging.warning(f"Cluster '{cluster_name}' is planned without its backup size: {e}")
+                backup_bytes = 0
+            predictions[cluster_name] = history.predict(cluster_name, backup_bytes)
+        lanes = PLANNER_LANES or (COORDINATOR_AGENTS if coordinator else MAX_PARALLEL_INSTANCES if MULTI_INSTANCE else 1)
+        planned, deferred, finish = plan_order(predictions, window=VALIDATION_WINDOW, lanes=lanes, overdue=history.overdue())
+        history.defer(deferred)
+    finally:
+        history.close()
+    for cluster_name in deferred:
+        MySQL_cluster.deferred[cluster_name] = 1
+        logging.warning(f"Cluster '{cluster_name}' deferred: predicted {format_time(predictions[cluster_name])} "
+                        f"does not fit the validation window")
+    logging.info("Validation plan: " + ", ".join(f"{cluster_name} ~{format_time(predictions[cluster_name])}" for cluster_name in planned)
+                 + f", expected to finish in {format_time(finish)}")
+    return planned
 
-    # Запуск сервиса
+def remove_validation_profile():
+    """ Удаление профиля валидации сервиса mysql по окончании работы (в том числе прерванной) """
+    if MULTI_INSTANCE:
+        # у экземпляров свои конфигурационные файлы, профиль сервиса не записывался
+        return
     try:
-        if cluster_instance.start_cluster():
+        MySQL_cluster.remove_validation_profile()
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        logging.error(f"Validation profile '{VALIDATION_PROFILE_FILE}' not removed: {e}")
+
+def pending_clusters(cluster_names, journal):
+    """ Кластеры, не завершенные в продолжаемом запуске; статистика завершенных берется из журнала """
+    if journal is None:
+        return cluster_names
+    pending = []
+    for cluster_name in cluster_names:
+        detail = journal.stage_detail(cluster_name, 'done')
+        if detail is None:
+            pending.append(cluster_name)
+        else:
+            restore_stats(cluster_name, detail)
+            logging.info(f"Cluster '{cluster_name}' already validated in run {journal.run_id}, skipped")
+    return pending
+
+def validate_cluster(cluster_instance, staged_future=None, dump_processes=None, incremental=False, journal=None, sample=False):
+    """
+    Полный цикл валидации одного кластера: остановка, очистка, восстановление, запуск, дамп, остановка, очистка.
+    staged_future - результат stage_cluster (бэкап уже скопирован и распакован в промежуточной директории).
+    incremental - читаются только изменившиеся с прошлой валидации таблицы и ротационная выборка неизменных.
+    journal - журнал запуска (Run_journal): этапы и снятые дампы записываются, при продолжении прерванного запуска
+    восстановленная директория данных того же бэкапа используется повторно, дамп снимается только с оставшихся задач.
+    sample - выборочная проверка (Sampling_engine) вместо полного дампа.
+    Возвращает код завершения
+    """
+    cluster_name = cluster_instance.cluster_name
+    val_start_time = time.time()
+    logging.info(f"Working with the '{cluster_name}' cluster'")
+    reused = journal is not None and journal.datadir_reusable(cluster_instance)
+    if reused:
+        # директория данных уже восстановлена из этого же бэкапа в прерванном запуске
+        exit_code, restor_duration = 0, 0
+        if staged_future is not None:
+            discard_staged(cluster_instance, staged_future)
+        logging.info(f"Data directory '{cluster_instance.mysql_data_dir}' already restored from the same backup, restore skipped")
+    else:
+        exit_code, restor_duration = restore_cluster(cluster_instance, staged_future)
+        if journal is not None and exit_code == 0:
+            journal.stage_done(cluster_name, 'restored', datadir_fingerprint(cluster_instance))
+
+    # Запуск сервиса (с профилем валидации, если VALIDATION_PROFILE)
+    start_time = time.time()
+    try:
+        if reused and cluster_instance.status_cluster():
+            logging.info(f"Service 'mysql' - cluster '{cluster_name}' is already running")
+        elif cluster_instance.start_cluster():
             logging.info(f"Service 'mysql' - cluster '{cluster_name}' start successful")
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
         exit_code = 1
         logging.error(e)
+    start_duration = time.time() - start_time
 
-    # Снятие дампа в нескольких паралельных процессах
+    # Опись таблиц (файлы бэкапа + один запрос к information_schema, кэш по идентификатору бэкапа) для всех этапов
+    progress.stage(cluster_name, 'inventory')
     try:
-        dbs_tables = cluster_instance.get_tables_in_dbs()
-        # базовые параметры для снятия дампа
-        parametrs = [
-            "--no-create-info",
-            "--single-transaction",
-            "--set-gtid-purged=OFF",
-            "--skip-triggers",
-            "--compact", 
-            "--complete-insert"
-            ]
-        # снятие только дампа схемы
-        if cluster_instance.start_dump(dump_filename=f"schema_only_{cluster_name}.dump"): # для тестирования, добавить параметр dump_filename='schema_only_crm_prod.dump'
-            logging.info(f"Taking dump schema from cluster '{cluster_name}' completed successfully")
-        # циклический вызов метода снятия дампа с таблиц
-        nproc = cluster_instance.get_nproc()
-        workers = tasks_building(dbs_tables, parametrs)
-        with multiprocessing.Pool(processes=nproc) as pool:
-            results_map = pool.map(start_dump, workers)
-    except subprocess.CalledProcessError as e:
+        inventory = load_inventory(cluster_instance)
+        logging.info(f"Inventory of cluster '{cluster_name}': {len(inventory.tables)} tables in {len(inventory.databases())} databases")
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, ValueError) as e:
         exit_code = 1
         logging.error(e)
+        # экземпляр не ответил - опись только по файлам бэкапа, без кэширования
+        inventory = load_inventory(cluster_instance, live=False, use_cache=False)
+
+    # Снятие дампа в нескольких паралельных процессах (или выборочная проверка)
+    dump_start_time = time.time()
+    if sample:
+        # выборочная проверка вместо дампа: случайные и очередные сегменты таблиц, CHECK TABLE по ротации
+        try:
+            results_map = Sampling_engine(cluster_instance, inventory).run()
+            for result in results_map:
+                for error in result['errors']:
+                    exit_code = 1
+                    logging.error(f"Sample check of table '{result['table']}' DB '{result['db']}': {error}")
+                if result.get('cycle_completed'):
+                    logging.info(f"Table '{result['table']}' DB '{result['db']}' fully covered by sample checks, coverage cycle restarted")
+            logging.info(f"Sample check of cluster '{cluster_name}': {len(results_map)} tables, "
+                         f"{sum(result['sampled'] for result in results_map)} of {sum(result['segments'] for result in results_map)} segments, "
+                         f"{sum(result['rows'] for result in results_map)} rows read, "
+                         f"{sum(1 for result in results_map if result['errors'])} tables with errors")
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            exit_code = 1
+            logging.error(e)
+    else:
+        try:
+            # поток размеров таблиц из описи для планирования: крупные таблицы (в пределах окна SCHEDULE_WINDOW) первыми
+            table_source = inventory.iter_sizes('backup' if DUMP_SIZE_SOURCE == 'backup' else 'instance')
+            if incremental:
+                # инкрементальный режим: изменившиеся таблицы и ротационная выборка неизменных
+                validation_state = Validation_state()
+                fingerprints = table_fingerprints(inventory.sizes('backup'), inventory.metadata())
+                changed, sampled = validation_state.select_tables(cluster_name, fingerprints)
+                selected = changed | sampled
+                table_source = ((db, table, info) for db, table, info in table_source if (db, table) in selected)
+                logging.info(f"Incremental validation of cluster '{cluster_name}': {len(changed)} changed, {len(sampled)} sampled, "
+                             f"{len(fingerprints) - len(changed) - len(sampled)} skipped tables")
+            # базовые параметры для снятия дампа
+            parametrs = [
+                "--no-create-info",
+                "--single-transaction",
+                "--set-gtid-purged=OFF",
+                "--skip-triggers",
+                "--compact",
+                "--complete-insert"
+                ]
+            # снятие только дампа схемы
+            if cluster_instance.start_dump(dump_filename=f"schema_only_{cluster_name}.dump"): # для тестирования, добавить параметр dump_filename='schema_only_crm_prod.dump'
+                logging.info(f"Taking dump schema from cluster '{cluster_name}' completed successfully")
+            # циклический вызов метода снятия дампа с таблиц
+            nproc = dump_processes if dump_processes is not None else cluster_instance.get_nproc()
+            # архив кластера: дампы потоково сжимаются в один индексированный файл, несжатые файлы на диск не пишутся
+            # результаты задач, завершенных в прерванном запуске (их члены уже в архиве)
+            done_tasks = journal.done_tasks(cluster_name) if reused else {}
+            archive_path = create_archive(os.path.join(TRUE_DUMP_DIR, f"{cluster_name}.dumps"), keep=bool(done_tasks)) \
+                if TRUE_DUMP and DUMP_ARCHIVE else None
+            streaming = STREAM_DUMP or archive_path is not None
+            # байты, прочитанные из вывода дампов по ходу задач: процессы пула получают счетчик при запуске, потоки - аргументом
+            streamed = multiprocessing.Value('q', 0)
+            dump_function = partial(stream_dump, archive=archive_path or TRUE_DUMP, streamed=streamed if ADAPTIVE_CONCURRENCY else None) \
+                if streaming else start_dump
+            # ошибка задачи возвращается ее результатом (с повторами временных ошибок), пул работает до конца очереди
+            dump_function = partial(isolated_dump, dump_function)
+            native = READER_ENGINE == 'native' and pymysql is not None and not TRUE_DUMP
+            # ход дампа: доли таблиц (диапазон - 1 / chunks таблицы) и байты, итоги известны по окончании потока таблиц
+            progress.stage(cluster_name, 'dump')
+
+            def discovered(tables):
+                count, size = 0, 0
+                for db, table, info in tables:
+                    count, size = count + 1, size + info['size']
+                    yield db, table, info
+                if not native:
+                    progress.total(cluster_name, tables=count, bytes=size)
+
+            def pending(tasks):
+                # задачи, завершенные в прерванном запуске, не повторяются и сразу учитываются в ходе
+                for task in tasks:
+                    if task_key(task) in done_tasks:
+                        progress.advance(cluster_name, tables=len(task['tables']) / task.get('chunks', 1), bytes=task['size'])
+                        continue
+                    yield task
+
+            # задачи создаются лениво по мере чтения описи, крупные таблицы делятся на диапазоны ключа при планировании
+            tasks = pending(iter_tasks(discovered(table_source), parametrs + cluster_instance.client_params(),
+                                       result_file=TRUE_DUMP and not streaming,
+                                       chunks_of=lambda db, table: cluster_instance.get_table_chunks(db, table, TABLE_CHUNKS,
+                                                                                                    inventory.chunk_key(db, table))))
+            if done_tasks:
+                logging.info(f"Resuming dump of cluster '{cluster_name}': {len(done_tasks)} tasks already done")
+            if READER_ENGINE == 'native' and pymysql is None:
+                logging.warning("Native reader engine requires pymysql, falling back to mysqldump")
+            if native:
+                # чтение таблиц через постоянные подключения, без запуска mysqldump на каждую таблицу
+                # читатель возвращает результаты только по завершении: ход не измеряется, этап не считается зависшим
+                results_map = read_tables(tasks, nproc, cluster_instance.mysql_socket)
+                for result in results_map:
+                    stage_metrics.add(cluster_name, 'dump_table', {'wall': result['duration']}, db=result['db'], tables=[result['table']])
+                failed_tables = [result for result in results_map if 'error' in result]
+                for result in failed_tables:
+                    logging.error(f"Reading table '{result['table']}' DB '{result['db']}' failed: {result['error']}")
+                if failed_tables:
+                    exit_code = 1
+                logging.info(f"Read {len(results_map)} tables of cluster '{cluster_name}': {sum(result['rows'] for result in results_map)} rows")
+            else:
+                # долгая задача не считается зависшей, пока из ее вывода читаются байты
+                progress.watch(cluster_name, lambda: streamed.value)
+
+                def completed(result, metrics):
+                    progress.advance(cluster_name, tables=len(metrics['tables']) / metrics.get('chunks', 1), bytes=metrics['size'])
+                    # завершенная задача сразу записывается в журнал, при продолжении запуска она не повторяется
+                    if journal is not None and not (isinstance(result, dict) and 'error' in result):
+                        journal.task_done(cluster_name, task_key(metrics), result)
+
+                # chunksize=1 - задачи выдаются процессам строго по очереди, без разбиения на порции
+                if ADAPTIVE_CONCURRENCY:
+                    # количество одновременных дампов меняется по ходу работы (AIMD), начиная с nproc
+                    controller = Concurrency_controller(nproc, cluster_instance.get_nproc(), cluster_instance)
+                    measured = run_adaptive(tasks, dump_function, controller, completed=completed, requeue=requeue_dump)
+                else:
+                    # каждая задача выполняется с замером ресурсов (metrics.measure), метрики попадают в stage_metrics
+                    # задача после временной ошибки ставится в очередь заново, процесс пула не ждет паузу перед повтором
+                    measured, feed = [], Task_feed(tasks)
+                    with multiprocessing.Pool(processes=nproc, initializer=attach_counter, initargs=(streamed,)) as pool:
+                        for result, metrics in pool.imap_unordered(partial(measure, dump_function), feed, chunksize=1):
+                            retry = requeue_dump(result)
+                            if retry is not None:
+                                feed.requeue(retry)
+                                continue
+                            measured.append((result, metrics))
+                            completed(result, metrics)
+                            feed.finished()
+                for result, metrics in measured:
+                    stage_metrics.add(cluster_name, 'dump_table', metrics)
+                results_map = [result for result, metrics in measured] + list(done_tasks.values())
+                outcomes = Counter(result['status'] for result in results_map)
+                for result in results_map:
+                    if result['status'] != 'ok':
+                        logging.error(f"Dump of tables {', '.join(result['tables'])} DB '{result['db']}' {result['status']} "
+                                      f"after {result['attempts']} attempts: {result['error']}")
+                if outcomes['failed'] or outcomes['timeout']:
+                    exit_code = 1
+                logging.info(f"Dump tasks of cluster '{cluster_name}': " + ", ".join(f"{status} - {count}" for status, count in sorted(outcomes.items())))
+                if archive_path is not None:
+                    index = write_index(archive_path, [result['member'] for result in results_map if 'member' in result])
+                    logging.info(f"Dump archive of cluster '{cluster_name}': {len(index['tables'])} tables in '{archive_path}' "
+                                 f"({os.path.getsize(archive_path)} bytes)")
+                if streaming:
+                    results_map = merge_chunk_results(results_map)
+                    logging.info(f"Streamed dump of cluster '{cluster_name}': {sum(result['bytes'] for result in results_map)} bytes, "
+                                 f"~{sum(result['rows'] for result in results_map)} rows")
+            if incremental:
+                # запоминаются отпечатки прочитанных без ошибок таблиц
+                checksums, failed_tables = {}, set()
+                for result in results_map:
+                    if not isinstance(result, dict):
+                        continue
+                    tables = [result['table']] if 'table' in result else result['tables']
+                    if 'error' in result:
+                        failed_tables.update((result['db'], table) for table in tables)
+                    elif len(tables) == 1 and 'checksum' in result:
+                        checksums[(result['db'], tables[0])] = result['checksum']
+                validation_state.record(cluster_name, {key: fingerprint for key, fingerprint in fingerprints.items()
+                                                       if key in changed | sampled and key not in failed_tables}, checksums)
+                validation_state.close()
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            exit_code = 1
+            logging.error(e)
+
+    dump_duration = time.time() - dump_start_time
+    logging.info(f"Cluster '{cluster_name}' started in {format_time(start_duration)}, dump taken in {format_time(dump_duration)} "
+                 f"(validation profile: {'on' if VALIDATION_PROFILE else 'off'})")
+
+    # Контрольные суммы содержимого таблиц и сравнение с предыдущим запуском (или с манифестом источника)
+    if CHECKSUM_TABLES:
+        progress.stage(cluster_name, 'checksums')
+        try:
+            previous_manifest = load_manifest(manifest_path(cluster_name))
+            manifest = Checksum_engine(cluster_instance, inventory=inventory).build_manifest(previous_manifest)
+            if CHECKSUM_BASELINE_DIR is not None:
+                report = diff_manifests(load_manifest(manifest_path(cluster_name, CHECKSUM_BASELINE_DIR)), manifest, strict=True)
+            else:
+                report = diff_manifests(previous_manifest, manifest)
+            save_manifest(manifest_path(cluster_name), manifest)
+            statuses = Counter(table['status'] for table in report.values())
+            logging.info(f"Checksums of cluster '{cluster_name}': " + ", ".join(f"{status} - {count}" for status, count in sorted(statuses.items())))
+            for table, result in report.items():
+                if result['status'] == 'corrupt':
+                    exit_code = 1
+                    logging.error(f"Table '{table}' content does not match the baseline, chunks: {result['chunks']}")
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            exit_code = 1
+            logging.error(e)
 
     # Отключение сервиса
     try:
         if cluster_instance.stop_cluster():
             logging.info(f"Service 'mysql' - cluster '{cluster_name}' stop successful")
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
         exit_code = 1
         logging.error(e)
 
@@ -99,7 +528,7 @@ for cluster_name in CLUSTER_NAMES:
     try:
         if cluster_instance.clear_data_dir():
             logging.info(f"Successfully cleared '{cluster_instance.mysql_data_dir}'")
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
         exit_code = 1
         logging.error(e)
 
@@ -109,15 +538,156 @@ for cluster_name in CLUSTER_NAMES:
     cluster_instance.val_durations[cluster_name] = format_time(val_duration)
     cluster_instance.exit_codes[cluster_name] = exit_code
     cluster_instance.restor_durations[cluster_name] = format_time(restor_duration)
+    cluster_instance.start_durations[cluster_name] = format_time(start_duration)
+    cluster_instance.dump_durations[cluster_name] = format_time(dump_duration)
+    # размер бэкапа измерен планировщиком, du выполняется только если кластер не планировался (агент)
     cluster_instance.sizes[cluster_name] = cluster_instance.get_size_cluster()
+    record_history(cluster_name)
+    progress.finish(cluster_name, exit_code)
+    if journal is not None:
+        journal.stage_done(cluster_name, 'done', cluster_stats(cluster_name))
+    return exit_code
+
+def run_sequential(cluster_names, incremental=False, journal=None, sample=False):
+    """
+    Последовательная валидация кластеров на одном сервисе mysql.
+    Конвейер: пока текущий кластер восстанавливается и дампится, следующий копируется и распаковывается.
+    Один поток подготовки - вперед готовится не более одного кластера, чтобы не занимать лишнее место на диске
+    """
+    cluster_names = pending_clusters(cluster_names, journal)
+    staging_executor = ThreadPoolExecutor(max_workers=1) if PIPELINE_STAGING else None
+    staged_clusters = {}
+    # директория данных, восстановленная в прерванном запуске, не требует подготовки бэкапа
+    if PIPELINE_STAGING and cluster_names and not (journal is not None and journal.datadir_reusable(MySQL_cluster(cluster_names[0]))):
+        staged_clusters[cluster_names[0]] = submit_staging(staging_executor, cluster_names[0])
+
+    for i, cluster_name in enumerate(cluster_names):
+        cluster_instance = MySQL_cluster(cluster_name)
+        if PIPELINE_STAGING and i + 1 < len(cluster_names):
+            staged_clusters[cluster_names[i + 1]] = submit_staging(staging_executor, cluster_names[i + 1])
+        staged_future = staged_clusters.pop(cluster_name, None)
+        try:
+            validate_cluster(cluster_instance, staged_future=staged_future, incremental=incremental,
+                             journal=journal, sample=sample)
+        except Exception as e:
+            # ошибка одного кластера не прерывает валидацию остальных, отчет и журнал формируются
+            MySQL_cluster.exit_codes[cluster_name] = 1
+            logging.error(e)
+            if staged_future is not None:
+                discard_staged(cluster_instance, staged_future)
+
+    if staging_executor is not None:
+        staging_executor.shutdown()
+
+def run_multi_instance(cluster_names, incremental=False, journal=None, sample=False):
+    """
+    Параллельная валидация кластеров на отдельных экземплярах mysqld.
+    Одновременно работает не более MAX_PARALLEL_INSTANCES экземпляров в пределах бюджета памяти INSTANCES_MEMORY_LIMIT
+    """
+    cluster_names = pending_clusters(cluster_names, journal)
+    memory_budget = Memory_budget(INSTANCES_MEMORY_LIMIT)
+    # процессы дампа делятся между одновременно работающими экземплярами
+    dump_processes = max(1, MySQL_cluster.get_nproc() // MAX_PARALLEL_INSTANCES)
+
+    def validate_instance(cluster_name):
+        cluster_instance = MySQL_instance(cluster_name)
+        memory_budget.acquire(cluster_instance.memory)
+        try:
+            return validate_cluster(cluster_instance, dump_processes=dump_processes, incremental=incremental, journal=journal,
+                                    sample=sample)
+        finally:
+            memory_budget.release(cluster_instance.memory)
+
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_INSTANCES) as executor:
+        for cluster_name, future in [(name, executor.submit(validate_instance, name)) for name in cluster_names]:
+            try:
+                future.result()
+            except Exception as e:
+                MySQL_cluster.exit_codes[cluster_name] = 1
+                logging.error(e)
+
+def validate_job(cluster_name, incremental=False, sample=False):
+    """ Задание агента распределенной валидации: полный цикл валидации кластера, возвращает его статистику """
+    cluster_instance = MySQL_instance(cluster_name) if MULTI_INSTANCE else MySQL_cluster(cluster_name)
+    validate_cluster(cluster_instance, incremental=incremental, sample=sample)
+    return cluster_stats(cluster_name)
+
+def run_coordinator(cluster_names, resume=False):
+    """ Координатор: очередь кластеров для агентов, статистика агентов собирается в общий отчет """
+    queue = Job_queue()
+    queue.start(cluster_names, resume=resume)
+    for job in Coordinator(queue).run():
+        if job['result'] is not None and 'val_duration' in job['result']:
+            restore_stats(job['cluster'], job['result'])
+            record_history(job['cluster'])
+            logging.info(f"Cluster '{job['cluster']}' validated by agent {job['agent']} after {job['attempts']} attempts")
+        else:
+            MySQL_cluster.exit_codes[job['cluster']] = 1
+            logging.error(f"Cluster '{job['cluster']}' failed: {(job['result'] or {}).get('error', 'no result')}")
+    queue.close()
 
-# Формирование файла отчета по всем итерациям (по всем бэкапам)
-try:
-    if MySQL_cluster.output_stats():
-        logging.info(f"Report and monitoring files have been generated")
-except Exception as e:
-    logging.error(e)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validation of xtrabackup backups by restore and dump")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--incremental', action='store_true',
+                      help="read only tables changed since the last validation plus a rotating sample of unchanged ones")
+    mode.add_argument('--sample', action='store_true',
+                      help="check random and rolling key ranges of every table instead of a full dump")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue the last interrupted run: skip finished clusters and tables, reuse a restored data directory")
+    role = parser.add_mutually_exclusive_group()
+    role.add_argument('--coordinator', action='store_true',
+                      help="serve the cluster queue to agents on restore hosts and collect their results")
+    role.add_argument('--agent', metavar='URL', help="validate clusters leased from the coordinator at URL")
+    args = parser.parse_args()
 
-logging.info(f"Script execution completed")
+    # файл хода валидации в STATS_DIR (и HTTP/unix-сокет, если заданы) обновляется в фоне до конца работы
+    progress.start()
 
+    if args.agent:
+        # агент: кластеры берутся из очереди координатора, отчет формирует координатор
+        try:
+            Agent(args.agent, partial(validate_job, incremental=args.incremental, sample=args.sample),
+                  exclusive=not MULTI_INSTANCE).run()
+        finally:
+            remove_validation_profile()
+            progress.stop()
+        raise SystemExit(0)
+
+    logging.info(f"Running validation script. List of clusters: {', '.join(CLUSTER_NAMES)}")
+
+    # журнал запуска: завершенные этапы кластеров и снятые дампы таблиц (у координатора - очередь заданий)
+    journal = None if args.coordinator else Run_journal()
+    if journal is not None:
+        journal.start(CLUSTER_NAMES, resume=args.resume)
+        logging.info(f"{'Resuming' if journal.resumed else 'Starting'} validation run {journal.run_id}")
+
+    # заведомо поврежденные бэкапы отсеиваются до копирования
+    cluster_names = preflight_clusters(CLUSTER_NAMES) if PREFLIGHT_CHECK else CLUSTER_NAMES
+    # критичные кластеры первыми, не помещающиеся в окно валидации откладываются
+    cluster_names = plan_clusters(cluster_names, coordinator=args.coordinator)
+    progress.plan(cluster_names)
+
+    if args.coordinator:
+        run_coordinator(cluster_names, resume=args.resume)
+    elif MULTI_INSTANCE:
+        run_multi_instance(cluster_names, incremental=args.incremental, journal=journal, sample=args.sample)
+    else:
+        try:
+            run_sequential(cluster_names, incremental=args.incremental, journal=journal, sample=args.sample)
+        finally:
+            # штатный запуск mysql на хосте не должен получить skip-grant-tables после валидации
+            remove_validation_profile()
+    if journal is not None:
+        journal.finish()
+        journal.close()
+    progress.stop()
+
+    # Формирование файла отчета по всем итерациям (по всем бэкапам)
+    try:
+        if MySQL_cluster.output_stats() and stage_metrics.output():
+            logging.info("Report and monitoring files have been generated")
+    except Exception as e:
+        logging.error(e)
 
+    logging.info("Script execution completed")